@@ -1,32 +1,106 @@
 """Library of functions for behavior analysis
+    * find_BORIS_header - finds the header row of each BORIS table
+    * read_BORIS_file - reads every table of a BORIS csv
     * import_behavior_data - inputs data from BORIS csv
+    * split_behavior_data - splits events by observation and subject
+    * nearest_index - finds the closest sample to each time
+    * event_times - onset times of a behavior
+    * peri_event_zscore - z-scores the signal around every event
+    * zscore_results - z-scores each channel around each behavior
+    * draw_zscore - draws the z-scores around a behavior
+    * zscore_figures - describes the z-score plots
     * plot_zscore - plots z-score for each behavior occurance
 """
 import sys
-from statistics import mean
+import io
+import csv
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import fpho_session
+import fpho_align
+import fpho_plot
 
+# Header names of the event time column in seconds, for raw BORIS
+# exports and for pre-formatted behavior files
+BORIS_TIME_COLUMNS = ('Time', 'Time in Video (sec)')
 
-def import_behavior_data(BORIS_filename, timestamp_filename):
-    """Takes a file name, returns a dataframe of parsed data
+# Default z-score channels, baseline and window in seconds from the
+# event, as in the MATLAB Zscore_wdriver.m
+ZSCORE_CHANNELS = ['f1GreenGreen']
+ZSCORE_BASELINE = (-3, -2)
+ZSCORE_WINDOW = (-3, 5)
+
+# Columns of the dataframe returned by import_behavior_data
+BEHAVIOR_COLUMNS = ['Time (total msec)', 'Time', 'Subject', 'Behavior',
+                    'Status', 'Observation id']
+
+
+def find_BORIS_header(lines):
+    """Takes the lines of a BORIS csv, returns where each table starts
+
+        Exports of several observations repeat the preamble and
+        header for each one, so every header row is found.
+
+        Parameters
+        ----------
+        lines: list of strings
+                lines of the BORIS csv
+
+        Returns:
+        --------
+        headers: list of tuples
+                (line index of the header row, index of the line
+                after the last data row, observation id or None)
+                for each table
+    """
+    headers = []
+    observation = None
+    preamble = None
+    for i, line in enumerate(lines):
+        # Only split lines that can be a preamble or header row
+        if 'Observation id' not in line and 'Behavior' not in line:
+            continue
+        fields = [field.strip() for field in next(csv.reader([line]))]
+        if len(fields) > 1 and fields[0] == 'Observation id':
+            # Preamble of the next observation ends the table before
+            if headers and headers[-1][1] is None:
+                headers[-1][1] = i
+            observation = fields[1]
+            preamble = i
+        elif ('Behavior' in fields
+              and any(name in fields for name in BORIS_TIME_COLUMNS)):
+            if headers and headers[-1][1] is None:
+                headers[-1][1] = preamble if preamble is not None else i
+            headers.append([i, None, observation])
+            observation = None
+            preamble = None
+    if headers and headers[-1][1] is None:
+        headers[-1][1] = len(lines)
+    return [tuple(header) for header in headers]
+
+
+def read_BORIS_file(BORIS_filename):
+    """Takes a file name, returns the events of every table in it
 
         Parameters
         ----------
         BORIS_filename: string
-                        The path to the CSV file
+                The path to the CSV file, either a raw BORIS
+                export or a pre-formatted file with a Time in
+                Video (sec) column
 
         Returns:
         --------
-        behaviorData: pandas dataframe
-                contains:
-                     Time(total msec), Time(sec), Subject,
-                     Behavior, Status
-        """
+        BORISData: pandas dataframe
+                all columns of every table, with the time column
+                renamed Time and an Observation id column. Tables
+                without an observation id use the file name.
+    """
     # Open file, catch errors
     try:
-        BORISData = pd.read_csv(BORIS_filename, header=15)  # starts at data
+        with open(BORIS_filename, 'r', newline='') as f:
+            lines = f.readlines()
     except FileNotFoundError:
         print("Could not find file: " + BORIS_filename)
         sys.exit(1)
@@ -34,54 +108,389 @@ def import_behavior_data(BORIS_filename, timestamp_filename):
         print("Could not access file: " + BORIS_filename)
         sys.exit(2)
 
-    # Drop unecessary columns
-    behaviorData = BORISData.drop(['Media file path', 'Total length', 'FPS',
-                                   'Behavioral category', 'Comment'], axis=1)
+    headers = find_BORIS_header(lines)
+    if len(headers) == 0:
+        print("Could not find a BORIS header row in file: " + BORIS_filename)
+        sys.exit(1)
+
+    default_observation = os.path.splitext(
+        os.path.basename(BORIS_filename))[0]
+    tables = []
+    for start, stop, observation in headers:
+        table = pd.read_csv(io.StringIO(''.join(lines[start:stop])),
+                            skip_blank_lines=True)
+        table.columns = [str(name).strip() for name in table.columns]
+        time_name = next(name for name in BORIS_TIME_COLUMNS
+                         if name in table.columns)
+        table = table.rename(columns={time_name: 'Time'})
+        # Blank separator rows are read as all empty
+        table = table.dropna(subset=['Time'])
+        if 'Observation id' not in table.columns:
+            table['Observation id'] = (observation if observation
+                                       else default_observation)
+        tables.append(table)
 
-    # Find timestamp corresponding to time 0sec of video
+    BORISData = pd.concat(tables, ignore_index=True)
     try:
-        timestamp_df = pd.read_csv(timestamp_filename, nrows=1)
-    except FileNotFoundError:
-        print("Could not find file: " + timestamp_filename)
+        BORISData['Time'] = BORISData['Time'].astype(np.float64)
+    except ValueError:
+        print("Could not parse event times in file: " + BORIS_filename)
         sys.exit(1)
-    except PermissionError:
-        print("Could not access file: " + timestamp_filename)
-        sys.exit(2)
-    timestamp = timestamp_df.to_numpy()[0][0]
-
-    # Add time in msec to dataframe
-    sec_times = behaviorData['Time'].tolist()
-    msec_times_day = []
-    # convert to msec, adjust to timestamp
-    for sec_time in sec_times:
-        msec_time = sec_time*1000
-        msec_adjusted = (msec_time + timestamp)
-        msec_times_day.append(msec_adjusted)
-    behaviorData.insert(0, 'Time (total msec)', msec_times_day)
+    return BORISData
+
+
+def import_behavior_data(BORIS_filename, timestamp_filename, fps=None):
+    """Takes a file name, returns a dataframe of parsed data
+
+        Parameters
+        ----------
+        BORIS_filename: string
+                        The path to the CSV file, see read_BORIS_file
+        timestamp_filename: string
+                        The path to the video timestamp file
+        fps: float
+                        frame rate BORIS counts video seconds in,
+                        default None, see fpho_align.video_fps
+
+        Returns:
+        --------
+        behaviorData: pandas dataframe
+                contains:
+                     Time(total msec), Time(sec), Subject,
+                     Behavior, Status, Observation id
+        """
+    BORISData = read_BORIS_file(BORIS_filename)
+
+    # Keep the event columns, columns missing from the file are empty
+    behaviorData = BORISData.reindex(columns=BEHAVIOR_COLUMNS[1:])
+
+    # Bonsai time of every video frame
+    frame_times = fpho_align.read_video_timestamps(timestamp_filename)
+    if fps is None:
+        fps = fpho_align.video_fps(BORISData)
+
+    # Add time in msec to dataframe, from the frame each event is on
+    behaviorData.insert(0, 'Time (total msec)',
+                        fpho_align.video_to_bonsai(
+                            behaviorData['Time'].to_numpy(),
+                            frame_times, fps))
 
     return(behaviorData)
 
 
-def plot_zscore(behaviorData, zplot_filename):
-    """Takes a dataframe and creates plot of z-scores for
-        each time a select behavior occurs with the avg
-        z-score and SEM
+def split_behavior_data(behaviorData):
+    """Splits behavior data into one event table per observation
+        and subject
+
+        Parameters
+        ----------
+        behaviorData: pandas dataframe
+                from import_behavior_data
+
+        Returns:
+        --------
+        events: dictionary
+                dataframe of events keyed by (observation id,
+                subject), subject is None for events without one.
+                Events keep their order in the file.
+    """
+    events = {}
+    groups = behaviorData.groupby(['Observation id', 'Subject'],
+                                  sort=False, dropna=False)
+    for (observation, subject), table in groups:
+        if pd.isna(subject):
+            subject = None
+        events[(observation, subject)] = table.reset_index(drop=True)
+    return events
+
+
+def nearest_index(times, values):
+    """Finds the index of the closest time for each value
+
+        Parameters
+        ----------
+        times: numpy array
+                sorted times
+        values: numpy array
+                times to look up
+
+        Returns:
+        --------
+        indexes: numpy array
+                index into times closest to each value, the
+                earlier one on ties
+    """
+    values = np.asarray(values, dtype=np.float64)
+    indexes = np.clip(np.searchsorted(times, values), 1, len(times) - 1)
+    indexes -= values - times[indexes - 1] <= times[indexes] - values
+    return indexes
+
+
+def event_times(behaviorData, behavior=None):
+    """Takes behavior data, returns the onset times of a behavior
+
+        Parameters
+        ----------
+        behaviorData: pandas dataframe
+                from import_behavior_data
+        behavior: string
+                name of the behavior, default None for all events
+
+        Returns:
+        --------
+        times: numpy array
+                Time (total msec) of each POINT or START event
+    """
+    events = behaviorData
+    if behavior is not None:
+        events = events[events['Behavior'] == behavior]
+    events = events[events['Status'].isna()
+                    | events['Status'].isin(['POINT', 'START'])]
+    return events['Time (total msec)'].to_numpy(dtype=np.float64)
+
+
+def peri_event_zscore(signal, signal_time, events, baseline=ZSCORE_BASELINE,
+                      window=ZSCORE_WINDOW):
+    """Z-scores the signal around every event
+
+        Each window is z-scored against the mean of its baseline and
+        the standard deviation of the whole signal. Events whose
+        window runs past either end of the recording are left out.
+
+        Parameters
+        ----------
+        signal: numpy array
+                fluorescence data
+        signal_time: numpy array
+                sorted time of each sample in msec
+        events: numpy array
+                event times in msec
+        baseline: tuple of numbers
+                (start, stop) of the baseline in seconds from the
+                event, default ZSCORE_BASELINE
+        window: tuple of numbers
+                (start, stop) of the window in seconds from the
+                event, default ZSCORE_WINDOW
+
+        Returns:
+        --------
+        result: dictionary
+                time: window time in seconds from the event
+                zscore: numpy array of shape (events, time)
+                mean, sem: mean and SEM of zscore for each time
+                event_index: sample index of each kept event
+                kept: boolean for each event, True if its window
+                fits in the recording
+    """
+    signal = np.asarray(signal)
+    signal_time = np.asarray(signal_time, dtype=np.float64)
+    events = np.asarray(events, dtype=np.float64)
+
+    # Samples before and after each event, from the sample interval
+    interval = np.median(np.diff(signal_time))
+    n_before = int(round(-window[0] * 1000 / interval))
+    n_after = int(round(window[1] * 1000 / interval))
+    width = n_before + n_after + 1
+
+    event_index = nearest_index(signal_time, events)
+    starts = event_index - n_before
+    kept = ((starts >= 0) & (starts + width <= len(signal))
+            & (events >= signal_time[0]) & (events <= signal_time[-1]))
+    event_index = event_index[kept]
+    events = events[kept]
+
+    # Every window as a row, gathered by index
+    windows = signal[(event_index - n_before)[:, None]
+                     + np.arange(width)].astype(np.float64)
+
+    # Baseline means from running sums
+    baseline_start = nearest_index(signal_time, events + baseline[0] * 1000)
+    baseline_stop = nearest_index(signal_time, events + baseline[1] * 1000)
+    sums = np.concatenate([[0], np.cumsum(signal, dtype=np.float64)])
+    baseline_mean = ((sums[baseline_stop + 1] - sums[baseline_start])
+                     / (baseline_stop - baseline_start + 1))
+
+    zscore = ((windows - baseline_mean[:, None])
+              / np.std(signal, ddof=1, dtype=np.float64))
+    n_events = len(zscore)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = zscore.mean(axis=0)
+        sem = (zscore.std(axis=0, ddof=1) / np.sqrt(n_events)
+               if n_events > 1 else np.zeros(width))
+
+    return {'time': np.arange(-n_before, n_after + 1) * interval / 1000,
+            'zscore': zscore, 'mean': mean, 'sem': sem,
+            'event_index': event_index, 'kept': kept}
+
+
+def zscore_results(session, behaviorData, channels=ZSCORE_CHANNELS,
+                   behaviors=None, baseline=ZSCORE_BASELINE,
+                   window=ZSCORE_WINDOW):
+    """Z-scores each channel around each behavior
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        behaviorData: pandas dataframe
+                from import_behavior_data
+        channels: list of strings
+                signal channels to analyze, e.g. f1GreenGreen
+                default = ZSCORE_CHANNELS
+        behaviors: list of strings
+                behaviors to analyze, default None for every
+                behavior in behaviorData
+        baseline, window: tuples of numbers
+                see peri_event_zscore
+
+        Returns:
+        --------
+        results: dictionary
+                peri_event_zscore result keyed by (channel,
+                behavior)
+    """
+    for channel in channels:
+        if channel not in session.names:
+            print("\nError: Channel <" + str(channel) + "> is not in the"
+                  + " session. Please use one of: "
+                  + ", ".join(session.names))
+            sys.exit(1)
+    if behaviors is None:
+        behaviors = list(behaviorData['Behavior'].dropna().unique())
+
+    results = {}
+    for channel in channels:
+        # Time channel of the LED the channel was recorded under
+        slot = next(slot for slot in fpho_session.SLOTS
+                    if channel.endswith(slot))
+        signal_time = session['fTime' + slot]
+        for behavior in behaviors:
+            results[(channel, behavior)] = peri_event_zscore(
+                session[channel], signal_time,
+                event_times(behaviorData, behavior),
+                baseline=baseline, window=window)
+    return results
+
+
+def draw_zscore(result, baseline, title):
+    """Draws the z-score around each event with the avg and SEM
+
+        Parameters
+        ----------
+        result: dictionary
+                from peri_event_zscore
+        baseline: tuple of numbers
+                baseline range in seconds, marked in grey
+        title: string
+                plot title
+
+        Returns:
+        --------
+        fig: matplotlib figure
+    """
+    fig = fpho_plot.new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Plots z scores for each behavior bout
+    ax.plot(result['time'], result['zscore'].T, color='k',
+            linewidth=0.5, alpha=0.5)
+    # Plots avg z score across all bouts with SEM lines
+    ax.plot(result['time'], result['mean'], linewidth=3)
+    ax.plot(result['time'], result['mean'] + result['sem'], color='r')
+    ax.plot(result['time'], result['mean'] - result['sem'], color='r')
+    ax.axvline(0, linestyle=':', color='k')
+    # Marks baseline range with grey bar
+    ax.axvspan(baseline[0], baseline[1], color='grey', alpha=0.2)
+    # Remove top and right borders
+    fpho_plot.remove_borders(ax)
+    # Add axes labels and a title
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('zscore')
+    ax.set_title(title)
+    return fig
+
+
+def zscore_figures(session, results, zplot_filename,
+                   baseline=ZSCORE_BASELINE):
+    """Describes the z-score plot of each channel and behavior
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        results: dictionary
+                from zscore_results
+        zplot_filename: string
+                name for output png files
+        baseline: tuple of numbers
+                see peri_event_zscore
+
+        Returns:
+        --------
+        jobs: list of dictionaries
+                one fpho_plot.figure_job per channel and behavior
+                with events inside the recording
+    """
+    jobs = []
+    for (channel, behavior), result in results.items():
+        if len(result['zscore']) == 0:
+            print('No ' + str(behavior) + ' events inside the '
+                  + channel + ' recording')
+            continue
+
+        # Save the plot in a png file
+        zplot_name = (zplot_filename + '_' + channel + '_'
+                      + str(behavior).replace(' ', '') + '_zscore.png')
+        jobs.append(fpho_plot.figure_job(
+            draw_zscore, zplot_name, result=result, baseline=baseline,
+            title=(str(behavior) + ' Animal no. '
+                   + str(session.animalID) + ' Channel: ' + channel)))
+    return jobs
+
+
+def plot_zscore(session, behaviorData, zplot_filename,
+                channels=ZSCORE_CHANNELS, behaviors=None,
+                baseline=ZSCORE_BASELINE, window=ZSCORE_WINDOW, workers=1):
+    """Takes a session and behavior data and creates plot of
+        z-scores for each time a select behavior occurs with the
+        avg z-score and SEM
 
         Parameters
         ----------
+        session: Session
+                parsed fiberphotometry data
         behaviorData: pandas dataframe
                 contains:
                     Time(total msec), Time(sec), Subject,
                     Behavior, Status
         zplot_filename: string
-                name of the output png file
+                name for output png files
+        channels: list of strings
+                signal channels to analyze, e.g. f1GreenGreen
+                default = ZSCORE_CHANNELS
+        behaviors: list of strings
+                behaviors to analyze, default None for every
+                behavior in behaviorData
+        baseline, window: tuples of numbers
+                see peri_event_zscore
+        workers: integer
+                number of processes drawing plots, see
+                fpho_plot.render_figures
 
         Returns:
         --------
-        zplot_filename: png file
+        results: dictionary
+                peri_event_zscore result keyed by (channel,
+                behavior)
+        zplot_filename_channel_behavior_zscore.png: png files
                 plot of the avg zscores for behavioral
                 occurances
     """
-    return
-    # built in zscore function?
-    # don't pick a baseline, instead use the mean (of the clip) as the baseline
+    results = zscore_results(session, behaviorData, channels=channels,
+                             behaviors=behaviors, baseline=baseline,
+                             window=window)
+    fpho_plot.render_figures(zscore_figures(session, results,
+                                            zplot_filename,
+                                            baseline=baseline),
+                             workers=workers)
+    return results
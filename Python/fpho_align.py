@@ -0,0 +1,159 @@
+"""Library of functions to align video time to the Bonsai clock
+    * read_video_timestamps - reads the Bonsai time of every video frame
+    * video_fps - frame rate BORIS counts video seconds in
+    * estimate_drift - fits the Bonsai clock against video time
+    * video_to_bonsai - maps video seconds to Bonsai msec
+
+    BORIS scores events in seconds of video, counted from the
+    frame rate the video file was written with. Bonsai writes the
+    time of day in msec of every frame, on the same clock as the
+    fiber photometry data, to the video timestamp file. Looking up
+    the frame an event falls on in that file aligns the event to
+    the fiber photometry data, including frame jitter and a frame
+    rate that differs from the one in the video file.
+"""
+import sys
+import numpy as np
+import pandas as pd
+
+# Frame rate of videos written by Bonsai, used when BORIS does not
+# give one
+VIDEO_FPS = 30.0
+
+
+def read_video_timestamps(timestamp_filename):
+    """Takes a file name, returns the time of every video frame
+
+        Parameters
+        ----------
+        timestamp_filename: string
+                The path to the video timestamp file, one Bonsai
+                time in msec per line and no header
+
+        Returns:
+        --------
+        frame_times: numpy array
+                float64 time of each frame in msec. A recording
+                stopped while Bonsai was writing can end in a
+                partial line, so times from the first one that is
+                missing or not after the frame before are dropped.
+    """
+    # Open file, catch errors
+    try:
+        timestamps = pd.read_csv(timestamp_filename, header=None,
+                                 usecols=[0], sep=',', dtype=str)
+    except FileNotFoundError:
+        print("Could not find file: " + timestamp_filename)
+        sys.exit(1)
+    except PermissionError:
+        print("Could not access file: " + timestamp_filename)
+        sys.exit(2)
+    except pd.errors.EmptyDataError:
+        timestamps = pd.DataFrame({0: []})
+
+    frame_times = pd.to_numeric(timestamps[0], errors='coerce').to_numpy(
+        dtype=np.float64)
+    bad = ~(np.diff(frame_times) > 0)
+    if bad.any():
+        frame_times = frame_times[:np.argmax(bad) + 1]
+    if len(frame_times) == 0 or not np.isfinite(frame_times[0]):
+        print("Could not find frame times in file: " + timestamp_filename)
+        sys.exit(1)
+    return frame_times
+
+
+def video_fps(BORISData=None):
+    """Finds the frame rate video seconds are counted in
+
+        Parameters
+        ----------
+        BORISData: pandas dataframe
+                from behavior_setup.read_BORIS_file, default None
+
+        Returns:
+        --------
+        fps: float
+                the FPS column of the BORIS export if there is one,
+                otherwise VIDEO_FPS
+    """
+    if BORISData is not None and 'FPS' in BORISData.columns:
+        fps = pd.to_numeric(BORISData['FPS'], errors='coerce').dropna()
+        if len(fps) > 0 and fps.iloc[0] > 0:
+            return float(fps.iloc[0])
+    return VIDEO_FPS
+
+
+def estimate_drift(frame_times, fps):
+    """Fits frame times against video time with a line
+
+        Parameters
+        ----------
+        frame_times: numpy array
+                time of each frame in msec
+        fps: float
+                frame rate video seconds are counted in
+
+        Returns:
+        --------
+        drift: dictionary
+                offset: Bonsai msec of video time 0
+                scale: Bonsai msec per msec of video
+                drift_ppm: (scale - 1) in parts per million
+                jitter_msec: standard deviation of the frame times
+                around the line
+    """
+    video_msec = np.arange(len(frame_times)) * (1000 / fps)
+    if len(frame_times) < 2:
+        return {'offset': frame_times[0], 'scale': 1.0, 'drift_ppm': 0.0,
+                'jitter_msec': 0.0}
+    centered = video_msec - video_msec.mean()
+    scale = (np.dot(centered, frame_times - frame_times.mean())
+             / np.dot(centered, centered))
+    offset = frame_times.mean() - scale * video_msec.mean()
+    residual = frame_times - (offset + scale * video_msec)
+    return {'offset': offset, 'scale': scale,
+            'drift_ppm': (scale - 1) * 1e6,
+            'jitter_msec': residual.std()}
+
+
+def video_to_bonsai(seconds, frame_times, fps, drift=None):
+    """Maps times in seconds of video to Bonsai time in msec
+
+        Times are turned into frame positions, and the Bonsai time
+        is interpolated between the frames around each one. Times
+        before the first or past the last frame are extrapolated
+        with the scale from estimate_drift.
+
+        Parameters
+        ----------
+        seconds: numpy array
+                times in seconds of video
+        frame_times: numpy array
+                time of each frame in msec
+        fps: float
+                frame rate video seconds are counted in
+        drift: dictionary
+                from estimate_drift, default None to fit it here
+
+        Returns:
+        --------
+        msec: numpy array
+                Bonsai time of each time in msec
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    frames = seconds * fps
+    msec = np.interp(frames, np.arange(len(frame_times)), frame_times)
+
+    # Outside the frames, continue from the first or last frame
+    # at the rate of the fitted line
+    last = len(frame_times) - 1
+    before = frames < 0
+    after = frames > last
+    if before.any() or after.any():
+        if drift is None:
+            drift = estimate_drift(frame_times, fps)
+        msec[before] = (frame_times[0]
+                        + drift['scale'] * frames[before] * 1000 / fps)
+        msec[after] = (frame_times[-1]
+                       + drift['scale'] * (frames[after] - last) * 1000 / fps)
+    return msec
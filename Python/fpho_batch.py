@@ -0,0 +1,290 @@
+"""Runs the fpho_config pipeline on every recording in a directory
+    * session_pattern - regular expression for a file name pattern
+    * find_sessions - pairs signal, timestamp and BORIS files
+    * session_config - config for one session of a batch
+    * run_session - runs the pipeline on one session
+    * run_batch - runs all sessions on a pool of worker processes
+    * main - runs a batch from config.yml
+
+    To use this driver, set batch_dir in config.yml, then run:
+        python fpho_batch.py --config config.yml
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import io
+import os
+import re
+import sys
+import time
+import pandas as pd
+import yaml
+import fpho_cache
+import fpho_config
+
+# Default file name patterns, * is the session stamp
+SIGNAL_PATTERN = 'FiberPhoSig*.csv'
+TIMESTAMP_PATTERN = 'video time stamp_*.csv'
+BORIS_PATTERN = '*BORIS*.csv'
+
+# Columns of the run summary, one row per session
+BATCH_SUMMARY_COLUMNS = ['session', 'input_filename', 'timestamp_file',
+                         'BORIS_file', 'status', 'samples',
+                         'recording_min', 'run_sec', 'message']
+
+
+def session_pattern(pattern):
+    """Takes a file name pattern, returns a regular expression
+
+        Parameters
+        ----------
+        pattern: string
+                file name with one * standing for the session
+                stamp, e.g. FiberPhoSig*.csv
+
+        Returns:
+        --------
+        regex: compiled regular expression
+                matches file names, group 1 is the session stamp
+    """
+    if pattern.count('*') != 1:
+        print("Error: Batch file pattern <" + pattern + "> needs"
+              + " exactly one * for the session stamp")
+        sys.exit(1)
+    before, after = pattern.split('*')
+    return re.compile(re.escape(before) + '(.+)' + re.escape(after) + '$')
+
+
+def find_sessions(batch_dir, signal_pattern=SIGNAL_PATTERN,
+                  timestamp_pattern=TIMESTAMP_PATTERN,
+                  BORIS_pattern=BORIS_PATTERN):
+    """Finds the recordings in a directory and their paired files
+
+        The session stamp is the part of the signal file name
+        matched by *. The timestamp file is timestamp_pattern with
+        * replaced by the stamp, and the BORIS file is the first
+        file matching BORIS_pattern whose name contains the stamp.
+
+        Parameters
+        ----------
+        batch_dir: string
+                directory holding the recordings
+        signal_pattern, timestamp_pattern, BORIS_pattern: strings
+                file name patterns, see SIGNAL_PATTERN
+
+        Returns:
+        --------
+        sessions: list of dictionaries
+                session, input_filename, timestamp_file and
+                BORIS_file for each signal file, sorted by name.
+                Missing timestamp or BORIS files are None.
+    """
+    if not os.path.isdir(batch_dir):
+        print("Could not find directory: " + batch_dir)
+        sys.exit(1)
+
+    signal_regex = session_pattern(signal_pattern)
+    session_pattern(timestamp_pattern)
+    files = sorted(os.listdir(batch_dir))
+    BORIS_files = sorted(os.path.basename(name) for name in
+                         glob.glob(os.path.join(batch_dir, BORIS_pattern)))
+
+    sessions = []
+    for name in files:
+        match = signal_regex.match(name)
+        if match is None:
+            continue
+        stamp = match.group(1)
+        timestamp_file = timestamp_pattern.replace('*', stamp)
+        BORIS_file = next((BORIS_name for BORIS_name in BORIS_files
+                           if stamp in BORIS_name), None)
+        sessions.append({
+            'session': stamp,
+            'input_filename': os.path.join(batch_dir, name),
+            'timestamp_file': (os.path.join(batch_dir, timestamp_file)
+                               if timestamp_file in files else None),
+            'BORIS_file': (os.path.join(batch_dir, BORIS_file)
+                           if BORIS_file is not None else None)})
+    return sessions
+
+
+def session_config(config, session):
+    """Takes the batch config and one session, returns its config
+
+        Output files get the session stamp appended to
+        output_filename. If the stamp starts with a date it is
+        used as exp_date.
+
+        Parameters
+        ----------
+        config: dictionary
+                settings loaded from config.yml
+        session: dictionary
+                one entry from find_sessions
+
+        Returns:
+        --------
+        config: dictionary
+                copy of config for this session
+    """
+    config = dict(config)
+    config['input_filename'] = session['input_filename']
+    config['output_filename'] = (config['output_filename'] + '_'
+                                 + session['session'])
+    config['timestamp_file'] = session['timestamp_file']
+    config['BORIS_file'] = session['BORIS_file']
+    if re.match(r'\d{4}-\d{2}-\d{2}', session['session']):
+        config['exp_date'] = session['session'][:10]
+
+    # Sessions already run one per worker, so each draws its plots
+    # in its own process
+    config['plot_workers'] = 1
+
+    # Behavior needs both the BORIS and the timestamp file
+    if session['BORIS_file'] is None or session['timestamp_file'] is None:
+        config['import_behavior'] = False
+        config['plot_zscore'] = False
+    return config
+
+
+def run_session(config):
+    """Runs the pipeline on one session, never exits
+
+        Parameters
+        ----------
+        config: dictionary
+                config for the session, from session_config
+
+        Returns:
+        --------
+        row: dictionary
+                run summary row, see BATCH_SUMMARY_COLUMNS. status
+                is ok or failed, message is the last line the
+                pipeline printed.
+    """
+    row = {'session': os.path.basename(config['output_filename']),
+           'input_filename': config['input_filename'],
+           'timestamp_file': config['timestamp_file'],
+           'BORIS_file': config['BORIS_file'],
+           'status': 'failed', 'samples': 0, 'recording_min': 0.0}
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            session = fpho_config.run_config(config)
+        row['status'] = 'ok'
+        row['samples'] = len(session)
+        if len(session) > 0:
+            row['recording_min'] = float(session.times[:, -1].max()
+                                         - session.times[:, 0].min()) / 6e4
+    except SystemExit:
+        pass
+    except Exception as error:
+        log.write(type(error).__name__ + ': ' + str(error) + '\n')
+    row['run_sec'] = time.perf_counter() - start
+    lines = log.getvalue().strip().splitlines()
+    row['message'] = lines[-1].strip() if lines else ''
+    return row
+
+
+def run_batch(config, workers=None):
+    """Runs the pipeline on every session in config['batch_dir']
+
+        Parameters
+        ----------
+        config: dictionary
+                settings loaded from config.yml, with batch_dir and
+                optionally batch_signal_pattern,
+                batch_timestamp_pattern and batch_BORIS_pattern
+        workers: integer
+                number of worker processes, default None for
+                config['batch_workers'], 0 or missing for one per
+                CPU. 1 runs the sessions one after another in this
+                process.
+
+        Returns:
+        --------
+        summary: pandas dataframe
+                one row per session, see BATCH_SUMMARY_COLUMNS,
+                also written to output_filename_BatchSummary.csv
+    """
+    sessions = find_sessions(
+        config['batch_dir'],
+        signal_pattern=config.get('batch_signal_pattern', SIGNAL_PATTERN),
+        timestamp_pattern=config.get('batch_timestamp_pattern',
+                                     TIMESTAMP_PATTERN),
+        BORIS_pattern=config.get('batch_BORIS_pattern', BORIS_PATTERN))
+    if len(sessions) == 0:
+        print("Could not find recordings in directory: "
+              + config['batch_dir'])
+        sys.exit(1)
+
+    # Clear the cache once, not in every session
+    configs = [session_config(config, session) for session in sessions]
+    if config.get('clear_cache', False) is True:
+        fpho_cache.clear_cache(
+            fpho_cache.cache_dir_for(config['output_filename']))
+        for session in configs:
+            session['clear_cache'] = False
+
+    if workers is None:
+        workers = config.get('batch_workers', 0)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(configs))
+
+    if workers == 1:
+        rows = [run_session(session) for session in configs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            rows = list(executor.map(run_session, configs))
+
+    summary = pd.DataFrame(rows, columns=BATCH_SUMMARY_COLUMNS)
+    summary_filename = config['output_filename'] + '_BatchSummary.csv'
+    summary.to_csv(summary_filename, index=False)
+    for row in rows:
+        print('{}: {} in {:.1f} s {}'.format(row['session'], row['status'],
+                                             row['run_sec'], row['message']))
+    print('Batch summary written to ' + summary_filename)
+    return summary
+
+
+def main():
+    """Runs a batch from config.yml
+
+    Parameters
+    ----------
+    config.yml
+        Set batch_dir in the config.yml file, then run the
+        following bash command:
+        python fpho_batch.py --config config.yml
+
+    Returns
+    -------
+        Batch summary dataframe
+        Writes the outputs of fpho_config.py for each session
+        and an output_filename_BatchSummary.csv run summary
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--config', type=str, required=True)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, overrides batch_workers')
+    args = parser.parse_args()
+
+    # Opens and reads config file to process
+    f = open(args.config, 'r')
+    config = yaml.load(f, Loader=yaml.FullLoader)
+    f.close()
+
+    if not config.get('batch_dir'):
+        print("Error: Set batch_dir in " + args.config
+              + " to the directory of recordings")
+        sys.exit(1)
+
+    return run_batch(config, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,643 @@
+"""Times fpho_setup functions against the implementations they replaced
+
+    Run from the main directory:
+        python Python/fpho_benchmark.py
+
+    With --suite, times each stage of the pipeline on the sample
+    recordings and on recordings scaled up from them, writes the
+    timings to a csv and flags stages slower than a stored
+    baseline:
+        python Python/fpho_benchmark.py --suite
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time as timer
+import timeit
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+import behavior_setup
+import fpho_align
+import fpho_session
+import fpho_setup
+import fpho_plot
+import fpho_synthetic
+
+# Recordings timed by the benchmark suite
+SUITE_DATASETS = [
+    {'dataset': 'sample_1fiber',
+     'input_filename': 'Python/SampleData/1fiberSignal.csv',
+     'n_fibers': 1, 'f1greencol': 3, 'f2greencol': None,
+     'BORIS_file': 'Python/SampleData/1FiberBORIS.csv',
+     'timestamp_file': 'Python/SampleData/1fiberTimestamp.csv'},
+    {'dataset': 'sample_2fiber',
+     'input_filename': 'Python/SampleData/2fiberSignal.csv',
+     'n_fibers': 2, 'f1greencol': 3, 'f2greencol': 5,
+     'BORIS_file': 'Python/SampleData/2fiberBORIS.csv',
+     'timestamp_file': 'Python/SampleData/2fiberTimestamp.csv'},
+    {'dataset': 'synchrony_2fiber',
+     'input_filename': ('Python/SynchronyData/'
+                        'FiberPhoSig2020-10-12T15_30_41.csv'),
+     'n_fibers': 2, 'f1greencol': 3, 'f2greencol': 5,
+     'BORIS_file': None, 'timestamp_file': None}]
+
+# Times the first dataset is repeated to make longer recordings
+SUITE_SCALES = [10, 100]
+
+# Runs of each stage, the fastest one is recorded
+SUITE_REPEAT = 3
+
+# Seconds in each sliding isosbestic fit window
+SUITE_WINDOW_SEC = 60.0
+
+# Columns of the suite results
+SUITE_COLUMNS = ['dataset', 'stage', 'samples', 'seconds']
+
+# Stored suite timings that new runs are compared against
+BASELINE_FILENAME = 'Python/benchmark_baseline.csv'
+
+# A stage is a regression when it is this many times slower than
+# the baseline, and slower by at least REGRESSION_MIN_SEC
+REGRESSION_RATIO = 2.0
+REGRESSION_MIN_SEC = 0.1
+
+
+def legacy_parse(input_filename, columns):
+    """Line-by-line parser that import_fpho_data used before
+        read_fpho_columns, kept as a reference for timing
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file
+        columns: list of integers
+                1-based column indexes to keep
+
+        Returns:
+        --------
+        parsed: list of lists
+                one list of floats per requested column
+    """
+    parsed = [[] for col in columns]
+    header = None
+    file = open(input_filename, 'r')
+    for line in file:
+        if header is None:
+            header = line
+            continue
+        break
+    for line in file:
+        values = line.rstrip().replace(',', ' ').split(' ')
+        for i, col in enumerate(columns):
+            parsed[i].append(float(values[col-1]))
+    file.close()
+    return parsed
+
+
+def bench_import(input_filename, n_fibers, repeat=5):
+    """Times the legacy line parser against read_fpho_columns
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file
+        n_fibers: integer
+                1 or 2 fiber input data
+        repeat: integer
+                number of timed runs, the best one is reported
+
+        Returns:
+        --------
+        timings: dictionary
+                best time in seconds for 'legacy' and 'bulk'
+    """
+    columns = [1, 3, 4] if n_fibers == 1 else [1, 3, 4, 5, 6]
+    legacy = min(timeit.repeat(lambda: legacy_parse(input_filename, columns),
+                               number=1, repeat=repeat))
+    bulk = min(timeit.repeat(lambda: fpho_setup.read_fpho_columns(
+                                 input_filename),
+                             number=1, repeat=repeat))
+    return {'legacy': legacy, 'bulk': bulk}
+
+
+def legacy_fit(time, signal):
+    """curve_fit call that plot_fitted_exp used before fit_bleaching,
+        kept as a reference for timing
+
+        Parameters
+        ----------
+        time: numpy array
+                time, starting at 0
+        signal: numpy array
+                fluorescence data
+
+        Returns:
+        --------
+        popt: numpy array
+                fitted A, B, C and D
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        popt, pcov = curve_fit(fpho_setup.fit_exp, time, signal,
+                               p0=(1.0, -0.001, 1.0, -0.001),
+                               maxfev=500000)
+    return popt
+
+
+def synthetic_bleaching(n_samples, seed=0):
+    """Makes a noisy double exponential recording
+
+        Parameters
+        ----------
+        n_samples: integer
+                number of samples, 75 msec apart
+        seed: integer
+                seed of the noise
+
+        Returns:
+        --------
+        time, signal: numpy arrays
+    """
+    rng = np.random.default_rng(seed)
+    time = np.arange(n_samples) * 75.0
+    signal = (200 * np.exp(-time / 3e5)
+              + 500 * np.exp(-time / (time[-1] * 5))
+              + rng.normal(0, 3, n_samples))
+    return time, signal
+
+
+def bench_fit(time, signal, repeat=3):
+    """Times the legacy curve_fit call against fit_bleaching
+
+        Parameters
+        ----------
+        time: numpy array
+                time of each sample
+        signal: numpy array
+                fluorescence data
+        repeat: integer
+                number of timed runs, the best one is reported
+
+        Returns:
+        --------
+        timings: dictionary
+                best time in seconds for 'legacy' and 'bulk', and
+                the mean squared residual of each fit as
+                'legacy_mse' and 'bulk_mse'
+    """
+    time = time - time[0]
+    legacy = min(timeit.repeat(lambda: legacy_fit(time, signal),
+                               number=1, repeat=repeat))
+    bulk = min(timeit.repeat(lambda: fpho_setup.fit_bleaching(time, signal),
+                             number=1, repeat=repeat))
+    legacy_mse = np.mean((fpho_setup.fit_exp(time, *legacy_fit(time, signal))
+                          - signal)**2)
+    bulk_mse = np.mean(fpho_setup.fit_bleaching(time, signal)['detrended']**2)
+    return {'legacy': legacy, 'bulk': bulk,
+            'legacy_mse': legacy_mse, 'bulk_mse': bulk_mse}
+
+
+def bench_iso_norm(n_samples, window_sec=60.0, n_fibers=2, repeat=3):
+    """Times the sliding window isosbestic fit against the global fit
+
+        Parameters
+        ----------
+        n_samples: integer
+                samples per channel, 75 msec apart
+        window_sec: number
+                seconds in each sliding fit window
+        n_fibers: integer
+                number of fibers
+        repeat: integer
+                number of timed runs, the best one is reported
+
+        Returns:
+        --------
+        timings: dictionary
+                best time in seconds for 'global' and 'window'
+    """
+    rng = np.random.default_rng(0)
+    names = fpho_session.signal_names(n_fibers)
+    signals = 1500 + np.cumsum(rng.normal(0, 1, (len(names), n_samples)),
+                               axis=1)
+    times = np.tile(np.arange(n_samples) * 75.0, (3, 1))
+    session = fpho_session.Session(signals, times, names)
+    timings = {}
+    for name, window in [('global', None), ('window', window_sec)]:
+        timings[name] = min(timeit.repeat(
+            lambda: fpho_setup.isosbestic_norm(session, window_sec=window),
+            number=1, repeat=repeat))
+    return timings
+
+
+def bench_plot(n_samples, repeat=1):
+    """Times drawing a trace in full against plot_envelope
+
+        Parameters
+        ----------
+        n_samples: integer
+                number of samples in the trace
+        repeat: integer
+                number of timed runs, the best one is reported
+
+        Returns:
+        --------
+        timings: dictionary
+                best time in seconds for 'legacy' and 'bulk' to
+                draw and save a raw_signal_trace sized figure
+    """
+    time, signal = synthetic_bleaching(n_samples)
+
+    def render(plot):
+        fig = fpho_plot.new_figure(figsize=(7, 6), dpi=300)
+        ax = fig.add_subplot(1, 1, 1)
+        plot(ax)
+        with tempfile.TemporaryDirectory() as tmp:
+            fig.savefig(os.path.join(tmp, 'benchmark.png'))
+
+    legacy = min(timeit.repeat(lambda: render(
+                                   lambda ax: ax.plot(time, signal)),
+                               number=1, repeat=repeat))
+    bulk = min(timeit.repeat(lambda: render(
+                                 lambda ax: fpho_setup.plot_envelope(
+                                     ax, time, signal)),
+                             number=1, repeat=repeat))
+    return {'legacy': legacy, 'bulk': bulk}
+
+
+def bench_render(n_figures, n_samples, workers=0):
+    """Times drawing figures one after another against a pool of
+        workers
+
+        Parameters
+        ----------
+        n_figures: integer
+                number of raw signal figures
+        n_samples: integer
+                number of samples in each trace
+        workers: integer
+                worker processes for 'bulk', 0 for one per CPU
+
+        Returns:
+        --------
+        timings: dictionary
+                time in seconds for 'legacy' (1 worker) and 'bulk'
+                to draw and save all figures
+    """
+    time, signal = synthetic_bleaching(n_samples)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = [fpho_plot.figure_job(
+                    fpho_setup.draw_raw_signal,
+                    os.path.join(tmp, 'benchmark' + str(i) + '.png'),
+                    time_data=time, traces=[signal],
+                    channels=['f1GreenGreen'], l_color='g')
+                for i in range(n_figures)]
+        for name, n_workers in [('legacy', 1), ('bulk', workers)]:
+            timings[name] = min(timeit.repeat(
+                lambda: fpho_plot.render_figures(jobs, workers=n_workers),
+                number=1, repeat=1))
+    return timings
+
+
+def scale_recording(dataset, factor, directory):
+    """Repeats a recording to make a longer one
+
+        Each repeat is shifted in time by the length of the
+        recording, and the frame counter keeps counting.
+
+        Parameters
+        ----------
+        dataset: dictionary
+                one entry of SUITE_DATASETS
+        factor: integer
+                number of repeats
+        directory: string
+                where the scaled files are written
+
+        Returns:
+        --------
+        dataset: dictionary
+                the same settings for the scaled files
+    """
+    name = dataset['dataset'] + '_x' + str(factor)
+    scaled = dict(dataset, dataset=name)
+
+    # Bonsai time in msec, frame counter, then the signals
+    data = fpho_setup.read_fpho_columns(dataset['input_filename'])
+    period = data[-1, :2] - data[0, :2] + (data[-1, :2] - data[-2, :2])
+    repeats = np.arange(factor).repeat(len(data))
+    data = np.tile(data, (factor, 1))
+    data[:, :2] += repeats[:, None] * period
+    data[:, 1] %= 2**32
+    scaled['input_filename'] = os.path.join(directory, name + 'Signal.csv')
+    np.savetxt(scaled['input_filename'], data,
+               fmt=['%.4f', '%d'] + ['%.14g'] * (data.shape[1] - 2))
+
+    # Video frames and BORIS events, shifted by the video length
+    if dataset['timestamp_file'] is None:
+        return scaled
+    frames = np.loadtxt(dataset['timestamp_file'])
+    frame_period = frames[-1] - frames[0] + (frames[-1] - frames[-2])
+    n_frames = len(frames)
+    frames = (np.tile(frames, factor)
+              + np.arange(factor).repeat(n_frames) * frame_period)
+    scaled['timestamp_file'] = os.path.join(directory,
+                                            name + 'Timestamp.csv')
+    np.savetxt(scaled['timestamp_file'], frames, fmt='%.4f')
+
+    if dataset['BORIS_file'] is not None:
+        events = behavior_setup.read_BORIS_file(dataset['BORIS_file'])
+        video_sec = n_frames / fpho_align.video_fps(events)
+        events = pd.concat([events.assign(Time=events['Time']
+                                          + i * video_sec)
+                            for i in range(factor)], ignore_index=True)
+        scaled['BORIS_file'] = os.path.join(directory, name + 'BORIS.csv')
+        events.rename(columns={'Time': 'Time in Video (sec)'}).to_csv(
+            scaled['BORIS_file'], index=False)
+    return scaled
+
+
+def time_stage(results, dataset, stage, samples, repeat, function, *args,
+               **kwargs):
+    """Runs one stage of the pipeline and records its fastest time
+
+        Parameters
+        ----------
+        results: list of dictionaries
+                suite results, see SUITE_COLUMNS, one row is
+                appended
+        dataset: dictionary
+                one entry of SUITE_DATASETS
+        stage: string
+                name of the stage
+        samples: integer
+                samples in each channel of the recording
+        repeat: integer
+                number of runs
+        function: function
+                the stage, called with args and kwargs
+
+        Returns:
+        --------
+        value:
+                what function returned
+    """
+    seconds = []
+    for run in range(repeat):
+        start = timer.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = function(*args, **kwargs)
+        seconds.append(timer.perf_counter() - start)
+    results.append({'dataset': dataset['dataset'], 'stage': stage,
+                    'samples': samples, 'seconds': min(seconds)})
+    return value
+
+
+def bench_suite(datasets, directory, repeat=SUITE_REPEAT):
+    """Times each stage of the pipeline on each recording
+
+        Parameters
+        ----------
+        datasets: list of dictionaries
+                see SUITE_DATASETS
+        directory: string
+                where output files are written
+        repeat: integer
+                runs of each stage, the fastest one is recorded
+
+        Returns:
+        --------
+        results: pandas dataframe
+                one row per dataset and stage, see SUITE_COLUMNS
+    """
+    results = []
+    for dataset in datasets:
+        output = os.path.join(directory, dataset['dataset'])
+        session = time_stage(results, dataset, 'import_fpho_data', None,
+                             repeat,
+                             fpho_setup.import_fpho_data,
+                             dataset['input_filename'], output,
+                             dataset['n_fibers'], dataset['f1greencol'],
+                             'benchmark', '', '',
+                             f2greencol=dataset['f2greencol'])
+        samples = len(session)
+        results[-1]['samples'] = samples
+        time_stage(results, dataset, 'plot_isosbestic_norm', samples, repeat,
+                   fpho_setup.plot_isosbestic_norm, session, output)
+        time_stage(results, dataset, 'isosbestic_norm_window', samples,
+                   repeat, fpho_setup.isosbestic_norm, session,
+                   window_sec=SUITE_WINDOW_SEC)
+        time_stage(results, dataset, 'plot_fitted_exp', samples, repeat,
+                   fpho_setup.plot_fitted_exp, session, output)
+        time_stage(results, dataset, 'raw_signal_trace', samples, repeat,
+                   fpho_setup.raw_signal_trace, session, output)
+        if dataset['BORIS_file'] is None:
+            continue
+        behaviorData = time_stage(results, dataset, 'import_behavior_data',
+                                  samples, repeat,
+                                  behavior_setup.import_behavior_data,
+                                  dataset['BORIS_file'],
+                                  dataset['timestamp_file'])
+        time_stage(results, dataset, 'plot_zscore', samples, repeat,
+                   behavior_setup.plot_zscore, session, behaviorData,
+                   output)
+    return pd.DataFrame(results, columns=SUITE_COLUMNS)
+
+
+def compare_baseline(results, baseline):
+    """Compares suite timings against a baseline
+
+        Parameters
+        ----------
+        results: pandas dataframe
+                from bench_suite
+        baseline: pandas dataframe
+                earlier results of bench_suite
+
+        Returns:
+        --------
+        results: pandas dataframe
+                results with baseline_seconds, ratio and
+                regression columns. Stages missing from the
+                baseline are never regressions.
+    """
+    results = results.merge(
+        baseline[['dataset', 'stage', 'seconds']].rename(
+            columns={'seconds': 'baseline_seconds'}),
+        on=['dataset', 'stage'], how='left')
+    results['ratio'] = results['seconds'] / results['baseline_seconds']
+    results['regression'] = ((results['ratio'] > REGRESSION_RATIO)
+                             & (results['seconds']
+                                - results['baseline_seconds']
+                                > REGRESSION_MIN_SEC))
+    return results
+
+
+def run_suite(results_filename, baseline_filename=BASELINE_FILENAME,
+              scales=SUITE_SCALES, synthetic_minutes=(),
+              repeat=SUITE_REPEAT, save_baseline=False):
+    """Runs the benchmark suite and reports regressions
+
+        Parameters
+        ----------
+        results_filename: string
+                csv the timings are written to
+        baseline_filename: string
+                csv of stored timings, see BASELINE_FILENAME
+        scales: list of integers
+                repeats of the first dataset to time as well
+        synthetic_minutes: list of numbers
+                lengths of 2 fiber recordings from fpho_synthetic
+                to time as well
+        repeat: integer
+                runs of each stage, see bench_suite
+        save_baseline: boolean
+                write the timings to baseline_filename instead of
+                comparing against it
+
+        Returns:
+        --------
+        results: pandas dataframe
+                see compare_baseline
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        datasets = SUITE_DATASETS + [scale_recording(SUITE_DATASETS[0],
+                                                     factor, tmp)
+                                     for factor in scales]
+        for minutes in synthetic_minutes:
+            name = 'synthetic_2fiber_{:g}min'.format(minutes)
+            recording = fpho_synthetic.write_recording(
+                os.path.join(tmp, name), name, minutes, n_fibers=2)
+            recording['dataset'] = name
+            datasets.append(recording)
+        results = bench_suite(datasets, tmp, repeat)
+
+    if save_baseline:
+        results.to_csv(baseline_filename, index=False)
+        print('Baseline written to ' + baseline_filename)
+        return results
+
+    if os.path.exists(baseline_filename):
+        results = compare_baseline(results,
+                                   pd.read_csv(baseline_filename))
+    else:
+        print('No baseline at ' + baseline_filename
+              + ', run with --save_baseline to store one')
+    results.to_csv(results_filename, index=False)
+
+    for row in results.to_dict('records'):
+        line = '{:>24} {:>22} {:>9} samples {:8.3f} s'.format(
+            row['dataset'], row['stage'], row['samples'], row['seconds'])
+        if row.get('baseline_seconds', np.nan) > 0:
+            line += ' ({:.2f}x baseline)'.format(row['ratio'])
+        if row.get('regression', False):
+            line += ' REGRESSION'
+        print(line)
+    print('Results written to ' + results_filename)
+    return results
+
+
+def print_timings(name, timings):
+    """Prints the timings of one benchmark"""
+    print('{}: legacy {:.4f} s, bulk {:.4f} s, speedup {:.1f}x'.format(
+          name, timings['legacy'], timings['bulk'],
+          timings['legacy'] / timings['bulk']))
+
+
+def main():
+    """Times fpho_setup functions, run from the main directory
+
+    Parameters
+    ----------
+    --suite
+        Time every stage of the pipeline on the sample and scaled
+        up recordings instead of the legacy comparisons
+    --results, --baseline
+        csv files the suite timings are written to and compared
+        against
+    --scales, --synthetic_minutes, --repeat
+        Recordings the suite times and the runs of each stage
+    --save_baseline
+        Store the suite timings as the new baseline
+
+    Returns
+    -------
+        Without --suite, prints legacy against new timings of
+        import, fits, isosbestic normalization, plots and rendering
+        With --suite, writes the results csv and exits with an
+        error when a stage is slower than the baseline
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suite', action='store_true',
+                        help='time every stage against a baseline')
+    parser.add_argument('--results', type=str,
+                        default='benchmark_results.csv',
+                        help='csv the suite timings are written to')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILENAME,
+                        help='csv of stored suite timings')
+    parser.add_argument('--scales', type=int, nargs='*',
+                        default=SUITE_SCALES,
+                        help='repeats of the sample recording to time')
+    parser.add_argument('--synthetic_minutes', type=float, nargs='*',
+                        default=[],
+                        help='lengths of synthetic recordings to time')
+    parser.add_argument('--repeat', type=int, default=SUITE_REPEAT,
+                        help='runs of each stage in the suite')
+    parser.add_argument('--save_baseline', action='store_true',
+                        help='store the suite timings as the baseline')
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite(args.results, args.baseline, args.scales,
+                            args.synthetic_minutes, args.repeat,
+                            args.save_baseline)
+        if results.get('regression', pd.Series([False])).any():
+            print('Error: stages slower than the baseline')
+            sys.exit(1)
+        return
+
+    sample_files = [('Python/SampleData/1fiberSignal.csv', 1),
+                    ('Python/SampleData/2fiberSignal.csv', 2)]
+    for input_filename, n_fibers in sample_files:
+        print_timings(input_filename,
+                      bench_import(input_filename, n_fibers))
+
+    # Photobleaching fits, on the sample data and on longer
+    # synthetic recordings
+    with tempfile.TemporaryDirectory() as tmp:
+        session = fpho_setup.import_fpho_data(
+            'Python/SampleData/1fiberSignal.csv',
+            os.path.join(tmp, 'benchmark'), 1, 3, 'benchmark', '', '')
+    print_timings('fit f1GreenGreen',
+                  bench_fit(session['fTimeGreen'], session['f1GreenGreen']))
+    for n_samples in [10**4, 10**5, 10**6]:
+        time, signal = synthetic_bleaching(n_samples)
+        timings = bench_fit(time, signal, repeat=1)
+        print_timings('fit {} samples'.format(n_samples), timings)
+        print('    mean squared residual: legacy {:.4g}, bulk {:.4g}'.format(
+              timings['legacy_mse'], timings['bulk_mse']))
+
+    # Sliding window isosbestic fits against one fit of the recording
+    for n_samples in [10**5, 10**6]:
+        timings = bench_iso_norm(n_samples)
+        print('isosbestic norm {} samples x 12 channels: global {:.4f} s,'
+              ' 60 s window {:.4f} s ({:.1f}x)'.format(
+                  n_samples, timings['global'], timings['window'],
+                  timings['window'] / timings['global']))
+
+    # Drawing traces, full against a min/max envelope
+    for n_samples in [10**5, 10**6, 10**7]:
+        print_timings('plot {} samples'.format(n_samples),
+                      bench_plot(n_samples))
+
+    # Drawing figures on a pool of worker processes
+    print_timings('render 8 figures on {} CPUs'.format(os.cpu_count()),
+                  bench_render(8, 10**5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""Library of functions to cache parsed fiber photometry data
+    * cache_dir_for - finds the cache directory next to the output
+    * file_hash - hashes the contents of an input file
+    * cache_key - builds a key from the input file and its settings
+    * stage_key - builds a key for a pipeline stage from what it reads
+    * cached_stage - loads a stage's arrays or computes and saves them
+    * load_cached - loads cached arrays as memory-mapped files
+    * save_cached - saves arrays in the cache
+    * evict_cache - deletes least recently used entries over a size limit
+    * clear_cache - deletes every cache entry
+"""
+import sys
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# Bump when the cached arrays change for the same input and settings
+cache_version = 3
+
+# Name of the cache directory, created next to the output files
+CACHE_DIRNAME = '.fpho_cache'
+
+# Default size limit of the cache in megabytes
+CACHE_MAX_MB = 1024
+
+
+def cache_dir_for(output_filename):
+    """Takes an output file name, returns the cache directory
+
+        Parameters
+        ----------
+        output_filename: string
+                name for output files, may include a directory
+
+        Returns:
+        --------
+        cache_dir: string
+                path of the cache directory next to the output
+    """
+    return os.path.join(os.path.dirname(output_filename), CACHE_DIRNAME)
+
+
+def file_hash(input_filename, cache_dir=None):
+    """Takes a file name, returns a hash of its contents
+
+        If cache_dir is given, hashes are remembered in an index
+        keyed on the file path, size and modification time, so an
+        unchanged file is not read again.
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the input file
+        cache_dir: string
+                cache directory holding the hash index
+                default = None
+
+        Returns:
+        --------
+        digest: string
+                hex digest of the file contents
+    """
+    try:
+        stat = os.stat(input_filename)
+    except (FileNotFoundError, TypeError):
+        print("Could not find file: " + str(input_filename))
+        sys.exit(1)
+
+    path = os.path.abspath(input_filename)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    index = {}
+    if cache_dir is not None:
+        index_file = os.path.join(cache_dir, 'index.json')
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        if path in index and index[path][:2] == signature:
+            return index[path][2]
+
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(input_filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    except PermissionError:
+        print("Could not access file: " + input_filename)
+        sys.exit(2)
+    digest = digest.hexdigest()
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        index[path] = signature + [digest]
+        write_json(index, index_file)
+
+    return digest
+
+
+def cache_key(input_filename, settings, cache_dir=None):
+    """Takes an input file and its parse settings, returns a cache key
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the input file
+        settings: dictionary
+                settings that change the parsed arrays, e.g.
+                n_fibers, f1greencol and f2greencol
+        cache_dir: string
+                cache directory holding the hash index
+                default = None
+
+        Returns:
+        --------
+        key: string
+                hex key naming the cache entry
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(file_hash(input_filename, cache_dir=cache_dir).encode())
+    key.update(json.dumps({'cache_version': cache_version,
+                           'settings': {name: str(settings[name])
+                                        for name in settings}},
+                          sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def stage_key(stage, settings, inputs=(), files=(), cache_dir=None):
+    """Takes a pipeline stage and what it depends on, returns a cache key
+
+        Parameters
+        ----------
+        stage: string
+                name of the stage
+        settings: dictionary
+                config values that change the stage output
+        inputs: list of strings
+                keys of the stages whose output it reads
+        files: list of strings
+                paths of the input files it reads, hashed by contents
+        cache_dir: string
+                cache directory holding the hash index
+                default = None
+
+        Returns:
+        --------
+        key: string
+                hex key naming the cache entry, the same as long as
+                the stage, its settings, inputs and files are
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(json.dumps({'cache_version': cache_version,
+                           'stage': stage,
+                           'settings': {name: str(settings[name])
+                                        for name in settings},
+                           'inputs': list(inputs),
+                           'files': [file_hash(filename,
+                                               cache_dir=cache_dir)
+                                     for filename in files]},
+                          sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def cached_stage(cache_dir, key, compute, outputs=()):
+    """Loads the arrays a stage saved under a key, or runs the stage
+        and saves them
+
+        Parameters
+        ----------
+        cache_dir: string
+                path of the cache directory, None to always run
+        key: string
+                key from stage_key
+        compute: function
+                runs the stage, takes no arguments and returns a
+                dictionary of numpy arrays
+        outputs: list of strings
+                files the stage writes, it is run again if one is
+                missing
+
+        Returns:
+        --------
+        arrays: dictionary
+                numpy arrays keyed by name, memory-mapped when loaded
+        cached: boolean
+                True if the arrays were loaded from the cache
+    """
+    missing = [output for output in outputs if not os.path.exists(output)]
+    if cache_dir is not None and not missing:
+        arrays = load_cached(cache_dir, key)
+        if arrays is not None:
+            return arrays, True
+
+    arrays = compute()
+    if cache_dir is not None:
+        save_cached(cache_dir, key, arrays)
+    return arrays, False
+
+
+def load_cached(cache_dir, key):
+    """Loads the arrays saved under a key
+
+        Parameters
+        ----------
+        cache_dir: string
+                path of the cache directory
+        key: string
+                key from cache_key
+
+        Returns:
+        --------
+        arrays: dictionary
+                read-only memory-mapped numpy arrays keyed by name,
+                or None if the key is not cached
+    """
+    entry = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(entry, 'names.json'), 'r') as f:
+            names = json.load(f)
+        arrays = {name: np.load(os.path.join(entry, name + '.npy'),
+                                mmap_mode='r')
+                  for name in names}
+    except (FileNotFoundError, ValueError):
+        return None
+
+    # Mark as recently used for evict_cache
+    os.utime(entry)
+    return arrays
+
+
+def save_cached(cache_dir, key, arrays):
+    """Saves arrays under a key, one .npy file per array
+
+        Parameters
+        ----------
+        cache_dir: string
+                path of the cache directory
+        key: string
+                key from cache_key
+        arrays: dictionary
+                numpy arrays keyed by name
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+
+    # Write to a temporary directory, then rename so a cache
+    # entry is never read half written
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+    for name in arrays:
+        np.save(os.path.join(tmp, name + '.npy'),
+                np.ascontiguousarray(arrays[name]))
+    with open(os.path.join(tmp, 'names.json'), 'w') as f:
+        json.dump(list(arrays), f)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Already saved by another run
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def evict_cache(cache_dir, max_mb=CACHE_MAX_MB):
+    """Deletes least recently used entries until the cache fits
+
+        Parameters
+        ----------
+        cache_dir: string
+                path of the cache directory
+        max_mb: number
+                size limit of the cache in megabytes
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry) or name.startswith('.tmp_'):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, f))
+                   for f in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, entry))
+
+    total = sum(size for mtime, size, entry in entries)
+    for mtime, size, entry in sorted(entries):
+        if total <= max_mb * 2**20:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def clear_cache(cache_dir):
+    """Deletes every cache entry and the hash index
+
+        Parameters
+        ----------
+        cache_dir: string
+                path of the cache directory
+    """
+    if os.path.basename(os.path.normpath(cache_dir)) != CACHE_DIRNAME:
+        print("Refusing to clear " + cache_dir
+              + ", not a " + CACHE_DIRNAME + " directory")
+        sys.exit(1)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def write_json(data, filename):
+    """Writes data as JSON, replacing filename in one step
+
+        Parameters
+        ----------
+        data: dictionary or list
+                JSON serializable data
+        filename: string
+                path of the output file
+    """
+    tmp = filename + '.tmp' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, filename)
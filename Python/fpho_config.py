@@ -1,80 +1,449 @@
 """This file runs the functions in the fpho_setup library"""
 import argparse
+import json
+import os
 import sys
 import fpho_setup
+import fpho_cache
+import fpho_filter
+import fpho_plot
+import fpho_profile
+import fpho_session
 import yaml
 import behavior_setup
+import numpy as np
 import pandas as pd
 
 
-def main():
-    """Runs functions in fpho_setup, processes config.yml
+def run_config(config):
+    """Runs the import, plots and analysis asked for in a config
 
     Parameters
     ----------
-    config.yml
-        To use this driver, update the config.yml file, then
-        run the following bash command:
-        python fpho_config.py --config config.yml
+    config: dictionary
+        settings loaded from config.yml
 
     Returns
     -------
-        Pandas dataframe of parsed fiber photometry data
+        Session of parsed fiber photometry data
         Writes an output CSV/XLXS to specified file name
         Outputs specified plots and analysis
+        With profile set, writes output_filename_Timing.json, see
+        fpho_profile.stop_profiling
     """
-    parser = argparse.ArgumentParser()
+    if config.get('profile', False) is not True:
+        return run_stages(config)
 
-    parser.add_argument('--config', type=str, required=True)
-    args = parser.parse_args()
+    fpho_profile.start_profiling(
+        memory=config.get('profile_memory', False),
+        cprofile=config.get('profile_cprofile', False))
+    try:
+        return run_stages(config)
+    finally:
+        fpho_profile.stop_profiling(config['output_filename'])
 
-    # Opens and reads config file to process
-    f = open(args.config, 'r')
-    config = yaml.load(f, Loader=yaml.FullLoader)
-    f.close()
 
-    # Generate the dataframe with data
-    fpho_df = fpho_setup.import_fpho_data(input_filename=(
-                                              config['input_filename']),
-                                          output_filename=(
-                                              config['output_filename']),
-                                          n_fibers=(
-                                              config['n_fibers']),
-                                          f1greencol=(
-                                              config['f1greencol']),
-                                          f2greencol=(
-                                              config['f2greencol']),
-                                          animal_ID=(
-                                              config['animal_ID']),
-                                          exp_date=(
-                                              config['exp_date']),
-                                          exp_desc=(
-                                              config['exp_desc']),
-                                          write_xlsx=(
-                                               config['write_xlsx']))
+# Config keys each stage depends on, besides the stages and input files
+# it reads. Plot flags are left out, they only choose which stages run.
+STAGE_SETTINGS = {
+    'import': ['n_fibers', 'f1greencol', 'f2greencol', 'fiber_columns',
+               'animal_ID', 'exp_date', 'exp_desc', 'signal_dtype',
+               'resample', 'resample_hz', 'output_filename', 'write_xlsx',
+               'summary_format'],
+    'filter': ['filter_kind', 'filter_hz', 'filter_window_sec'],
+    'normalize': ['iso_fit_window_sec'],
+    'percentile_dff': ['dff_window_sec', 'dff_percentile'],
+    'fit': [],
+    'align': ['video_fps'],
+    'zscore': ['zscore_channels', 'zscore_behaviors', 'zscore_baseline',
+               'zscore_window'],
+}
+
+# File in the cache directory recording the key each figure was drawn
+# from, see render_stage
+FIGURE_INDEX = 'figures.json'
+
+
+def stage_key(config, stage, cache_dir, inputs=(), files=()):
+    """Takes a config and a stage, returns the stage's cache key
+
+        Parameters
+        ----------
+        config: dictionary
+                settings loaded from config.yml
+        stage: string
+                name in STAGE_SETTINGS
+        cache_dir: string
+                cache directory, None when stages are not cached
+        inputs: list of strings
+                keys of the stages it reads
+        files: list of strings
+                config keys of the input files it reads
+
+        Returns:
+        --------
+        key: string
+                see fpho_cache.stage_key, None without cache_dir
+    """
+    if cache_dir is None:
+        return None
+    return fpho_cache.stage_key(
+        stage, {name: config.get(name) for name in STAGE_SETTINGS[stage]},
+        inputs=inputs, files=[config[name] for name in files],
+        cache_dir=cache_dir)
+
+
+def session_from_arrays(arrays, config):
+    """Builds the session saved by the import or filter stage"""
+    n_fibers = len(arrays['signals']) // (len(fpho_session.COLORS)
+                                          * len(fpho_session.SLOTS))
+    return fpho_session.Session(
+        arrays['signals'], arrays['times'],
+        fpho_session.signal_names(n_fibers), animalID=config['animal_ID'],
+        date=config['exp_date'], description=config['exp_desc'])
+
+
+def import_stage(config):
+    """Imports the session of a config, see fpho_setup.import_fpho_data
+
+        The parsed session is not cached here, run_stages caches the
+        output of this stage with the others.
+    """
+    session = fpho_setup.import_fpho_data(
+        input_filename=config['input_filename'],
+        output_filename=config['output_filename'],
+        n_fibers=config['n_fibers'],
+        f1greencol=config['f1greencol'],
+        f2greencol=config['f2greencol'],
+        column_map=config.get('fiber_columns', None),
+        animal_ID=config['animal_ID'],
+        exp_date=config['exp_date'],
+        exp_desc=config['exp_desc'],
+        write_xlsx=config['write_xlsx'],
+        use_cache=False,
+        dtype=config.get('signal_dtype', 'float64'),
+        summary_format=config.get('summary_format', 'csv'),
+        resample=config.get('resample', False),
+        resample_hz=(config.get('resample_hz') or None))
+    return {'signals': session.signals, 'times': session.times}
+
+
+def filter_stage(config, session):
+    """Filters every channel of a session, see fpho_filter.filter_session"""
+    filtered = fpho_filter.filter_session(
+        session, config['filter_kind'], cutoff=config.get('filter_hz'),
+        window_sec=config.get('filter_window_sec'))
+    return {'signals': filtered.signals, 'times': filtered.times}
+
+
+def normalize_stage(config, session):
+    """Normalizes a session to the isosbestic, see
+        fpho_setup.isosbestic_norm
+    """
+    with fpho_profile.stage('normalize'):
+        return fpho_setup.isosbestic_norm(
+            session, window_sec=(config.get('iso_fit_window_sec') or None))[0]
+
+
+def percentile_dff_stage(config, session):
+    """dF/F of a session to a rolling percentile, see
+        fpho_setup.percentile_dff
+    """
+    with fpho_profile.stage('rolling_baseline'):
+        return fpho_setup.percentile_dff(
+            session,
+            window_sec=config.get('dff_window_sec',
+                                  fpho_setup.DFF_WINDOW_SEC),
+            percentile=config.get('dff_percentile',
+                                  fpho_setup.DFF_PERCENTILE))[0]
+
+
+def fit_stage(config, session):
+    """Fits photobleaching of a session, see
+        fpho_setup.fit_bleaching_session
+    """
+    with fpho_profile.stage('fit'):
+        fits = fpho_setup.fit_bleaching_session(session)
+    return {label + '_' + name: fits[label][name]
+            for label in fits for name in ['time', 'fit']}
+
+
+def align_stage(config):
+    """Imports behavior and returns the onset of every event on the
+        Bonsai clock, see behavior_setup.import_behavior_data
+    """
+    behaviorData = behavior_setup.import_behavior_data(
+        config['BORIS_file'], config['timestamp_file'],
+        fps=(config.get('video_fps') or None))
+    onsets = behaviorData[behaviorData['Behavior'].notna()
+                          & (behaviorData['Status'].isna()
+                             | behaviorData['Status'].isin(
+                                 ['POINT', 'START']))]
+    return {'behavior': onsets['Behavior'].to_numpy(dtype=str),
+            'time': onsets['Time (total msec)'].to_numpy(dtype=np.float64)}
+
+
+def zscore_stage(config, session, arrays):
+    """Z-scores the channels of a config around the events from
+        align_stage, see behavior_setup.zscore_results
+    """
+    behaviorData = pd.DataFrame({'Time (total msec)': arrays['time'],
+                                 'Behavior': arrays['behavior'],
+                                 'Status': None})
+    results = behavior_setup.zscore_results(
+        session, behaviorData,
+        channels=config.get('zscore_channels',
+                            behavior_setup.ZSCORE_CHANNELS),
+        behaviors=config.get('zscore_behaviors') or None,
+        baseline=config.get('zscore_baseline',
+                            behavior_setup.ZSCORE_BASELINE),
+        window=config.get('zscore_window', behavior_setup.ZSCORE_WINDOW))
+    saved = {'keys': np.array(list(results), dtype=str).reshape(-1, 2)}
+    for i, result in enumerate(results.values()):
+        for field in result:
+            saved[str(i) + '_' + field] = result[field]
+    return saved
+
+
+def zscore_from_arrays(arrays):
+    """Rebuilds the results of zscore_stage keyed by (channel,
+        behavior)
+    """
+    results = {}
+    for i, (channel, behavior) in enumerate(arrays['keys'].tolist()):
+        prefix = str(i) + '_'
+        results[(channel, behavior)] = {
+            name[len(prefix):]: arrays[name] for name in arrays
+            if name.startswith(prefix)}
+    return results
+
+
+def job_key(job, key):
+    """Takes a figure job and the key of the stage it draws, returns a
+        key that changes with the figure
+    """
+    settings = {'filename': job['filename'], 'draw': job['draw'].__name__,
+                'savefig': job['savefig']}
+    for name, value in job['kwargs'].items():
+        # Arrays come from the stage, so its key covers them
+        if isinstance(value, (np.ndarray, dict)) or (
+                isinstance(value, list)
+                and any(isinstance(item, np.ndarray) for item in value)):
+            continue
+        settings[name] = value
+    return fpho_cache.stage_key('render', settings, inputs=[key])
+
+
+def render_stage(jobs, cache_dir, workers=0):
+    """Draws the figures whose stage output or settings changed
+
+        Parameters
+        ----------
+        jobs: list of tuples
+                (stage key, fpho_plot.figure_job)
+        cache_dir: string
+                cache directory, None to draw every figure
+        workers: integer
+                see fpho_plot.render_figures
+
+        Returns:
+        --------
+        skipped: integer
+                figures already drawn from the same keys
+    """
+    if cache_dir is None:
+        fpho_plot.render_figures([job for key, job in jobs],
+                                 workers=workers)
+        return 0
+
+    index_file = os.path.join(cache_dir, FIGURE_INDEX)
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    todo = []
+    for key, job in jobs:
+        filename = os.path.abspath(job['filename'])
+        key = job_key(job, key)
+        if not (os.path.exists(filename) and index.get(filename) == key):
+            todo.append((filename, key, job))
+
+    fpho_plot.render_figures([job for filename, key, job in todo],
+                             workers=workers)
+    for filename, key, job in todo:
+        index[filename] = key
+    os.makedirs(cache_dir, exist_ok=True)
+    fpho_cache.write_json(index, index_file)
+    return len(jobs) - len(todo)
+
+
+def run_stages(config):
+    """Runs each stage asked for in a config, see run_config
+
+        Stages form a graph: import, filter, then normalize,
+        percentile_dff and fit of the session, align of the behavior
+        files, zscore of both and render of every figure. With
+        use_cache, each stage's output is saved in the cache under a
+        key of its settings and the stages and files it reads, so a
+        rerun only runs the stages a config change affects and only
+        draws figures that would change.
+    """
+    cache_dir = None
+    if config.get('use_cache', False) is True:
+        cache_dir = fpho_cache.cache_dir_for(config['output_filename'])
+
+    # Clears the cache if specified
+    if config.get('clear_cache', False) is True:
+        fpho_cache.clear_cache(
+            fpho_cache.cache_dir_for(config['output_filename']))
+
+    reused = []
+
+    def run(stage, key, compute, outputs=()):
+        arrays, cached = fpho_cache.cached_stage(cache_dir, key, compute,
+                                                 outputs=outputs)
+        if cached:
+            reused.append(stage)
+        return arrays
+
+    # Generate the session with data
+    with fpho_profile.stage('import_fpho_data'):
+        importKey = stage_key(config, 'import', cache_dir,
+                              files=['input_filename'])
+        summaries = [config['output_filename'] + '_Summary'
+                     + fpho_setup.SUMMARY_FORMATS.get(
+                         config.get('summary_format', 'csv'), '')]
+        if config['write_xlsx'] is True:
+            summaries.append(config['output_filename'] + '_Summary.xlsx')
+        session = session_from_arrays(
+            run('import', importKey, lambda: import_stage(config),
+                outputs=summaries), config)
+    sessionKey = importKey
+
+    # Filters every channel if specified
+    if config.get('filter_kind'):
+        with fpho_profile.stage('filter'):
+            sessionKey = stage_key(config, 'filter', cache_dir,
+                                   inputs=[importKey])
+            session = session_from_arrays(
+                run('filter', sessionKey,
+                    lambda: filter_stage(config, session)), config)
+
+    # Figures are collected with the key of the stage they draw, and
+    # drawn together at the end
+    jobs = []
 
     # Plot raw signal if specified
     if config['plot_raw_signal'] is True:
-        fpho_setup.raw_signal_trace(fpho_df, config['output_filename'])
+        jobs += [(sessionKey, job) for job in fpho_setup.raw_signal_figures(
+            session, config['output_filename'],
+            fpho_setup.select_raw_channels(
+                session, config.get('raw_signal_channels', 'all')))]
 
     # Plots isosbestic fit if specified
     if config['plot_iso_fit'] is True:
-        fpho_setup.plot_isosbestic_norm(fpho_df, config['output_filename'])
+        with fpho_profile.stage('isosbestic_norm'):
+            key = stage_key(config, 'normalize', cache_dir,
+                            inputs=[sessionKey])
+            normData = run('normalize', key,
+                           lambda: normalize_stage(config, session))
+            jobs += [(key, job) for job in fpho_setup.isosbestic_norm_figures(
+                session, config['output_filename'],
+                window_sec=(config.get('iso_fit_window_sec') or None),
+                normData=normData)]
+
+    # Plots dF/F to a rolling percentile baseline if specified
+    if config.get('plot_percentile_dff', False) is True:
+        with fpho_profile.stage('percentile_dff'):
+            key = stage_key(config, 'percentile_dff', cache_dir,
+                            inputs=[sessionKey])
+            dff = run('percentile_dff', key,
+                      lambda: percentile_dff_stage(config, session))
+            jobs += [(key, job) for job in fpho_setup.percentile_dff_figures(
+                session, config['output_filename'],
+                window_sec=config.get('dff_window_sec',
+                                      fpho_setup.DFF_WINDOW_SEC),
+                percentile=config.get('dff_percentile',
+                                      fpho_setup.DFF_PERCENTILE), dff=dff)]
 
     # Plots fitted exponent if specified
     if config['plot_fit_exp'] is True:
-        fpho_setup.plot_fitted_exp(fpho_df, config['output_filename'])
+        with fpho_profile.stage('fitted_exp'):
+            key = stage_key(config, 'fit', cache_dir, inputs=[sessionKey])
+            arrays = run('fit', key, lambda: fit_stage(config, session))
+            fits = {label: {name: arrays[label + '_' + name]
+                            for name in ['time', 'fit']}
+                    for label, isoName, sigName, timeName
+                    in fpho_setup.isosbestic_pairs(session)}
+            jobs += [(key, job) for job in fpho_setup.fitted_exp_figures(
+                session, config['output_filename'], fits=fits)]
 
     # Imports behavior data if specified
-    behaviorData = pd.DataFrame()
     if config['import_behavior'] is True:
-        behaviorData = behavior_setup.import_behavior_data(
-                                            config['BORIS_file'],
-                                            config['timestamp_file'])
+        with fpho_profile.stage('import_behavior_data'):
+            alignKey = stage_key(config, 'align', cache_dir,
+                                 files=['BORIS_file', 'timestamp_file'])
+            events = run('align', alignKey, lambda: align_stage(config))
 
     # Plots z-score analysis of behavior if specified
     if config['plot_zscore'] is True:
-        behavior_setup.plot_zscore(behaviorData, config['output_filename'])
+        if config['import_behavior'] is not True:
+            print("\nError: plot_zscore needs import_behavior set to True")
+            sys.exit(1)
+        with fpho_profile.stage('zscore'):
+            key = stage_key(config, 'zscore', cache_dir,
+                            inputs=[sessionKey, alignKey])
+            results = zscore_from_arrays(run(
+                'zscore', key, lambda: zscore_stage(config, session, events)))
+        jobs += [(key, job) for job in behavior_setup.zscore_figures(
+            session, results, config['output_filename'],
+            baseline=config.get('zscore_baseline',
+                                behavior_setup.ZSCORE_BASELINE))]
+
+    # Draws the figures that changed, one per worker process
+    with fpho_profile.stage('render_figures'):
+        skipped = render_stage(jobs, cache_dir,
+                               workers=config.get('plot_workers', 0))
+
+    if cache_dir is not None:
+        fpho_cache.evict_cache(cache_dir,
+                               max_mb=config.get('cache_max_mb',
+                                                 fpho_cache.CACHE_MAX_MB))
+    if reused or skipped:
+        print('Reused unchanged stages: ' + ', '.join(reused)
+              + ' and ' + str(skipped) + ' figures')
+
+    return session
+
+
+def main():
+    """Runs functions in fpho_setup, processes config.yml
+
+    Parameters
+    ----------
+    config.yml
+        To use this driver, update the config.yml file, then
+        run the following bash command:
+        python fpho_config.py --config config.yml
+
+    Returns
+    -------
+        Session of parsed fiber photometry data
+        Writes an output CSV/XLXS to specified file name
+        Outputs specified plots and analysis
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--config', type=str, required=True)
+    args = parser.parse_args()
+
+    # Opens and reads config file to process
+    f = open(args.config, 'r')
+    config = yaml.load(f, Loader=yaml.FullLoader)
+    f.close()
+
+    return run_config(config)
 
 
 if __name__ == '__main__':
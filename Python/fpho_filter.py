@@ -0,0 +1,236 @@
+"""Zero-phase filters for every channel of a session
+    * sample_rate - samples per second of a session
+    * filter_overlap - samples a filter's transients last
+    * design_filter - describes a lowpass, bandpass or median filter
+    * apply_filter - filters the rows of an array forwards and backwards
+    * filter_blocks - filters blocks of a session in overlapping chunks
+    * filter_session - filters every channel of a session
+
+    Lowpass and bandpass filters are Butterworth filters in second
+    order sections, run forwards and backwards so peaks do not move.
+    All signal channels are filtered at once as one 2-D array.
+    Recordings are filtered in chunks of FILTER_CHUNK samples with
+    filter_overlap samples of the recording on either side, so
+    memory use does not grow with the recording and each chunk
+    matches filtering the whole recording at once. The ends of the
+    recording are padded the same way scipy.signal.sosfiltfilt pads
+    them.
+"""
+import sys
+import numpy as np
+import scipy.ndimage
+import scipy.signal
+import fpho_session
+
+# Filters of design_filter
+FILTER_KINDS = ('lowpass', 'bandpass', 'median')
+
+# Order of lowpass and bandpass Butterworth filters
+FILTER_ORDER = 4
+
+# Samples of every channel filtered at once
+FILTER_CHUNK = 2**18
+
+# Fraction of a transient left at the end of the overlap between
+# chunks, see filter_overlap
+FILTER_SETTLE = 1e-9
+
+
+def sample_rate(session):
+    """Takes a session, returns its median samples per second"""
+    if len(session) < 2:
+        return 1.0
+    return 1000 / np.median(np.diff(session['fTimeGreen']))
+
+
+def filter_overlap(sos):
+    """Takes second order sections, returns the samples their
+        transients take to decay to FILTER_SETTLE
+
+        The slowest transient decays as the largest pole radius to
+        the power of the samples passed.
+    """
+    radius = np.abs(scipy.signal.sos2zpk(sos)[1]).max()
+    if radius == 0:
+        return 1
+    return int(np.ceil(np.log(FILTER_SETTLE) / np.log(radius)))
+
+
+def design_filter(kind, rate, cutoff=None, window_sec=None,
+                  order=FILTER_ORDER):
+    """Describes a filter for signals sampled at rate
+
+        Parameters
+        ----------
+        kind: string
+                lowpass, bandpass or median
+        rate: number
+                samples per second, see sample_rate
+        cutoff: number or list of two numbers
+                cutoff in Hz for lowpass, [low, high] in Hz for
+                bandpass
+        window_sec: number
+                seconds in the median window, rounded to an odd
+                number of samples
+        order: integer
+                Butterworth filter order
+                default = FILTER_ORDER
+
+        Returns:
+        --------
+        spec: dictionary
+                kind, sos (second order sections) or size (median
+                window samples), and overlap, the samples of context
+                each chunk needs on either side
+    """
+    if kind not in FILTER_KINDS:
+        print("\nError: Filter <" + str(kind) + "> was invalid."
+              + " Please enter one of " + ", ".join(FILTER_KINDS))
+        sys.exit(1)
+
+    if kind == 'median':
+        try:
+            window_sec = float(window_sec)
+        except (TypeError, ValueError):
+            window_sec = 0
+        if window_sec <= 0:
+            print("\nError: Median window <" + str(window_sec)
+                  + "> was invalid. Please enter a number of seconds"
+                  + " above 0\n")
+            sys.exit(1)
+        size = int(round(window_sec * rate)) // 2 * 2 + 1
+        return {'kind': kind, 'size': size, 'overlap': size // 2}
+
+    # Cutoffs must fall between 0 and the Nyquist frequency, low first
+    try:
+        edges = np.atleast_1d(np.asarray(cutoff, dtype=np.float64))
+    except (TypeError, ValueError):
+        edges = np.array([])
+    n_edges = 1 if kind == 'lowpass' else 2
+    if (len(edges) != n_edges or not (edges > 0).all()
+            or not (edges < rate / 2).all() or not (np.diff(edges) > 0).all()):
+        print("\nError: Cutoff <" + str(cutoff) + "> was invalid for a "
+              + kind + " filter. Please enter " + str(n_edges)
+              + " ascending frequencies in Hz between 0 and "
+              + "{:g}".format(rate / 2) + "\n")
+        sys.exit(1)
+    sos = scipy.signal.butter(order, edges if n_edges > 1 else edges[0],
+                              btype=kind, fs=rate, output='sos')
+    return {'kind': kind, 'sos': sos, 'overlap': filter_overlap(sos)}
+
+
+def apply_filter(spec, signals):
+    """Filters every row of an array forwards and backwards
+
+        Parameters
+        ----------
+        spec: dictionary
+                from design_filter
+        signals: numpy array
+                shape (channels, samples)
+
+        Returns:
+        --------
+        filtered: numpy array
+                float64, same shape as signals
+    """
+    if signals.shape[1] == 0:
+        return np.array(signals, dtype=np.float64)
+    if spec['kind'] == 'median':
+        return scipy.ndimage.median_filter(
+            np.asarray(signals, dtype=np.float64),
+            size=(1, spec['size']), mode='nearest')
+    sos = spec['sos']
+    return scipy.signal.sosfiltfilt(
+        sos, signals, axis=1,
+        padlen=min(3 * (2 * len(sos) + 1), signals.shape[1] - 1))
+
+
+def filter_blocks(blocks, spec, chunk=FILTER_CHUNK):
+    """Filters blocks of a session in overlapping chunks
+
+        Each chunk is filtered with spec['overlap'] samples of the
+        recording before and after it, which are then dropped, so
+        the result matches filtering the whole recording at once.
+
+        Parameters
+        ----------
+        blocks: iterable of Session
+                blocks in time order, e.g. from
+                fpho_setup.stream_fpho_data
+        spec: dictionary
+                from design_filter
+        chunk: integer
+                samples filtered at once
+                default = FILTER_CHUNK
+
+        Returns:
+        --------
+        blocks: generator of Session
+                filtered blocks of chunk samples, the last one
+                shorter. Time channels are unchanged.
+    """
+    overlap = spec['overlap']
+    chunk = max(chunk, overlap, 1)
+    signals = None
+    # Samples at the start of signals that were already yielded
+    context = 0
+
+    for block in blocks:
+        if signals is None:
+            names = block.names
+            dtype = block.signals.dtype
+            signals = block.signals
+            times = block.times
+        else:
+            signals = np.concatenate([signals, block.signals], axis=1)
+            times = np.concatenate([times, block.times], axis=1)
+
+        while signals.shape[1] - context - overlap >= chunk:
+            filtered = apply_filter(
+                spec, signals[:, :context + chunk + overlap])
+            yield fpho_session.Session(
+                filtered[:, context:context + chunk].astype(dtype),
+                times[:, context:context + chunk], names)
+            start = context + chunk - overlap
+            signals = signals[:, start:]
+            times = times[:, start:]
+            context = overlap
+
+    if signals is not None and signals.shape[1] > context:
+        filtered = apply_filter(spec, signals)
+        yield fpho_session.Session(filtered[:, context:].astype(dtype),
+                                   times[:, context:], names)
+
+
+def filter_session(session, kind, cutoff=None, window_sec=None,
+                   order=FILTER_ORDER, chunk=FILTER_CHUNK):
+    """Filters every signal channel of a session
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        kind, cutoff, window_sec, order: see design_filter
+        chunk: integer
+                samples filtered at once, see filter_blocks
+                default = FILTER_CHUNK
+
+        Returns:
+        --------
+        session: Session
+                filtered signals in the same data type, with the
+                same times, names and metadata
+    """
+    spec = design_filter(kind, sample_rate(session), cutoff=cutoff,
+                         window_sec=window_sec, order=order)
+    if len(session) == 0:
+        return session
+    blocks = (fpho_session.Session(session.signals[:, start:start + chunk],
+                                   session.times[:, start:start + chunk],
+                                   session.names)
+              for start in range(0, len(session), chunk))
+    return fpho_session.Session.concatenate(
+        filter_blocks(blocks, spec, chunk=chunk),
+        animalID=session.animalID, date=session.date,
+        description=session.description, dtype=session.signals.dtype)
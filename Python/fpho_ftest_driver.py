@@ -3,7 +3,6 @@
    test_fpho_driver.sh"""
 
 import argparse
-import sys
 import fpho_setup
 
 
@@ -33,6 +32,10 @@ def main():
             optional plot of raw data for a
             particular fiber
 
+    raw_channels: list of strings
+            channels for the raw data plot, e.g. f1Red,
+            default all
+
     plot_iso_fit: boolean
             optional isosbestic plot
 
@@ -41,7 +44,7 @@ def main():
 
     Returns
     -------
-    Pandas dataframe of parsed fiber photometry data
+    Session of parsed fiber photometry data
 
     Optional output:
         - Excel file of dataframe (.xlsx)
@@ -116,6 +119,13 @@ def main():
                         action='store_true',
                         help='add --plot_raw_signal to command line')
 
+    parser.add_argument('--raw_channels',
+                        dest='raw_channels',
+                        type=str,
+                        nargs='+',
+                        default=['all'],
+                        help='channels to plot with --plot_raw_signal')
+
     parser.add_argument('--plot_iso_fit',
                         dest='plot_iso_fit',
                         action='store_true',
@@ -128,8 +138,8 @@ def main():
 
     args = parser.parse_args()
 
-    # Generate the dataframe with data
-    fpho_df = fpho_setup.import_fpho_data(input_filename=args.input_filename,
+    # Generate the session with data
+    session = fpho_setup.import_fpho_data(input_filename=args.input_filename,
                                           output_filename=args.output_filename,
                                           write_xlsx=args.write_xlsx,
                                           n_fibers=args.n_fibers,
@@ -141,20 +151,18 @@ def main():
 
     # Plot raw signal if specified in command line
     if args.plot_raw_signal:
-        sys.stdin = open("Python/fpho_ftest_driver_input.txt")
-        fpho_setup.raw_signal_trace(fpho_dataframe=fpho_df,
-                                    output_filename=args.output_filename)
+        fpho_setup.raw_signal_trace(session=session,
+                                    output_filename=args.output_filename,
+                                    channels=args.raw_channels)
 
     # Prints isosbestic fit if specified
     if args.plot_iso_fit:
-        sys.stdin = open("Python/fpho_ftest_driver_input.txt")
-        fpho_setup.plot_isosbestic_norm(fpho_dataframe=fpho_df,
+        fpho_setup.plot_isosbestic_norm(session=session,
                                         output_filename=args.output_filename)
 
     # Prints fitted exponent if specified
     if args.plot_fit_exp:
-        sys.stdin = open("Python/fpho_ftest_driver_input.txt")
-        fpho_setup.plot_fitted_exp(fpho_dataframe=fpho_df,
+        fpho_setup.plot_fitted_exp(session=session,
                                    output_filename=args.output_filename)
 
 
@@ -0,0 +1,429 @@
+"""Follows a Bonsai csv while it is recorded and normalizes new frames
+    * read_new_lines - parses the complete lines added to a file
+    * tail_fpho_rows - yields rows of a Bonsai csv as it grows
+    * live_fpho_data - yields de-interleaved frames as they arrive
+    * RunningFit - isosbestic fit updated one block at a time
+    * live_norm - yields dF/F of new frames as they arrive
+    * write_live - appends dF/F to the _Live.csv file
+    * live_status - one line report of signal quality
+    * run_live - runs live mode for a config
+    * main - runs live mode from the command line
+
+    New rows are read every poll_sec seconds, so a frame is
+    normalized at most poll_sec plus one frame after Bonsai writes
+    its last row. Run from the main directory while Bonsai records:
+        python Python/fpho_live.py --config Python/config.yml
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import yaml
+import fpho_session
+import fpho_setup
+
+# Seconds between reads of the growing file
+LIVE_POLL_SEC = 0.5
+
+# Seconds without new rows before the recording is taken as finished
+LIVE_IDLE_SEC = 30.0
+
+# Seconds between signal quality reports
+LIVE_STATUS_SEC = 10.0
+
+# Rows collected before the first frames are normalized, the
+# interleave phase is found from them
+LIVE_MIN_ROWS = 300
+
+
+def read_new_lines(file, pending=''):
+    """Parses the complete lines added to an open file
+
+        Parameters
+        ----------
+        file: open text file
+                file being written, read from where the last call
+                stopped
+        pending: string
+                partial last line left by the last call
+
+        Returns:
+        --------
+        lines: list of strings
+                complete lines, commas replaced by spaces
+        pending: string
+                partial last line, completed by a later write
+    """
+    text, newline, pending = (pending + file.read()).rpartition('\n')
+    if not newline:
+        return [], pending
+    return text.replace(',', ' ').split('\n'), pending
+
+
+def tail_fpho_rows(input_filename, poll_sec=LIVE_POLL_SEC,
+                   idle_sec=LIVE_IDLE_SEC):
+    """Generator that yields rows of a Bonsai csv as it grows
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file being recorded
+        poll_sec: number
+                seconds between reads of the file
+        idle_sec: number
+                seconds without new rows, or without the file, after
+                which the recording is taken as finished
+
+        Yields:
+        --------
+        rows: numpy array
+                float array of shape (rows, columns) of the lines
+                added since the last block. As in iter_fpho_columns,
+                the first two lines of the file are not included.
+    """
+    last_change = time.monotonic()
+    while not os.path.exists(input_filename):
+        if time.monotonic() - last_change > idle_sec:
+            print("Could not find file: " + input_filename)
+            sys.exit(1)
+        time.sleep(poll_sec)
+
+    n_lines = 0
+    pending = ''
+    with open(input_filename, 'r') as file:
+        while True:
+            lines, pending = read_new_lines(file, pending)
+            if len(lines) > 0:
+                last_change = time.monotonic()
+            elif time.monotonic() - last_change > idle_sec:
+                return
+
+            # Skip the header and the line counted for columns
+            skip = min(len(lines), max(0, 2 - n_lines))
+            n_lines += len(lines)
+            lines = lines[skip:]
+            if len(lines) > 0:
+                try:
+                    yield np.loadtxt(lines, ndmin=2)
+                except ValueError:
+                    print("Could not parse numeric data in file: "
+                          + input_filename)
+                    sys.exit(1)
+            else:
+                time.sleep(poll_sec)
+
+
+def live_fpho_data(input_filename, n_fibers, f1greencol, f2greencol=None,
+                   column_map=None, poll_sec=LIVE_POLL_SEC,
+                   idle_sec=LIVE_IDLE_SEC, drops=None):
+    """Generator that yields de-interleaved frames as they arrive
+
+        Works like fpho_setup.stream_fpho_data on a file still being
+        written: the first ~5sec are trimmed, the phase is found from
+        the first LIVE_MIN_ROWS rows and frames are grouped by the
+        frame counter, see fpho_setup.align_frames.
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file being recorded
+        n_fibers, f1greencol, f2greencol, column_map:
+                see fpho_setup.import_fpho_data
+        poll_sec, idle_sec: numbers
+                see tail_fpho_rows
+        drops: list
+                a dictionary is appended for every dropped frame,
+                see fpho_setup.align_frames
+                default = None
+
+        Yields:
+        --------
+        block: Session
+                signal and time channels of the new whole frames,
+                without metadata
+    """
+    blocks = tail_fpho_rows(input_filename, poll_sec=poll_sec,
+                            idle_sec=idle_sec)
+
+    # Collect enough rows to find the interleave phase
+    first = []
+    n_rows = 0
+    for rows in blocks:
+        first.append(rows)
+        n_rows += len(rows)
+        if n_rows >= fpho_setup.SKIP_ROWS + LIVE_MIN_ROWS:
+            break
+    if n_rows < fpho_setup.SKIP_ROWS + 3:
+        print("Not enough data in file: " + input_filename)
+        sys.exit(1)
+    data = np.concatenate(first)
+
+    columns = fpho_setup.check_fpho_columns(data.shape[1], n_fibers,
+                                            f1greencol,
+                                            f2greencol=f2greencol,
+                                            column_map=column_map)
+    names = (['fTime']
+             + ['f' + str(fiber) + color
+                for fiber in range(1, (len(columns) - 1) // 2 + 1)
+                for color in fpho_session.COLORS])
+    col_idx = [columns['fTime'] - 1, 1] + [columns[name] - 1
+                                           for name in names[1:]]
+
+    # Trim first ~5sec from data, then follow the file
+    rows = (block[:, col_idx] for block in
+            itertools.chain([data[fpho_setup.SKIP_ROWS:]], blocks))
+    for frames in fpho_setup.align_frames(rows, drops=drops,
+                                          first_row=fpho_setup.SKIP_ROWS):
+        if len(frames) > 0:
+            yield fpho_setup.de_interleave_block(frames)
+
+
+class RunningFit(object):
+    """Isosbestic fit of every channel updated one block at a time
+
+        Keeps the sums of a least squares fit of signal = a *
+        isosbestic + b, so the fit over all samples so far costs
+        the same at every update. Sums are taken about the means of
+        the first block to keep their precision over long sessions.
+
+        Attributes
+        ----------
+        n: integer
+                samples fit so far
+        shift: tuple of numpy arrays
+                isosbestic and signal means of the first block
+        sums: dictionary
+                iso, sig, iso2 and isosig sums of the shifted values,
+                one per channel
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.shift = None
+        self.sums = None
+
+    def update(self, iso, sig):
+        """Adds a block of samples to the fit
+
+            Parameters
+            ----------
+            iso: numpy array
+                    shape (channels, samples), isosbestic values
+            sig: numpy array
+                    shape (channels, samples), signal values
+        """
+        if iso.shape[1] == 0:
+            return
+        if self.shift is None:
+            self.shift = (iso.mean(axis=1, dtype=np.float64),
+                          sig.mean(axis=1, dtype=np.float64))
+            self.sums = {name: np.zeros(len(iso))
+                         for name in ['iso', 'sig', 'iso2', 'isosig']}
+        x = iso - self.shift[0][:, None]
+        y = sig - self.shift[1][:, None]
+        self.n += iso.shape[1]
+        self.sums['iso'] += x.sum(axis=1)
+        self.sums['sig'] += y.sum(axis=1)
+        self.sums['iso2'] += np.einsum('ij,ij->i', x, x)
+        self.sums['isosig'] += np.einsum('ij,ij->i', x, y)
+
+    def coefficients(self):
+        """Returns the fit over all samples so far
+
+            Returns:
+            --------
+            a, b: numpy arrays
+                    slope and intercept of each channel, the same
+                    as fpho_setup.isosbestic_norm gives for the
+                    samples so far
+        """
+        isoMean = self.sums['iso'] / self.n
+        sigMean = self.sums['sig'] / self.n
+        a = ((self.sums['isosig'] - self.n * isoMean * sigMean)
+             / (self.sums['iso2'] - self.n * isoMean * isoMean))
+        b = self.shift[1] + sigMean - a * (self.shift[0] + isoMean)
+        return a, b
+
+
+def live_norm(blocks):
+    """Generator that normalizes new frames to the isosbestic fit
+        of all frames so far
+
+        Parameters
+        ----------
+        blocks: iterable of Session
+                new frames, e.g. from live_fpho_data
+
+        Yields:
+        --------
+        block: Session
+                the new frames
+        normData: dictionary
+                dF/F of the new frames for each label from
+                fpho_setup.isosbestic_pairs
+        coefficients: dictionary
+                (a, b) of the fit used for each label
+    """
+    fit = RunningFit()
+    for block in blocks:
+        pairs = fpho_setup.isosbestic_pairs(block)
+        iso = block.signals[[block.rows[pair[1]] for pair in pairs]]
+        sig = block.signals[[block.rows[pair[2]] for pair in pairs]]
+        fit.update(iso, sig)
+        a, b = fit.coefficients()
+        controlFit = a[:, None] * iso + b[:, None]
+        normData = (sig - controlFit) / controlFit
+
+        labels = [pair[0] for pair in pairs]
+        yield (block,
+               {label: normData[i] for i, label in enumerate(labels)},
+               {label: (a[i], b[i]) for i, label in enumerate(labels)})
+
+
+def write_live(file, block, normData):
+    """Appends the dF/F of new frames to the _Live.csv file
+
+        Parameters
+        ----------
+        file: open text file
+                the _Live.csv file, a header is written first if
+                it is empty
+        block: Session
+                the new frames
+        normData: dictionary
+                dF/F of the new frames for each label
+    """
+    if file.tell() == 0:
+        file.write(','.join(list(fpho_session.TIME_NAMES)
+                            + list(normData)) + '\n')
+    np.savetxt(file, np.vstack([block.times] + list(normData.values())).T,
+               fmt='%.10g', delimiter=',')
+    file.flush()
+
+
+def live_status(minutes, n_frames, drops, normData, coefficients):
+    """One line report of signal quality
+
+        Parameters
+        ----------
+        minutes: number
+                recording time so far
+        n_frames: integer
+                frames normalized so far
+        drops: list
+                dropped frames so far, see fpho_setup.align_frames
+        normData: dictionary
+                dF/F of the latest frames for each label
+        coefficients: dictionary
+                (a, b) of the current fit for each label
+
+        Returns:
+        --------
+        status: string
+                recording time, frames, drops and for each label
+                the fit and the spread of the latest dF/F
+    """
+    status = ['{:.1f} min'.format(minutes),
+              '{} frames'.format(n_frames),
+              '{} dropped'.format(sum(drop['missing_frames']
+                                      for drop in drops))]
+    for label in normData:
+        a, b = coefficients[label]
+        status.append('{} a={:.3f} b={:.1f} dF/F sd={:.4f}'.format(
+            label, a, b, np.std(normData[label])))
+    return ' | '.join(status)
+
+
+def run_live(config):
+    """Follows the input file of a config until it stops growing
+
+        Parameters
+        ----------
+        config: dictionary
+                settings loaded from config.yml
+
+        Returns:
+        --------
+        result: dictionary
+                frames normalized, the final coefficients and the
+                dropped frames. dF/F of every frame is written to
+                output_filename_Live.csv as it arrives and dropped
+                frames to output_filename_Drops.csv at the end.
+    """
+    drops = []
+    blocks = live_fpho_data(
+        config['input_filename'], config['n_fibers'],
+        config['f1greencol'], f2greencol=config['f2greencol'],
+        column_map=config.get('fiber_columns', None),
+        poll_sec=config.get('live_poll_sec', LIVE_POLL_SEC),
+        idle_sec=config.get('live_idle_sec', LIVE_IDLE_SEC),
+        drops=drops)
+    status_sec = config.get('live_status_sec', LIVE_STATUS_SEC)
+
+    output_live = config['output_filename'] + '_Live.csv'
+    n_frames = 0
+    coefficients = {}
+    start_msec = None
+    last_status = time.monotonic()
+    recent = []
+    with open(output_live, 'w') as file:
+        print('Following ' + config['input_filename']
+              + ', writing ' + output_live)
+        for block, normData, coefficients in live_norm(blocks):
+            write_live(file, block, normData)
+            n_frames += len(block)
+            if start_msec is None:
+                start_msec = block['fTimeGreen'][0]
+
+            # Report on the frames since the last report
+            recent.append(normData)
+            if time.monotonic() - last_status >= status_sec:
+                print(live_status(
+                    (block['fTimeGreen'][-1] - start_msec) / 60000,
+                    n_frames, drops,
+                    {label: np.concatenate([entry[label]
+                                            for entry in recent])
+                     for label in normData},
+                    coefficients))
+                recent = []
+                last_status = time.monotonic()
+
+    print('Recording stopped after ' + str(n_frames) + ' frames')
+    if len(drops) > 0:
+        fpho_setup.write_drops(pd.DataFrame(
+            drops, columns=fpho_setup.DROP_COLUMNS),
+            config['output_filename'])
+    return {'frames': n_frames, 'coefficients': coefficients,
+            'drops': drops}
+
+
+def main():
+    """Runs live mode for a config from the command line
+
+    Parameters
+    ----------
+    config.yml
+        Set input_filename to the file Bonsai is writing, then run:
+        python fpho_live.py --config config.yml
+
+    Returns
+    -------
+        Writes output_filename_Live.csv as frames arrive and prints
+        a signal quality report every live_status_sec seconds
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, required=True)
+    args = parser.parse_args()
+
+    f = open(args.config, 'r')
+    config = yaml.load(f, Loader=yaml.FullLoader)
+    f.close()
+
+    return run_live(config)
+
+
+if __name__ == '__main__':
+    main()
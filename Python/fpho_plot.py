@@ -0,0 +1,142 @@
+"""Library of functions to render figures without pyplot
+    * new_figure - makes a figure on the Agg canvas
+    * remove_borders - removes the top and right borders of axes
+    * figure_job - describes one figure to render
+    * save_figure - saves a figure, replacing the file in one step
+    * render_figure - draws and saves one figure
+    * render_figures - draws and saves figures on a pool of workers
+
+    Figures are drawn by functions that return a Figure made with
+    new_figure. They hold no pyplot state, so each can be drawn in
+    its own worker process.
+"""
+import os
+import concurrent.futures
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def new_figure(**kwargs):
+    """Makes a figure on the non-interactive Agg canvas
+
+        Parameters
+        ----------
+        kwargs:
+                passed to matplotlib.figure.Figure, e.g. figsize
+                and dpi
+
+        Returns:
+        --------
+        fig: matplotlib figure
+    """
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def remove_borders(ax):
+    """Removes the top and right borders of axes
+
+        Parameters
+        ----------
+        ax: matplotlib axes
+    """
+    ax.spines['right'].set_color('none')
+    ax.spines['top'].set_color('none')
+
+
+def figure_job(draw, filename, savefig=None, **kwargs):
+    """Describes one figure to render
+
+        Parameters
+        ----------
+        draw: function
+                module level function returning a figure from
+                new_figure, called with kwargs
+        filename: string
+                name of the output file, the extension sets the
+                format
+        savefig: dictionary
+                keyword arguments for Figure.savefig, default None
+        kwargs:
+                arguments for draw
+
+        Returns:
+        --------
+        job: dictionary
+                draw, kwargs, filename and savefig, for
+                render_figure
+    """
+    return {'draw': draw, 'kwargs': kwargs, 'filename': filename,
+            'savefig': savefig or {}}
+
+
+def save_figure(fig, filename, **kwargs):
+    """Saves a figure, replacing filename in one step
+
+        The figure is written to a temporary file in the same
+        directory and renamed, so a partly written file is never
+        seen under filename.
+
+        Parameters
+        ----------
+        fig: matplotlib figure
+        filename: string
+                name of the output file, the extension sets the
+                format
+        kwargs:
+                passed to Figure.savefig
+    """
+    directory, name = os.path.split(filename)
+    tmp = os.path.join(directory, '.tmp' + str(os.getpid()) + '_' + name)
+    file_format = os.path.splitext(name)[1][1:] or None
+    try:
+        fig.savefig(tmp, format=file_format, **kwargs)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def render_figure(job):
+    """Draws and saves one figure
+
+        Parameters
+        ----------
+        job: dictionary
+                from figure_job
+
+        Returns:
+        --------
+        filename: string
+                name of the saved file
+    """
+    fig = job['draw'](**job['kwargs'])
+    save_figure(fig, job['filename'], **job['savefig'])
+    return job['filename']
+
+
+def render_figures(jobs, workers=1):
+    """Draws and saves figures on a pool of worker processes
+
+        Parameters
+        ----------
+        jobs: list of dictionaries
+                from figure_job
+        workers: integer
+                number of worker processes, 0 or None for one per
+                CPU. With 1 worker, or 1 figure, figures are drawn
+                in this process.
+
+        Returns:
+        --------
+        filenames: list of strings
+                names of the saved files, in the order of jobs
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return [render_figure(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(render_figure, jobs))
@@ -0,0 +1,218 @@
+"""Library of functions to time and measure the memory of each stage
+    * NoStage - context of stages while profiling is off
+    * Profiler - records the time and memory of nested stages
+    * stage - times a stage of the running profiler
+    * start_profiling - starts a profiler for the pipeline
+    * stop_profiling - stops it and writes its reports
+
+    Pipeline functions mark their stages with
+        with fpho_profile.stage('parse'):
+    which does nothing unless a profiler was started with
+    start_profiling, so profiling costs nothing when it is off.
+"""
+import contextlib
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Profiler of the running pipeline, None when profiling is off
+PROFILER = None
+
+
+class NoStage(object):
+    """Context of stages run while profiling is off, does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+# Context of stages run while profiling is off
+NO_STAGE = NoStage()
+
+
+def rss_peak_mb():
+    """Peak resident memory of this process in MB, None where the
+        resource module is missing"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    if sys.platform == 'darwin':
+        return peak / 2**20
+    return peak / 1024
+
+
+class Profiler(object):
+    """Records the time and memory of nested stages
+
+        Attributes
+        ----------
+        stages: list of dictionaries
+                one per finished stage, in the order they started:
+                stage (names of the enclosing stages joined by /),
+                seconds, rss_peak_mb, the peak resident memory of
+                the process so far, and with memory, peak_mb, the
+                most memory traced by tracemalloc during the stage.
+                Traces are cleared as each stage starts, so memory
+                allocated before and freed during a stage still
+                counts and peak_mb is an upper bound.
+        memory: boolean
+                trace Python and numpy memory with tracemalloc
+        cprofile: cProfile.Profile or None
+                profile of every function call
+    """
+
+    def __init__(self, memory=False, cprofile=False):
+        self.stages = []
+        self.memory = memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.open = []
+        # Memory traced before tracemalloc was last cleared
+        self.traced = 0
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        """Starts tracing memory and function calls"""
+        if self.memory:
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        """Stops tracing memory and function calls"""
+        self.seconds = time.perf_counter() - self.started
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.memory:
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times one stage, stages opened inside it are nested
+
+            Parameters
+            ----------
+            name: string
+                    name of the stage
+        """
+        row = {'stage': '/'.join([entry['stage'] for entry in self.open]
+                                 + [name])}
+        self.stages.append(row)
+        if self.memory:
+            # The enclosing stage keeps the peak reached so far, then
+            # traces restart so the peak is this stage's own
+            current, peak = tracemalloc.get_traced_memory()
+            if self.open:
+                self.open[-1]['peak'] = max(self.open[-1]['peak'],
+                                            self.traced + peak)
+            self.traced += current
+            tracemalloc.clear_traces()
+        self.open.append({'stage': name, 'peak': 0})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            row['seconds'] = time.perf_counter() - start
+            entry = self.open.pop()
+            if self.memory:
+                peak = max(entry['peak'],
+                           self.traced + tracemalloc.get_traced_memory()[1])
+                row['peak_mb'] = peak / 2**20
+                if self.open:
+                    self.open[-1]['peak'] = max(self.open[-1]['peak'], peak)
+            row['rss_peak_mb'] = rss_peak_mb()
+
+    def report(self):
+        """Returns the timing report
+
+            Returns:
+            --------
+            report: dictionary
+                    total seconds, rss_peak_mb and the stages
+        """
+        return {'seconds': self.seconds, 'rss_peak_mb': rss_peak_mb(),
+                'memory_traced': self.memory, 'stages': self.stages}
+
+
+def stage(name):
+    """Times a stage of the running profiler
+
+        Parameters
+        ----------
+        name: string
+                name of the stage
+
+        Returns:
+        --------
+        context: context manager
+                times the stage, does nothing when profiling is off
+    """
+    if PROFILER is None:
+        return NO_STAGE
+    return PROFILER.stage(name)
+
+
+def start_profiling(memory=False, cprofile=False):
+    """Starts a profiler that stage reports to
+
+        Parameters
+        ----------
+        memory: boolean
+                trace memory with tracemalloc, which slows Python
+                code down
+        cprofile: boolean
+                profile every function call with cProfile
+
+        Returns:
+        --------
+        profiler: Profiler
+    """
+    global PROFILER
+    PROFILER = Profiler(memory=memory, cprofile=cprofile)
+    PROFILER.start()
+    return PROFILER
+
+
+def stop_profiling(output_filename):
+    """Stops the running profiler and writes its reports
+
+        Parameters
+        ----------
+        output_filename: string
+                name for output files
+
+        Returns:
+        --------
+        report: dictionary
+                see Profiler.report, also written to
+                output_filename_Timing.json. With cProfile, the
+                function call profile is written to
+                output_filename_Profile.prof, to read with pstats
+                or snakeviz.
+    """
+    global PROFILER
+    profiler = PROFILER
+    PROFILER = None
+    profiler.stop()
+
+    report = profiler.report()
+    timing_filename = output_filename + '_Timing.json'
+    with open(timing_filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Timing report written to ' + timing_filename)
+    if profiler.cprofile is not None:
+        profile_filename = output_filename + '_Profile.prof'
+        profiler.cprofile.dump_stats(profile_filename)
+        print('Function call profile written to ' + profile_filename)
+    return report
@@ -0,0 +1,158 @@
+"""Rolling order statistics of fiber photometry channels
+    * SortedWindow - sorted values of a sliding window
+    * rolling_order_stats - percentiles and MAD in a sliding window
+    * rolling_percentile - percentile in a sliding window
+    * rolling_median - median in a sliding window
+    * rolling_mad - median absolute deviation in a sliding window
+
+    Each step of the window inserts one value into a sorted list and
+    removes another, so a window of w samples costs O(log w) searches
+    and one O(w) memory move per sample instead of sorting the window
+    again. Windows are centered on their sample and cut short at the
+    ends of the recording, as in fpho_setup.rolling_fit.
+"""
+import bisect
+import numpy as np
+
+
+class SortedWindow(object):
+    """Sorted values of a sliding window
+
+        Percentiles interpolate between the two nearest values, the
+        same as np.percentile. The median absolute deviation is
+        found by a binary search over the distances below and above
+        the median, which are both already in order.
+
+        Attributes
+        ----------
+        values: list
+                values in the window, in ascending order
+    """
+
+    def __init__(self, values=()):
+        self.values = sorted(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        """Adds a value to the window"""
+        bisect.insort(self.values, value)
+
+    def remove(self, value):
+        """Removes one copy of a value in the window"""
+        del self.values[bisect.bisect_left(self.values, value)]
+
+    def percentile(self, q):
+        """Takes a percentile from 0 to 100, returns it for the window"""
+        position = q / 100 * (len(self.values) - 1)
+        below = int(position)
+        if below == position:
+            return self.values[below]
+        fraction = position - below
+        return ((1 - fraction) * self.values[below]
+                + fraction * self.values[below + 1])
+
+    def median(self):
+        """Returns the median of the window"""
+        return self.percentile(50)
+
+    def kth_distance(self, center, k):
+        """Takes a value and k, returns the k-th smallest (from 0)
+            distance of a value in the window to it
+        """
+        values = self.values
+        split = bisect.bisect_left(values, center)
+        # Distances below the split rise going down, above it going up.
+        # Find how many of the k + 1 smallest come from below
+        lo = max(0, k + 1 - (len(values) - split))
+        hi = min(k + 1, split)
+        while lo < hi:
+            below = (lo + hi) // 2
+            if (center - values[split - 1 - below]
+                    < values[split + k - below] - center):
+                lo = below + 1
+            else:
+                hi = below
+        distance = -np.inf
+        if lo > 0:
+            distance = center - values[split - lo]
+        if lo < k + 1:
+            distance = max(distance, values[split + k - lo] - center)
+        return distance
+
+    def mad(self):
+        """Returns the median absolute deviation of the window"""
+        center = self.median()
+        half = len(self.values) // 2
+        if len(self.values) % 2:
+            return self.kth_distance(center, half)
+        return (self.kth_distance(center, half - 1)
+                + self.kth_distance(center, half)) / 2
+
+
+def rolling_order_stats(signals, window, percentiles=(), mad=False):
+    """Takes channels, returns percentiles and the median absolute
+        deviation in a window around every sample
+
+        Parameters
+        ----------
+        signals: numpy array
+                shape (channels, samples)
+        window: integer
+                samples in each window, centered on its sample. Windows
+                are cut short at the ends of the recording
+        percentiles: list of numbers
+                percentiles from 0 to 100
+        mad: boolean
+                also find the median absolute deviation
+
+        Returns:
+        --------
+        stats: dictionary
+                shape (channels, samples) array for each percentile,
+                and for 'mad' with mad set
+    """
+    signals = np.atleast_2d(signals)
+    n = signals.shape[1]
+    half = min(window, 2 * n - 1) // 2
+    names = list(percentiles) + (['mad'] if mad else [])
+    stats = {name: np.empty(signals.shape) for name in names}
+
+    for channel, row in enumerate(signals):
+        row = row.tolist()
+        sortedWindow = SortedWindow(row[:half])
+        results = {name: [] for name in names}
+        for i in range(n):
+            if i + half < n:
+                sortedWindow.add(row[i + half])
+            if i > half:
+                sortedWindow.remove(row[i - half - 1])
+            for q in percentiles:
+                results[q].append(sortedWindow.percentile(q))
+            if mad:
+                results['mad'].append(sortedWindow.mad())
+        for name in names:
+            stats[name][channel] = results[name]
+    return stats
+
+
+def rolling_percentile(signals, window, q):
+    """Takes channels, returns percentile q in a window around every
+        sample, see rolling_order_stats
+    """
+    return rolling_order_stats(signals, window, percentiles=[q])[q]
+
+
+def rolling_median(signals, window):
+    """Takes channels, returns the median in a window around every
+        sample, see rolling_order_stats
+    """
+    return rolling_percentile(signals, window, 50)
+
+
+def rolling_mad(signals, window):
+    """Takes channels, returns the median absolute deviation in a
+        window around every sample, see rolling_order_stats
+    """
+    return rolling_order_stats(signals, window, mad=True)['mad']
@@ -0,0 +1,233 @@
+"""Session class holding parsed fiber photometry data
+    * Session - channels of one recording in contiguous numpy arrays
+    * signal_names - names of the de-interleaved signal channels
+    * check_dtype - checks the storage data type of signals
+"""
+import sys
+import numpy as np
+
+# Fluorophore columns recorded for each fiber
+COLORS = ('Green', 'Red')
+
+# LED channels de-interleaved from each column
+SLOTS = ('Iso', 'Red', 'Green')
+
+# Time channels, one per LED
+TIME_NAMES = ('fTimeIso', 'fTimeRed', 'fTimeGreen')
+
+
+def signal_names(n_fibers):
+    """Takes a number of fibers, returns the signal channel names
+
+        Parameters
+        ----------
+        n_fibers: integer
+                number of fibers in input data
+
+        Returns:
+        --------
+        names: list of strings
+                f1GreenIso, f1GreenRed, f1GreenGreen, f1RedIso,
+                f1RedRed, f1RedGreen, then the same for each
+                further fiber. This is the row order of
+                Session.signals.
+    """
+    return ['f' + str(fiber) + color + slot
+            for fiber in range(1, n_fibers + 1)
+            for color in COLORS
+            for slot in SLOTS]
+
+
+def check_dtype(dtype):
+    """Checks that signals are stored as float32 or float64
+
+        Parameters
+        ----------
+        dtype: numpy data type or string
+
+        Returns:
+        --------
+        dtype: numpy data type
+    """
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        dtype = None
+    if dtype not in (np.float32, np.float64):
+        print("Error: Signal data type was invalid."
+              + " Please use float32 or float64")
+        sys.exit(1)
+    return dtype
+
+
+class Session(object):
+    """Parsed fiber photometry data for one recording
+
+        Every channel has the same length and is a row of one
+        contiguous 2-D array, so indexing by name returns a view
+        without copying.
+
+        Attributes
+        ----------
+        signals: numpy array
+                shape (channels, samples), rows ordered as
+                signal_names(n_fibers). float64 or float32.
+        times: numpy array
+                shape (3, samples), rows fTimeIso, fTimeRed,
+                fTimeGreen. Always float64, since msec/day
+                timestamps need double precision.
+        names: tuple of strings
+                signal channel names, in row order
+        animalID: string
+                unique animal ID #
+        date: string
+                date data was gathered
+        description: string
+                brief description of data
+    """
+    __slots__ = ('signals', 'times', 'names', 'animalID', 'date',
+                 'description', 'rows')
+
+    def __init__(self, signals, times, names, animalID=None, date=None,
+                 description=None, dtype=None):
+        if dtype is not None and signals.dtype != check_dtype(dtype):
+            signals = signals.astype(dtype)
+        self.signals = signals
+        self.times = times
+        self.names = tuple(names)
+        self.animalID = animalID
+        self.date = date
+        self.description = description
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_channels(cls, channels, n_fibers, animalID=None, date=None,
+                      description=None, dtype=np.float64):
+        """Builds a session from separate channel arrays
+
+            Channels are cropped to the shortest one.
+
+            Parameters
+            ----------
+            channels: dictionary
+                    numpy array or list of numpy array blocks for
+                    every signal and time channel name
+            n_fibers: integer
+                    number of fibers in input data
+            animalID, date, description: strings
+                    session metadata
+            dtype: numpy data type
+                    float64 or float32 storage for signals
+
+            Returns:
+            --------
+            session: Session
+        """
+        dtype = check_dtype(dtype)
+        names = signal_names(n_fibers)
+        joined = {}
+        for name in names + list(TIME_NAMES):
+            values = channels[name]
+            if isinstance(values, list):
+                values = np.concatenate(values)
+            joined[name] = values
+        n_samples = min(len(joined[name]) for name in joined)
+
+        signals = np.empty((len(names), n_samples), dtype=dtype)
+        for i, name in enumerate(names):
+            signals[i] = joined[name][:n_samples]
+        times = np.empty((len(TIME_NAMES), n_samples))
+        for i, name in enumerate(TIME_NAMES):
+            times[i] = joined[name][:n_samples]
+
+        return cls(signals, times, names, animalID=animalID, date=date,
+                   description=description)
+
+    @classmethod
+    def concatenate(cls, blocks, animalID=None, date=None,
+                    description=None, dtype=np.float64):
+        """Joins sessions with the same channels along time
+
+            Parameters
+            ----------
+            blocks: iterable of Session
+                    blocks in time order, e.g. from stream_fpho_data
+            animalID, date, description: strings
+                    session metadata
+            dtype: numpy data type
+                    float64 or float32 storage for signals
+
+            Returns:
+            --------
+            session: Session
+        """
+        dtype = check_dtype(dtype)
+        blocks = list(blocks)
+        n_samples = sum(len(block) for block in blocks)
+        signals = np.empty((len(blocks[0].names), n_samples), dtype=dtype)
+        times = np.empty((len(TIME_NAMES), n_samples))
+        start = 0
+        for block in blocks:
+            signals[:, start:start + len(block)] = block.signals
+            times[:, start:start + len(block)] = block.times
+            start += len(block)
+
+        return cls(signals, times, blocks[0].names, animalID=animalID,
+                   date=date, description=description)
+
+    def __getitem__(self, name):
+        """Returns a view of the signal or time channel called name"""
+        if name in self.rows:
+            return self.signals[self.rows[name]]
+        if name in TIME_NAMES:
+            return self.times[TIME_NAMES.index(name)]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self.rows or name in TIME_NAMES
+
+    def __len__(self):
+        return self.signals.shape[1]
+
+    def __repr__(self):
+        return ('Session(animalID={!r}, date={!r}, fibers={}, samples={}, '
+                'dtype={})'.format(self.animalID, self.date, self.n_fibers,
+                                   len(self), self.signals.dtype))
+
+    @property
+    def n_fibers(self):
+        """Number of fibers in the session"""
+        return len(self.names) // (len(COLORS) * len(SLOTS))
+
+    @property
+    def columns(self):
+        """Names of all signal and time channels"""
+        return list(self.names) + list(TIME_NAMES)
+
+    def fiber(self, fiber, color=None):
+        """Returns a view of the rows for one fiber
+
+            Parameters
+            ----------
+            fiber: integer
+                    fiber number, starting at 1
+            color: string
+                    Green or Red, default None for both
+
+            Returns:
+            --------
+            rows: numpy array
+                    shape (3, samples) for one color, rows Iso,
+                    Red, Green, or (6, samples) for both colors
+        """
+        if fiber not in range(1, self.n_fibers + 1):
+            raise KeyError('fiber ' + str(fiber))
+        start = self.rows['f' + str(fiber) + COLORS[0] + SLOTS[0]]
+        if color is None:
+            return self.signals[start:start + len(COLORS) * len(SLOTS)]
+        start += COLORS.index(color) * len(SLOTS)
+        return self.signals[start:start + len(SLOTS)]
+
+    def to_dict(self):
+        """Returns views of every channel keyed by name"""
+        return {name: self[name] for name in self.columns}
@@ -1,72 +1,187 @@
 """Library of functions for fpho_driver
-    * import_fpho_data - saves data from csv in lists
+    * iter_fpho_columns - reads numeric columns of a Bonsai csv in blocks
+    * read_fpho_columns - reads all numeric columns of a Bonsai csv
+    * check_fpho_columns - checks fiber and column settings
+    * check_column_map - checks a column map for any number of fibers
+    * split_label - splits a label like f10Green into fiber and color
+    * stream_fpho_data - yields de-interleaved channels in blocks
+    * rebatch_rows - regroups blocks of rows into fixed-size blocks
+    * interleave_slots - finds the interleave phase of the 3 colors
+    * counter_ticks - decodes the Bonsai frame counter
+    * align_frames - groups rows into whole frames by the frame counter
+    * de_interleave_block - splits a block of frames into a Session
+    * import_fpho_data - saves data from csv in a Session
+    * write_drops - writes the dropped frame report
+    * uniform_grid - shared uniform time grid of a session
+    * interpolate_channels - interpolates every channel onto a grid
+    * resample_session - resamples a session onto a uniform grid
+    * summary_dataframe - one row dataframe of a session
+    * summary_table - columnar table of a session
+    * write_summary - writes a session to the _Summary file
+    * load_summary - loads a session from a parquet or feather summary
+    * minmax_envelope - reduces a trace to a min/max envelope
+    * plot_envelope - plots a trace as a min/max envelope
+    * raw_channel_options - channels raw_signal_trace can plot
+    * select_raw_channels - checks the channels to plot
+    * draw_raw_signal - draws raw signal traces
+    * raw_signal_figures - describes raw signal plots
     * raw_signal_trace - plots raw signal from fpho data
     * fit_exp - finds fitted exponent
-    * plot_fitted_exp - plots 1 fiber normalized fitted exponenent
-    * plot_isosbestic_norm - plots 1 fiber normalized isosbestic fit
+    * fit_exp_jacobian - partial derivatives of fit_exp
+    * exp_initial_guess - guesses fit_exp parameters from the data
+    * fit_bleaching - fits photobleaching and detrends a signal
+    * fit_exp_scaled - fits fit_exp to scaled data
+    * fit_bleaching_session - fits photobleaching for all fibers
+    * draw_fitted_exp - draws a signal and its fitted exponent
+    * fitted_exp_figures - describes fitted exponent plots
+    * plot_fitted_exp - plots fitted exponent for all fibers
+    * isosbestic_pairs - channels fit to the isosbestic
+    * window_samples - samples in a window of a session's time
+    * rolling_fit - isosbestic fit in a sliding window
+    * isosbestic_norm - normalizes all fibers to the isosbestic
+    * draw_isosbestic_norm - draws a normalized signal
+    * isosbestic_norm_figures - describes normalized isosbestic plots
+    * plot_isosbestic_norm - plots normalized isosbestic fit
+    * percentile_dff - dF/F to a rolling percentile baseline
+    * percentile_dff_figures - describes rolling percentile dF/F plots
+    * plot_percentile_dff - plots rolling percentile dF/F
 """
 import sys
-from statistics import mean
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import datetime
 from scipy.optimize import curve_fit
+import scipy.signal
 import csv
+import itertools
+import json
+import re
+import fpho_cache
+import fpho_session
+import fpho_plot
+import fpho_profile
+import fpho_rolling
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as pa_feather
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+    pa_csv = None
 
 driver_version = 'v2.0'
 
+# Rows per block read from Bonsai csv files
+BLOCK_ROWS = 3 * 2**16
 
-def import_fpho_data(input_filename, output_filename,
-                     n_fibers, f1greencol,
-                     animal_ID, exp_date, exp_desc,
-                     f2greencol=None,
-                     write_xlsx=False):
-    """Takes a file name, returns a dataframe of parsed data
+# 3-color frames per block yielded by stream_fpho_data
+BLOCK_FRAMES = 2**16
+
+# Leading rows trimmed from every recording, about 5sec
+SKIP_ROWS = 250
+
+# The Bonsai frame counter (column 2) is the camera's 32 bit cycle
+# timer: 7 bits of seconds, 13 bits of 125 usec cycles counting to
+# 8000 and 12 bits of cycle offset counting to 3072
+COUNTER_CYCLES = 8000
+COUNTER_OFFSETS = 3072
+
+# Cycle offsets before the cycle timer wraps, every 128 seconds
+COUNTER_WRAP = 128 * COUNTER_CYCLES * COUNTER_OFFSETS
+
+# Rows needed after a dropped frame to check the phase by brightness,
+# the phase is kept from the frame counter after shorter runs
+PHASE_MIN_ROWS = 30
+
+# Fiber and color labels such as f1Green or f10Red, fibers count from 1
+LABEL_PATTERN = re.compile(r'f([1-9][0-9]*)('
+                           + '|'.join(fpho_session.COLORS) + ')')
+
+# Columns of the dropped frame report, see align_frames
+DROP_COLUMNS = ['row', 'time', 'missing_frames', 'shifted']
+
+# Anti-aliasing filter of resample_session, the Chebyshev type I
+# filter scipy.signal.decimate uses: order, passband ripple in dB and
+# cutoff as a fraction of the output Nyquist frequency
+RESAMPLE_ORDER = 8
+RESAMPLE_RIPPLE_DB = 0.05
+RESAMPLE_CUTOFF = 0.8
+
+# File extension for each summary format
+SUMMARY_FORMATS = {'csv': '.csv', 'parquet': '.parquet',
+                   'feather': '.feather'}
+
+# Schema metadata key holding session metadata in columnar summaries
+SUMMARY_METADATA_KEY = b'fpho_session'
+
+# Channels raw_signal_trace plots for each fiber: the signals drawn
+# side by side, their time channel and the line color
+RAW_CHANNELS = {'Red': (['RedRed'], 'fTimeRed', 'r'),
+                'Green': (['GreenGreen', 'GreenIso'], 'fTimeGreen', 'g')}
+
+# Seconds in the window and percentile of its values taken as F0 by
+# percentile_dff
+DFF_WINDOW_SEC = 60.0
+DFF_PERCENTILE = 10.0
+
+# Points in the coarse photobleaching fit, see fit_bleaching
+FIT_COARSE_POINTS = 2000
+
+# Largest photobleaching rate, in units of 1/recording length
+FIT_RATE_MAX = 1e4
+
+# Rates tried by exp_initial_guess, in units of 1/recording length
+GUESS_RATES = (-300, -100, -30, -10, -3, -1, -0.3, 0, 0.3, 1)
+
+
+class CommaAsSpace(object):
+    """Wraps an open text file so commas are read as spaces
+
+        Lets the whitespace-delimited parser read space- and
+        comma-delimited Bonsai files alike.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.file).replace(',', ' ')
+
+
+def iter_fpho_columns(input_filename, block_rows=BLOCK_ROWS):
+    """Generator that yields all numeric columns of a Bonsai csv
+        in blocks of rows
+
+        Uses the pyarrow CSV reader when it is installed and the
+        file has a single delimiter between values. Files with
+        repeated or mixed whitespace are read with numpy.loadtxt.
 
         Parameters
         ----------
         input_filename: string
-                The path to the CSV file
-        output_filename: string
-                name for output file
-        n_fibers: integer
-                indicating 1 or 2 fiber input data
-        f1greencol: integer
-                f1green column index
-        f2greencol: integer
-                f2green column index
-                default = None
-        animal_ID: integer
-                unique animal ID #
-        exp_date: YYYY_MM_DD
-                date data was gathered
-        exp_desc: string
-                brief description of data
+                The path to the CSV file. Columns may be separated
+                by commas or any amount of whitespace.
+        block_rows: integer
+                number of rows per block for numpy.loadtxt. pyarrow
+                blocks hold roughly as many rows.
 
-       Returns:
+        Yields:
         --------
-        twofiber_fdata: pandas dataframe
-                containing f1GreenIso, f1GreenRed, f1GreenGreen,
-                           f2GreenIso, f2GreenRed, f2GreenGreen,
-                           f1RedIso, f1RedRed, f1RedGreen,
-                           f2RedIso, f2RedRed, f2RedGreen,
-                           fTimeIso, fTimeRed, fTimeGreen,
-                           animal_ID, exp_date, exp_desc
-
-        onefiber_fdata: pandas dataframe
-                containing f1GreenIso, f1GreenRed, f1GreenGreen,
-                           f1RedIso, f1RedRed, f1RedGreen,
-                           fTimeIso, fTimeRed, fTimeGreen,
-                           animal_ID, exp_date, exp_desc
-        * Note: only one of these will be returned, depending
-                on if data is for one or two fiber
-        """
-
+        data: numpy array
+                float array of shape (rows, columns). The first
+                line of the file is treated as a header and the
+                second line is only used to count columns, so
+                neither is included. A partial last line is
+                dropped. At least one block is yielded, even if it
+                has no rows.
+    """
     # Open file, catch errors
     try:
         file = open(input_filename, 'r')
-        header = None
     except FileNotFoundError:
         print("Could not find file: " + input_filename)
         sys.exit(1)
@@ -74,14 +189,128 @@ def import_fpho_data(input_filename, output_filename,
         print("Could not access file: " + input_filename)
         sys.exit(2)
 
-    # Get number of columns in input data
-    for line in file:
-        if header is None:
-            header = line
-            continue
-        columns = line.rstrip().replace(',', ' ').split(' ')
-        break
-    n_columns = len(columns)
+    # Get delimiter and number of columns from first line after header
+    file.readline()
+    first_row = file.readline()
+    file.close()
+    delimiter = ',' if ',' in first_row else ' '
+    n_columns = len(first_row.replace(',', ' ').split())
+    if n_columns == 0:
+        print("Could not find numeric data in file: " + input_filename)
+        sys.exit(1)
+    fields = first_row.rstrip('\r\n').split(delimiter)
+
+    # Rows already yielded, loadtxt picks up from here
+    n_rows = 0
+
+    # Repeated delimiters show up as empty fields, use loadtxt instead
+    if pa_csv is not None and '' not in fields[:n_columns]:
+        names = ['c' + str(i) for i in range(len(fields))]
+        try:
+            reader = pa_csv.open_csv(
+                input_filename,
+                read_options=pa_csv.ReadOptions(
+                    skip_rows=2, column_names=names,
+                    block_size=block_rows * len(first_row)),
+                parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={name: pa.float64()
+                                  for name in names[:n_columns]}))
+            for batch in reader:
+                if any(batch.column(i).null_count
+                       for i in range(n_columns)):
+                    break
+                yield np.column_stack([batch.column(i).to_numpy()
+                                       for i in range(n_columns)])
+                n_rows += batch.num_rows
+            else:
+                if n_rows == 0:
+                    yield np.empty((0, n_columns))
+                return
+        except pa.ArrowInvalid:
+            pass
+
+    file = open(input_filename, 'r')
+    try:
+        lines = CommaAsSpace(file)
+        for i in range(2 + n_rows):
+            next(lines, None)
+        while True:
+            chunk = list(itertools.islice(lines, block_rows))
+            if len(chunk) == 0:
+                if n_rows == 0:
+                    yield np.empty((0, n_columns))
+                break
+            try:
+                data = np.loadtxt(chunk, ndmin=2)
+            except ValueError:
+                # A recording stopped while Bonsai was writing leaves
+                # a partial last line, which is dropped
+                if (next(lines, None) is not None
+                        or len(chunk[-1].split()) >= n_columns):
+                    raise
+                data = np.empty((0, n_columns))
+                if len(chunk) > 1:
+                    data = np.loadtxt(chunk[:-1], ndmin=2)
+            yield data
+            n_rows += len(data)
+    except ValueError:
+        print("Could not parse numeric data in file: " + input_filename)
+        sys.exit(1)
+    finally:
+        file.close()
+
+
+def read_fpho_columns(input_filename):
+    """Takes a file name, returns all numeric columns in one array
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file. Columns may be separated
+                by commas or any amount of whitespace.
+
+        Returns:
+        --------
+        data: numpy array
+                float array of shape (rows, columns), see
+                iter_fpho_columns
+    """
+    return np.concatenate(list(iter_fpho_columns(input_filename)))
+
+
+def check_fpho_columns(n_columns, n_fibers, f1greencol, f2greencol=None,
+                       column_map=None):
+    """Checks fiber and column settings against the input data
+
+        Parameters
+        ----------
+        n_columns: integer
+                number of columns in input data
+        n_fibers: integer
+                indicating 1 or 2 fiber input data, or any number
+                of fibers with column_map
+        f1greencol: integer
+                f1green column index
+        f2greencol: integer
+                f2green column index
+                default = None
+        column_map: dictionary
+                1-based column index for every fiber and color, see
+                check_column_map. Replaces f1greencol and f2greencol.
+                default = None
+
+        Returns:
+        --------
+        columns: dictionary
+                1-based column index for fTime, f1Red, f1Green and,
+                for 2 fiber data, f2Red and f2Green
+    """
+    # Change None string to None keyword
+    if column_map == "None":
+        column_map = None
+    if column_map is not None:
+        return check_column_map(column_map, n_columns, n_fibers=n_fibers)
 
     # Change None string to None keyword
     if f2greencol == "None":
@@ -103,7 +332,8 @@ def import_fpho_data(input_filename, output_filename,
         print("Error: Integer entered for number of "
               + "fibers represented in dataset <"
               + str(n_fibers) + "> was invalid."
-              + " Please enter 1 or 2 in integer format")
+              + " Please enter 1 or 2 in integer format,"
+              + " or set fiber_columns for more fibers")
         sys.exit(1)
 
     # Catch error: f1green col entry not integer
@@ -123,7 +353,7 @@ def import_fpho_data(input_filename, output_filename,
     if f1greencol > n_columns:
         print("\nColumn index for f1green is not a valid column index. "
               + "Input data contains ", n_columns, " columns.\n")
-        sys.exit
+        sys.exit(1)
 
     # Catch error: Mismatched entries - 2 fibers but info for one
     if(n_fibers == 2 and f2greencol is None):
@@ -171,552 +401,1813 @@ def import_fpho_data(input_filename, output_filename,
         else:
             f2redcol = 5
 
-    fTime = []
-    f1Red = []
-    f1Green = []
-    f2Red = []
-    f2Green = []
+    columns = {'fTime': 1, 'f1Red': f1redcol, 'f1Green': f1greencol}
+    if n_fibers == 2:
+        columns['f2Red'] = f2redcol
+        columns['f2Green'] = f2greencol
 
-    for line in file:
-        if header is None:
-            header = line
-            continue
-        # Read in each line
-        # Must be separated by single space or comma
-        columns = line.rstrip().replace(",", " ").split(' ')
-        fTime.append(float(columns[0]))
-        f1Red.append(float(columns[f1redcol-1]))
-        f1Green.append(float(columns[f1greencol-1]))
-        if n_fibers == 2:
-            f2Red.append(float(columns[f2redcol-1]))
-            f2Green.append(float(columns[f2greencol-1]))
+    return columns
 
-    file.close()
 
-    # Trim first ~5sec from data
-    f1Green = f1Green[250:]
-    f1Red = f1Red[250:]
-    f2Green = f2Green[250:]
-    f2Red = f2Red[250:]
-    fTime = fTime[250:]
+def check_column_map(column_map, n_columns, n_fibers=None):
+    """Checks a column map for any number of fibers
 
-    # De-interleave
-    offset1 = f1Green[0::3]  # takes every 3rd element starting from 0
-    offset2 = f1Green[1::3]
-    offset3 = f1Green[2::3]
-    meanoffsets = [mean(offset1), mean(offset2), mean(offset3)]
+        Parameters
+        ----------
+        column_map: dictionary
+                1-based column index keyed by fiber and color,
+                e.g. {'f1Green': 3, 'f1Red': 4, 'f2Green': 5, ...}.
+                Every fiber from 1 up needs a Green and a Red column.
+        n_columns: integer
+                number of columns in input data
+        n_fibers: integer
+                number of fibers expected in the map
+                default = None, any number
 
-    # Green has highest signal (GcAMP)
-    # Order: green(470), red(560), iso(415)
-    greenIdX = meanoffsets.index(max(meanoffsets))
-    redIdX = greenIdX+1
-    isoIdX = greenIdX+2
+        Returns:
+        --------
+        columns: dictionary
+                1-based column index for fTime, then f1Green, f1Red,
+                f2Green, f2Red and so on
+    """
+    if not isinstance(column_map, dict) or len(column_map) == 0:
+        print("\nError: Column map <" + str(column_map) + "> was invalid."
+              + " Please map names like f1Green and f1Red to column"
+              + " indexes\n")
+        sys.exit(1)
 
-    # Assigning correct rows to colors
-    # First fiber, green
-    f1GreenIso = f1Green[greenIdX::3]
-    f1GreenRed = f1Green[redIdX::3]
-    f1GreenGreen = f1Green[isoIdX::3]
+    fibers = set()
+    for name, col in column_map.items():
+        match = LABEL_PATTERN.fullmatch(str(name))
+        if match is None:
+            print("\nError: Column map name <" + str(name) + "> was"
+                  + " invalid. Please use names like f1Green and f1Red\n")
+            sys.exit(1)
+        fibers.add(int(match.group(1)))
 
-    # First fiber, red
-    f1RedIso = f1Red[greenIdX::3]
-    f1RedRed = f1Red[redIdX::3]
-    f1RedGreen = f1Red[isoIdX::3]
+        # Catch error: column index not an integer of a data column
+        try:
+            col = int(col)
+        except (TypeError, ValueError):
+            col = None
+        if col is None or col < 3 or col > n_columns:
+            print("\nError: Column index for " + str(name) + " <"
+                  + str(column_map[name]) + "> was invalid."
+                  + " Input data contains", n_columns, "columns,"
+                  + " signals start at column 3.\n")
+            sys.exit(1)
 
-    # Sorting time by color
-    fTimeIso = fTime[greenIdX::3]
-    fTimeRed = fTime[redIdX::3]
-    fTimeGreen = fTime[isoIdX::3]
+    columns = {'fTime': 1}
+    for fiber in range(1, len(fibers) + 1):
+        for color in fpho_session.COLORS:
+            name = 'f' + str(fiber) + color
+            if name not in column_map:
+                print("\nError: Column map has no column for " + name
+                      + ". Fibers must be numbered from 1 with a Green"
+                      + " and a Red column each.\n")
+                sys.exit(1)
+            columns[name] = int(column_map[name])
+
+    if len(set(columns.values())) != len(columns):
+        print("\nError: Column map uses a column more than once\n")
+        sys.exit(1)
 
-    if n_fibers == 2:
-        # Second fiber, green
-        f2GreenIso = f2Green[greenIdX::3]
-        f2GreenRed = f2Green[redIdX::3]
-        f2GreenGreen = f2Green[isoIdX::3]
-
-        # Second fiber, red
-        f2RedIso = f2Red[greenIdX::3]
-        f2RedRed = f2Red[redIdX::3]
-        f2RedGreen = f2Red[isoIdX::3]
-
-        # Create list of all column names
-        colnames = ['f1GreenIso', 'f1GreenRed', 'f1GreenGreen',
-                    'f1RedIso', 'f1RedGreen', 'f1RedRed',
-                    'f2GreenIso', 'f2GreenRed', 'f2GreenGreen',
-                    'f2RedIso', 'f2RedGreen', 'f2RedRed',
-                    'fTimeIso', 'fTimeRed', 'fTimeGreen']
-
-        # Set arbitrarily large column length
-        collength = 100**10
-
-        # Find minimum column length by comparing
-        # last value to length of current column.
-        # Use to crop lists in output dataframe
-
-        for name in colnames:
-            collength = min(collength, len(eval(name)))
-
-        # Everything into a dictionary
-        twofiber_dict = {'f1GreenIso': [f1GreenIso],
-                         'f1GreenRed': [f1GreenRed],
-                         'f1GreenGreen': [f1GreenGreen],
-                         'f2GreenIso': [f2GreenIso],
-                         'f2GreenRed': [f2GreenRed],
-                         'f2GreenGreen': [f2GreenGreen],
-                         'f1RedIso': [f1RedIso],
-                         'f1RedRed': [f1RedRed],
-                         'f1RedGreen': [f1RedGreen],
-                         'f2RedIso': [f2RedIso],
-                         'f2RedRed': [f2RedRed],
-                         'f2RedGreen': [f2RedGreen],
-                         'fTimeIso': [fTimeIso],
-                         'fTimeRed': [fTimeRed],
-                         'fTimeGreen': [fTimeGreen],
-                         'animalID': [animal_ID],
-                         'date': [exp_date],
-                         'description': [exp_desc]}
-
-        # Dictionary to dataframe
-        twofiber_fdata = pd.DataFrame.from_dict(twofiber_dict)
+    # Catch error: Mismatched entries - map for another fiber count
+    if n_fibers is not None and str(n_fibers) != 'None':
+        try:
+            n_fibers = int(n_fibers)
+        except ValueError:
+            n_fibers = None
+        if n_fibers != len(fibers):
+            print("\nError: Indicated " + str(n_fibers) + " fibers in"
+                  + " input data but the column map has "
+                  + str(len(fibers)) + ". Check the config.yml file for"
+                  + " mismatched inputs.\n")
+            sys.exit(1)
 
-        # Dataframe to output csv
-        output_csv = output_filename + '_Summary.csv'
-        twofiber_fdata.to_csv(output_csv, index=None, na_rep='')
-        print('Output CSV written to ' + output_csv)
+    return columns
 
-        if write_xlsx is True:
-            output_xlsx = output_filename + '_Summary.xlsx'
-            twofiber_fdata.to_excel(output_xlsx, index=False)
-            print('Output excel file written to ' + "output_xlsx")
 
-        return twofiber_fdata
+def split_label(label):
+    """Splits a fiber and color label
 
-    else:
+        Parameters
+        ----------
+        label: string
+                e.g. f10Green, or a channel name starting with one,
+                e.g. f10GreenIso
+
+        Returns:
+        --------
+        fiber, color: strings
+                e.g. f10 and Green
+    """
+    match = LABEL_PATTERN.match(label)
+    return 'f' + match.group(1), match.group(2)
 
-        # Create list of all column names
-        colnames = ['f1GreenIso', 'f1GreenRed', 'f1GreenGreen',
-                    'f1RedIso', 'f1RedGreen', 'f1RedRed',
-                    'fTimeIso', 'fTimeRed', 'fTimeGreen']
-
-        # Set arbitrarily large column length
-        collength = 100**10
-
-        # Find minimum column length. Use to crop lists in output dataframe
-        for name in colnames:
-            collength = min(collength, len(eval(name)))
-
-        # Everything into a dictionary
-        onefiber_dict = {'f1GreenIso': [f1GreenIso[0:collength]],
-                         'f1GreenRed': [f1GreenRed[0:collength]],
-                         'f1GreenGreen': [f1GreenGreen[0:collength]],
-                         'f1RedIso': [f1RedIso[0:collength]],
-                         'f1RedRed': [f1RedRed[0:collength]],
-                         'f1RedGreen': [f1RedGreen[0:collength]],
-                         'fTimeIso': [fTimeIso[0:collength]],
-                         'fTimeRed': [fTimeRed[0:collength]],
-                         'fTimeGreen': [fTimeGreen[0:collength]],
-                         'animalID': [animal_ID],
-                         'date': [exp_date],
-                         'description': [exp_desc]}
-
-        # Dictionary to dataframe
-        onefiber_fdata = pd.DataFrame.from_dict(onefiber_dict)
 
-        # Dataframe to output csv
-        output_csv = output_filename + '_Summary.csv'
-        onefiber_fdata.to_csv(output_csv, index=False)
-        print('Output CSV written to ' + output_csv)
+def stream_fpho_data(input_filename, n_fibers, f1greencol, f2greencol=None,
+                     block_frames=BLOCK_FRAMES, column_map=None,
+                     drops=None):
+    """Generator that yields de-interleaved channels in fixed-size blocks
 
-        if write_xlsx is True:
-            output_xlsx = output_filename + '_Summary.xlsx'
-            onefiber_fdata.to_excel(output_xlsx, index=False)
-            print('Output excel file written to ' + output_xlsx)
+        The first ~5sec of data are trimmed and rows are grouped
+        into frames of all 3 colors by the frame counter, see
+        align_frames, so a dropped frame never swaps colors.
+
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file
+        n_fibers: integer
+                indicating 1 or 2 fiber input data, or any number
+                of fibers with column_map
+        f1greencol: integer
+                f1green column index
+        f2greencol: integer
+                f2green column index
+                default = None
+        block_frames: integer
+                number of 3-color frames per block
+        column_map: dictionary
+                1-based column index for every fiber and color, see
+                check_column_map
+                default = None
+        drops: list
+                a dictionary is appended for every dropped frame,
+                see align_frames
+                default = None
 
-        return onefiber_fdata
+        Yields:
+        --------
+        block: Session
+                signal and time channels of block_frames frames,
+                without metadata. Only the last block may hold
+                fewer frames.
+    """
+    blocks = iter_fpho_columns(input_filename, block_rows=3*block_frames)
+    data = next(blocks)
+    columns = check_fpho_columns(data.shape[1], n_fibers, f1greencol,
+                                 f2greencol=f2greencol,
+                                 column_map=column_map)
+    names = (['fTime']
+             + ['f' + str(fiber) + color
+                for fiber in range(1, (len(columns) - 1) // 2 + 1)
+                for color in fpho_session.COLORS])
+    col_idx = [columns['fTime'] - 1, 1] + [columns[name] - 1
+                                           for name in names[1:]]
+    data = itertools.chain([data], blocks)
+
+    # Regroup into blocks, trim first ~5sec from data
+    rows = rebatch_rows(data, col_idx, 3*block_frames, skip=SKIP_ROWS)
+    first = next(rows)
+    if len(first) < 3:
+        print("Not enough data in file: " + input_filename)
+        sys.exit(1)
 
+    # Whole frames starting on an Iso row, regrouped into blocks
+    frames = align_frames(itertools.chain([first], rows), drops=drops,
+                          first_row=SKIP_ROWS)
+    for block in rebatch_rows(frames, slice(None), 3*block_frames):
+        yield de_interleave_block(block)
 
-def raw_signal_trace(fpho_dataframe, output_filename, data_row_index=0):
-    """Creates a plot of the raw signal traces
-    Parameters
-    ----------
-    fpho_dataframe: pandas dataframe
-                    contains parsed fiberphotometry data
-    output_filename: string
-                    output png name
-    data_row_index: optional integer
-                    row containing data to plot
 
-    Returns:
-    --------
-    output_filename: PNG
-                     Plot of data
-    """
-    # renamed for simplicity
-    df = fpho_dataframe
-
-    # Get user input for what to plot
-    channel_input = input("----------\n"
-                          + "What channel(s) would you like to plot?\n"
-                          + "\nOptions are f1Red, f2Red, f1Green, f2Green."
-                          + "\n\nIf plotting multiple channels,"
-                          + " please separate with a space or comma."
-                          + "\n----------\n"
-                          + "Selection: ")
-
-    # Make a list of user inputs
-    if ',' in channel_input:
-        channel_list = channel_input.split(',')
-    else:
-        channel_list = channel_input.split(' ')
+def rebatch_rows(blocks, col_idx, n_rows, skip=0):
+    """Generator that regroups blocks of rows into blocks of n_rows
 
-    # quick for loop to catch input error -- input not found in column names
-    for channel in channel_list:
-        col = df.columns.str.contains(pat=str(channel))
-        if not any(col):
-            print("Could not find entries for channels you'd like to plot"
-                  + " in the dataframe column names."
-                  + " You entered <" + channel + "> and the options are "
-                  + str(list(df.columns)))
-            print('Please restart...\n')
-            sys.exit(1)
+        Parameters
+        ----------
+        blocks: iterable of numpy arrays
+                blocks of rows as yielded by iter_fpho_columns
+        col_idx: list of integers or slice
+                0-based indexes of the columns to keep
+        n_rows: integer
+                number of rows per yielded block
+        skip: integer
+                number of leading rows to drop
+
+        Yields:
+        --------
+        rows: numpy array
+                n_rows rows of the kept columns. The last block holds
+                the remaining rows, at least one block is yielded.
+    """
+    pending = []
+    n_pending = 0
+    n_yielded = 0
+    for data in blocks:
+        if skip > 0:
+            n_skip = min(skip, len(data))
+            data = data[n_skip:]
+            skip -= n_skip
+        pending.append(data[:, col_idx])
+        n_pending += len(data)
+        while n_pending >= n_rows:
+            rows = np.concatenate(pending)
+            pending = [rows[n_rows:]]
+            n_pending -= n_rows
+            n_yielded += 1
+            yield rows[:n_rows]
+
+    if n_pending > 0 or n_yielded == 0:
+        yield np.concatenate(pending)
+
+
+def interleave_slots(f1Green):
+    """Finds the interleave phase of the 3 LED colors
 
-    # Replace user input with actual column name
-    for channel in channel_list:
+        Parameters
+        ----------
+        f1Green: numpy array
+                f1green column, starting at the first frame
 
-        if 'f1Red' in str(channel):
-            channels = ["f1RedRed"]
-            time_col = 'fTimeRed'
-            l_color = "r"
-        if 'f2Red' in str(channel):
-            channels = ["f2RedRed"]
-            time_col = 'fTimeRed'
-            l_color = "r"
-        if 'f1Green' in str(channel):
-            channels = ["f1GreenGreen", "f1GreenIso"]
-            time_col = 'fTimeGreen'
-            l_color = "g"
-        if 'f2Green' in str(channel):
-            channels = ["f2GreenGreen", "f2GreenIso"]
-            time_col = 'fTimeGreen'
-            l_color = "g"
-
-        fig = plt.figure(figsize=(7*len(channels), 6),
-                         facecolor='w',
-                         edgecolor='k',
-                         dpi=300)
-
-        for i in range(0, len(channels)):
-
-            channel_data = df[channels[i]].values[data_row_index]
-            time_data = df[time_col].values[data_row_index]
-
-            # Initialize plot, add data and title
-            ax = fig.add_subplot(1, len(channels), 1+i)
-            ax.plot(time_data, channel_data, color=l_color)
-            ax.set_title(str(channels[i]))
-
-            # Remove top and right borders
-            plt.gca().spines['right'].set_color('none')
-            plt.gca().spines['top'].set_color('none')
+        Returns:
+        --------
+        slots: dictionary
+                first row index for Iso, Red and Green channels
+    """
+    # De-interleave
+    # Mean of every 3rd element starting from 0, 1 and 2
+    meanoffsets = [f1Green[i::3].mean() for i in range(3)]
+
+    # Green has highest signal (GcAMP)
+    # Order: green(470), red(560), iso(415)
+    greenIdX = int(np.argmax(meanoffsets))
+    redIdX = greenIdX+1
+    isoIdX = greenIdX+2
+
+    return {'Iso': greenIdX, 'Red': redIdX, 'Green': isoIdX}
 
-        # outputs raw sig plot as png file
-        rawsig_file_name = output_filename + '_RawSignal_' + channel + '.png'
-        plt.savefig(rawsig_file_name, bbox_inches='tight')
-        plt.close()
 
+def counter_ticks(counter):
+    """Decodes the Bonsai frame counter into cycle offsets
 
-def plot_isosbestic_norm(fpho_dataframe, output_filename):
-    """Creates a plot normalizing 1 fiber data to the isosbestic
         Parameters
         ----------
-        fpho_dataframe: string
-                pandas dataframe
-        output_filename: string
-                name for output file
+        counter: numpy array
+                frame counter column, the camera's 32 bit cycle timer
+
         Returns:
         --------
-        output_filename_f1GreenNorm.png
-        & output_filename_f1RedNorm.png: png files
-                containing the normalized plot for each fluorophore
+        ticks: numpy array
+                int64 time in 1/3072 of a 125 usec cycle, wrapping
+                at COUNTER_WRAP
     """
+    counter = counter.astype(np.int64)
+    cycles = ((counter >> 25) * COUNTER_CYCLES
+              + ((counter >> 12) & 0x1FFF))
+    return cycles * COUNTER_OFFSETS + (counter & 0xFFF)
 
-    # Open dataframe
-    # Check for Name Error and Permission Error exceptions
-    try:
-        df = fpho_dataframe
-    except NameError:
-        print('No ' + fpho_dataframe + ' data frame found')
-        sys.exit(1)
-    except PermissionError:
-        print('Unable to access data frame ' + fpho_dataframe)
-        sys.exit(1)
 
-    # Initialize lists for the fluorophores and time
-    f1GreenIso = []
-    f1GreenGreen = []
-    f1GreenTime = []
-
-    f1RedIso = []
-    f1RedRed = []
-    f1RedTime = []
-
-    # Define columns
-    greenIso_col = "f1GreenIso"
-    greenGreen_col = "f1GreenGreen"
-    greenTime_col = "fTimeGreen"
-    redIso_col = "f1RedIso"
-    redRed_col = "f1RedRed"
-    redTime_col = "fTimeRed"
-
-    # Read through each line of the dataframe
-    # Append the isosbectic, fluorophore and time data to their
-    # respective vectors, depending on color
-    f1GreenIso = df[greenIso_col].values[0]
-    f1GreenGreen = df[greenGreen_col].values[0]
-    f1GreenTime = df[greenTime_col].values[0]
-    f1RedIso = df[redIso_col].values[0]
-    f1RedRed = df[redRed_col].values[0]
-    f1RedTime = df[redTime_col].values[0]
-
-    # Make sure the iso and color vectors have the same number
-    # of values. If not, then trim off the last few values
-    # from the longer vector
-    if len(f1GreenIso) > len(f1GreenGreen):
-        n = len(f1GreenIso) - len(f1GreenGreen)
-        del f1GreenIso[-n:]
-    elif len(f1GreenIso) < len(f1GreenGreen):
-        n = len(f1GreenGreen) - len(f1GreenIso)
-        del f1GreenGreen[-n:]
-
-    if len(f1RedIso) > len(f1RedRed):
-        n = len(f1RedIso) - len(f1RedRed)
-        del f1RedIso[-n:]
-    elif len(f1RedIso) < len(f1RedRed):
-        n = len(f1RedRed) - len(f1RedIso)
-        del f1RedRed[-n:]
-
-    # Get coefficients for normalized fit
-    regGreen = np.polyfit(f1GreenIso, f1GreenGreen, 1)
-    aGreen = regGreen[0]
-    bGreen = regGreen[1]
-
-    regRed = np.polyfit(f1RedIso, f1RedRed, 1)
-    aRed = regRed[0]
-    bRed = regRed[1]
-
-    # Use the coefficients to create a control fit
-    controlFitGreen = []
-    for value in f1GreenIso:
-        controlFitGreen.append(aGreen * value + bGreen)
-
-    controlFitRed = []
-    for value in f1RedIso:
-        controlFitRed.append(aRed * value + bRed)
+def align_frames(blocks, drops=None, first_row=0):
+    """Generator that groups rows into whole frames by the frame counter
 
-    # Normalize the fluorophore data using the control fit
-    normDataGreen = []
-    for i in range(len(f1GreenGreen)):
-        normDataGreen.append((f1GreenGreen[i]
-                              - controlFitGreen[i]) / controlFitGreen[i])
-
-    normDataRed = []
-    for i in range(len(f1RedRed)):
-        normDataRed.append((f1RedRed[i] - controlFitRed[i]) / controlFitRed[i])
-
-    # Make sure the normalized data vector and the time
-    # vector have the same number of values. If not, then
-    # trim off the last few values from the longer vector
-    if len(f1GreenTime) > len(normDataGreen):
-        n = len(f1GreenTime) - len(normDataGreen)
-        del f1GreenTime[-n:]
-    elif len(f1GreenTime) < len(normDataGreen):
-        n = len(normDataGreen) - len(f1GreenTime)
-        del normDataGreen[-n:]
-
-    if len(f1RedTime) > len(normDataRed):
-        n = len(f1RedTime) - len(normDataRed)
-        del f1RedTime[-n:]
-    elif len(f1RedTime) < len(normDataRed):
-        n = len(normDataRed) - len(f1RedTime)
-        del normDataRed[-n:]
-
-    # Plot the data for green
-    plt.plot(f1GreenTime, normDataGreen, color='g')
-    # Remove top and right borders
-    plt.gca().spines['right'].set_color('none')
-    plt.gca().spines['top'].set_color('none')
-    # Add axes labels and a title
-    plt.xlabel('Time')
-    plt.ylabel('Normalized Fluorescence')
-    plt.title('Green Normalized to Isosbestic')
+        Rows are numbered by the frames elapsed on the frame counter,
+        so a dropped row leaves a gap rather than shifting the colors
+        after it. The interleave phase is found from the brightness
+        of the first block and checked again after every drop;
+        frames with a missing color are left out.
 
-    # Save the plot in a png file
-    green_iso_plot_name = output_filename + '_f1GreenNormIso.png'
-    figGreen = plt.savefig(green_iso_plot_name)
-    plt.close(figGreen)
+        Parameters
+        ----------
+        blocks: iterable of numpy arrays
+                blocks of rows, columns fTime, frame counter, f1Green,
+                f1Red, f2Green and so on. The first block needs at
+                least 3 rows.
+        drops: list
+                a dictionary is appended for every drop: row, the
+                index of the first row after it in the file data,
+                time, its Bonsai time, missing_frames and shifted,
+                True if the colors changed phase across it
+                default = None
+        first_row: integer
+                index in the file data of the first row
 
-    # Plot the data for red
-    plt.plot(f1RedTime, normDataRed, color='r')
-    # Remove top and right borders
-    plt.gca().spines['right'].set_color('none')
-    plt.gca().spines['top'].set_color('none')
-    # Add axes labels and a title
-    plt.xlabel('Time')
-    plt.ylabel('Normalized Fluorescence')
-    plt.title('Red Normalized to Isosbestic')
+        Yields:
+        --------
+        rows: numpy array
+                rows of whole frames, Iso, Red then Green row, without
+                the frame counter column
+    """
+    period = None
+    last_tick = None
+    last_frame = -1
+    segment = 0
+    phase = None
+    carry = None
+    n_rows = 0
+    for rows in blocks:
+        if len(rows) == 0:
+            continue
+        ticks = counter_ticks(rows[:, 1])
+        if period is None:
+            period = np.median(np.diff(ticks) % COUNTER_WRAP)
+            last_tick = ticks[0]
+
+        # Frames elapsed since the row before, more than 1 after a drop
+        elapsed = np.diff(ticks, prepend=last_tick) % COUNTER_WRAP
+        gaps = np.flatnonzero(elapsed >= 1.5 * period)
+        if len(gaps) == 0:
+            frames = last_frame + np.arange(1, len(rows) + 1)
+        else:
+            steps = np.maximum(np.rint(elapsed / period), 1).astype(np.int64)
+            frames = last_frame + np.cumsum(steps)
+        columns = [0] + list(range(2, rows.shape[1]))
+        n_rows += len(rows)
+        last_tick = ticks[-1]
+        last_frame = frames[-1]
+
+        if len(gaps) == 0 and phase is not None:
+            # No drop: whole frames run on from the first Iso row
+            if carry is not None:
+                rows = np.concatenate([carry[0], rows])
+                frames = np.concatenate([carry[1], frames])
+            first = (phase - frames[0]) % 3
+            end = first + (len(rows) - first) // 3 * 3
+            carry = None
+            if end < len(rows):
+                carry = (rows[end:], frames[end:],
+                         np.full(len(rows) - end, phase),
+                         np.full(len(rows) - end, segment))
+            yield rows[first:end][:, columns]
+            continue
 
-    # Save the plot in a png file
-    red_iso_plot_name = output_filename + '_f1RedNormIso.png'
-    figRed = plt.savefig(red_iso_plot_name)
-    plt.close(figRed)
+        # Run of rows between drops each row is in
+        local = np.zeros(len(rows), dtype=np.int64)
+        local[gaps] = 1
+        local = np.cumsum(local)
+
+        # Brightest residue of the green column of each run between
+        # drops, Iso is brightest (see interleave_slots)
+        keys = 3 * local + frames % 3
+        sums = np.bincount(keys, weights=rows[:, 2],
+                           minlength=3 * (len(gaps) + 1)).reshape(-1, 3)
+        counts = np.bincount(keys,
+                             minlength=3 * (len(gaps) + 1)).reshape(-1, 3)
+        brightest = np.argmax(sums / np.maximum(counts, 1), axis=1)
+        run_phase = np.empty(len(gaps) + 1, dtype=np.int64)
+        for run in range(len(gaps) + 1):
+            if phase is None:
+                found = brightest[run]
+            elif run > 0 and counts[run].sum() >= PHASE_MIN_ROWS:
+                found = brightest[run]
+            else:
+                found = phase
+            if run > 0 and drops is not None:
+                gap = gaps[run - 1]
+                drops.append({'row': int(first_row + n_rows - len(rows)
+                                         + gap),
+                              'time': float(rows[gap, 0]),
+                              'missing_frames': int(steps[gap] - 1),
+                              'shifted': bool(found != phase)})
+            phase = found
+            run_phase[run] = phase
+        row_phase = run_phase[local]
+        row_segment = segment + local
+        segment = row_segment[-1]
+
+        # Rows of a frame split between blocks are joined to the next
+        if carry is not None:
+            rows, frames, row_phase, row_segment = [
+                np.concatenate(pair) for pair in
+                zip(carry, (rows, frames, row_phase, row_segment))]
+
+        # Number frames of 3 rows from each Iso row, new numbers
+        # start after every drop
+        frame = (frames - row_phase) // 3
+        starts = np.ones(len(rows), dtype=bool)
+        starts[1:] = ((frame[1:] != frame[:-1])
+                      | (row_segment[1:] != row_segment[:-1]))
+        frame_id = np.cumsum(starts) - 1
+        whole = np.bincount(frame_id)[frame_id] == 3
+        last = frame_id == frame_id[-1]
+        if whole[-1]:
+            carry = None
+        else:
+            carry = (rows[last], frames[last], row_phase[last],
+                     row_segment[last])
+            whole &= ~last
 
+        yield rows[np.ix_(np.flatnonzero(whole), columns)]
 
-def fit_exp(values, a, b, c, d):
-    """Transforms data into an exponential function
-        of the form y=A*exp(-B*X)+C*exp(-D*x)
+
+def de_interleave_block(rows):
+    """Splits a block of frames into one array per channel type
+
+        All columns are split at once by viewing the rows as
+        (frames, 3, columns), so each fiber adds no per-sample
+        work beyond copying its values.
 
         Parameters
         ----------
-        values: list
-                data
-        a, b, c, d: integers or floats
-                estimates for the parameter values of
-                A, B, C and D
+        rows: numpy array
+                block of rows starting on an Iso row, columns fTime,
+                f1Green, f1Red, f2Green, f2Red and so on. A last,
+                incomplete frame is dropped.
+
+        Returns:
+        --------
+        block: Session
+                signals in signal_names order and times, without
+                metadata
     """
+    n_frames = len(rows) // 3
+    frames = rows[:3*n_frames].reshape(n_frames, 3, rows.shape[1])
 
-    values = np.array(values)
+    # (columns, slots, frames), slots in SLOTS order
+    channels = frames.transpose(2, 1, 0)
+    times = np.ascontiguousarray(channels[0])
+    signals = np.ascontiguousarray(channels[1:]).reshape(
+        3 * (rows.shape[1] - 1), n_frames)
+    n_fibers = (rows.shape[1] - 1) // len(fpho_session.COLORS)
+    return fpho_session.Session(signals, times,
+                                fpho_session.signal_names(n_fibers))
 
-    return a * np.exp(b * values) + c * np.exp(d * values)
 
+def import_fpho_data(input_filename, output_filename,
+                     n_fibers, f1greencol,
+                     animal_ID, exp_date, exp_desc,
+                     f2greencol=None,
+                     write_xlsx=False,
+                     use_cache=False,
+                     cache_max_mb=fpho_cache.CACHE_MAX_MB,
+                     dtype=np.float64,
+                     summary_format='csv',
+                     column_map=None,
+                     resample=False,
+                     resample_hz=None):
+    """Takes a file name, returns a session of parsed data
 
-def plot_fitted_exp(fpho_dataframe, output_filename):
-    """Creates a plot normalizing 1 fiber data to an
-        exponential of the form y=A*exp(-B*X)+C*exp(-D*x)
+        Parameters
+        ----------
+        input_filename: string
+                The path to the CSV file
+        output_filename: string
+                name for output file
+        n_fibers: integer
+                indicating 1 or 2 fiber input data, or any number
+                of fibers with column_map
+        f1greencol: integer
+                f1green column index
+        f2greencol: integer
+                f2green column index
+                default = None
+        animal_ID: integer
+                unique animal ID #
+        exp_date: YYYY_MM_DD
+                date data was gathered
+        exp_desc: string
+                brief description of data
+        write_xlsx: boolean
+                also write the summary as an excel file
+                default = False
+        use_cache: boolean
+                load de-interleaved channels from the parse cache
+                next to the output, parse and save them on a miss
+                default = False
+        cache_max_mb: number
+                size limit of the parse cache in megabytes
+        dtype: numpy data type
+                float64 or float32 storage for signal channels,
+                time channels are always float64
+                default = np.float64
+        summary_format: string
+                csv, parquet or feather, see write_summary
+                default = csv
+        column_map: dictionary
+                1-based column index for every fiber and color, e.g.
+                {'f1Green': 3, 'f1Red': 4, 'f2Green': 5, ...}, see
+                check_column_map. Replaces f1greencol and f2greencol.
+                default = None
+        resample: boolean
+                resample every channel onto one uniform time grid
+                before writing the summary, see resample_session
+                default = False
+        resample_hz: number
+                samples per second of the grid with resample
+                default = None, the recorded rate
+
+       Returns:
+        --------
+        session: Session
+                containing f1GreenIso, f1GreenRed, f1GreenGreen,
+                           f1RedIso, f1RedRed, f1RedGreen,
+                           the same channels for f2 and
+                           further fibers,
+                           fTimeIso, fTimeRed, fTimeGreen,
+                           animalID, date, description
+                Dropped frames are reported in
+                output_filename_Drops.csv, see write_drops
+        """
+
+    # Look up channels parsed by an earlier run with the same settings
+    cached = None
+    if use_cache is True:
+        with fpho_profile.stage('cache_lookup'):
+            cache_dir = fpho_cache.cache_dir_for(output_filename)
+            key = fpho_cache.cache_key(input_filename,
+                                       {'n_fibers': n_fibers,
+                                        'f1greencol': f1greencol,
+                                        'f2greencol': f2greencol,
+                                        'column_map': column_map},
+                                       cache_dir=cache_dir)
+            cached = fpho_cache.load_cached(cache_dir, key)
+
+    if cached is not None:
+        drops = pd.DataFrame(np.asarray(cached['drops']),
+                             columns=DROP_COLUMNS)
+        session = fpho_session.Session(cached['signals'], cached['times'],
+                                       fpho_session.signal_names(
+                                           len(cached['signals'])
+                                           // (len(fpho_session.COLORS)
+                                               * len(fpho_session.SLOTS))),
+                                       animalID=animal_ID, date=exp_date,
+                                       description=exp_desc, dtype=dtype)
+    else:
+        # Join the de-interleaved blocks
+        with fpho_profile.stage('parse'):
+            drops = []
+            session = fpho_session.Session.concatenate(
+                          stream_fpho_data(input_filename, n_fibers,
+                                           f1greencol, f2greencol=f2greencol,
+                                           column_map=column_map,
+                                           drops=drops),
+                          animalID=animal_ID, date=exp_date,
+                          description=exp_desc, dtype=dtype)
+            drops = pd.DataFrame(drops, columns=DROP_COLUMNS)
+
+        if use_cache is True:
+            with fpho_profile.stage('cache_save'):
+                fpho_cache.save_cached(cache_dir, key,
+                                       {'signals': session.signals,
+                                        'times': session.times,
+                                        'drops': drops.to_numpy(
+                                            dtype=np.float64)})
+                fpho_cache.evict_cache(cache_dir, max_mb=cache_max_mb)
+
+    if len(drops) > 0:
+        write_drops(drops, output_filename)
+
+    if resample is True:
+        with fpho_profile.stage('resample'):
+            session = resample_session(session, rate=resample_hz)
+
+    with fpho_profile.stage('write_summary'):
+        write_summary(session, output_filename, write_xlsx=write_xlsx,
+                      summary_format=summary_format)
+
+    return session
+
+
+def write_drops(drops, output_filename):
+    """Writes the dropped frame report
 
         Parameters
         ----------
-        fpho_dataframe: string
-                pandas dataframe
+        drops: dataframe
+                one row per drop, see align_frames
         output_filename: string
-                name for output csv
+                name for output files
+
         Returns:
         --------
-        output_filename_f1GreenNormExp.png
-        & output_filename_f1RedNormExp.png: png files
-                containing the normalized plot for each fluorophore
+        Writes output_filename_Drops.csv
     """
+    drops = drops.astype({'row': np.int64, 'missing_frames': np.int64,
+                          'shifted': bool})
+    output_drops = output_filename + '_Drops.csv'
+    drops.to_csv(output_drops, index=False)
+    print('Warning: ' + str(drops['missing_frames'].sum())
+          + ' frames dropped in ' + str(len(drops)) + ' places, '
+          + str(drops['shifted'].sum()) + ' shifted the colors. '
+          + 'Report written to ' + output_drops)
 
-    # Open dataframe
-    # Check for Name Error and Permission Error exceptions
-    try:
-        df = fpho_dataframe
-    except NameError:
-        print('No ' + fpho_dataframe + ' data frame found')
-        sys.exit(1)
-    except PermissionError:
-        print('Unable to access data frame ' + fpho_dataframe)
-        sys.exit(1)
 
-    # Initialize lists for the fluorophores and time
-    f1GreenGreen = []
-    f1GreenTime = []
-
-    f1RedRed = []
-    f1RedTime = []
-
-    # Define columns
-    greenGreen_col = "f1GreenGreen"
-    greenTime_col = "fTimeGreen"
-    redRed_col = "f1RedRed"
-    redTime_col = "fTimeRed"
-
-    # Read through each line of the dataframe
-    # Append the fluorophore and time data to their
-    # respective vectors, depending on color
-    f1GreenGreen = df[greenGreen_col].values[0]
-    f1GreenTime = df[greenTime_col].values[0]
-    f1RedRed = df[redRed_col].values[0]
-    f1RedTime = df[redTime_col].values[0]
-
-    # Make sure the time and color vectors have the same number
-    # of values. If not, then trim off the last few values
-    # from the longer vector
-    if len(f1GreenTime) > len(f1GreenGreen):
-        n = len(f1GreenTime) - len(f1GreenGreen)
-        del f1GreenTime[-n:]
-    elif len(f1GreenTime) < len(f1GreenGreen):
-        n = len(f1GreenGreen) - len(f1GreenTime)
-        del f1GreenGreen[-n:]
-
-    if len(f1RedTime) > len(f1RedRed):
-        n = len(f1RedTime) - len(f1RedRed)
-        del f1RedTime[-n:]
-    elif len(f1RedTime) < len(f1RedRed):
-        n = len(f1RedRed) - len(f1RedTime)
-        del f1RedRed[-n:]
-
-    # Initialize the time data to 0 by subracting each value
-    # by the first value
-    timeG = []
-    for i in range(len(f1GreenTime)):
-        timeG.append(f1GreenTime[i] - f1GreenTime[0])
-
-    timeR = []
-    for i in range(len(f1RedTime)):
-        timeR.append(f1RedTime[i] - f1RedTime[0])
-
-    # Get coefficients for normalized fit using first guesses
-    # for the coefficients - B and D (the second and fourth
-    # inputs for p0) must be negative, while A and C (the
-    # first and third inputs for p0) must be positive
-    popt, pcov = curve_fit(fit_exp, timeG, f1GreenGreen,
-                           p0=(1.0, -0.001, 1.0, -0.001), maxfev=500000)
-
-    AG = popt[0]  # A value
-    BG = popt[1]  # B value
-    CG = popt[2]  # C value
-    DG = popt[3]  # D value
-
-    popt, pcov = curve_fit(fit_exp, timeR, f1RedRed,
-                           p0=(1.0, -0.001, 1.0, -0.001), maxfev=500000)
-
-    AR = popt[0]  # A value
-    BR = popt[1]  # B value
-    CR = popt[2]  # C value
-    DR = popt[3]  # D value
-
-    # Generate fit line using calculated coefficients
-    fitGreen = fit_exp(timeG, AG, BG, CG, DG)
-    fitRed = fit_exp(timeR, AR, BR, CR, DR)
-
-    # Plot the data for green
-    plt.plot(timeG, f1GreenGreen, color='g')
-    plt.plot(timeG, fitGreen, color='k')
-    # Remove top and right borders
-    plt.gca().spines['right'].set_color('none')
-    plt.gca().spines['top'].set_color('none')
-    # Add axes labels and a title
-    plt.xlabel('Time')
-    plt.ylabel('Fluorescence')
-    plt.title('Green Fitted to Exponential')
-
-    # Save the plot in a png file
-    green_exp_plot_name = output_filename + '_f1GreenNormExp.png'
-    figGreen = plt.savefig(green_exp_plot_name)
-    plt.close(figGreen)
-
-    # Plot the data for red
-    plt.plot(timeR, f1RedRed, color='r')
-    plt.plot(timeR, fitRed, color='k')
-    # Remove top and right borders
-    plt.gca().spines['right'].set_color('none')
-    plt.gca().spines['top'].set_color('none')
-    # Add axes labels and a title
-    plt.xlabel('Time')
-    plt.ylabel('Fluorescence')
-    plt.title('Red Fitted to Exponential')
-
-    # Save the plot in a png file
-    red_exp_plot_name = output_filename + '_f1RedNormExp.png'
-    figRed = plt.savefig(red_exp_plot_name)
-    plt.close(figRed)
+def uniform_grid(session, rate=None):
+    """Takes a session, returns one uniform time grid for all channels
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        rate: number
+                samples per second of the grid
+                default = None, the median frame rate of the recording
+
+        Returns:
+        --------
+        grid: numpy array
+                times in msec from the latest first sample to the
+                earliest last sample of the three time channels
+    """
+    times = session.times
+    if rate is None:
+        period = np.median(np.diff(times, axis=1)) if len(session) > 1 else 1
+    else:
+        period = 1000 / rate
+    start = times[:, 0].max()
+    stop = times[:, -1].min()
+    return start + period * np.arange(int((stop - start) // period) + 1)
+
+
+def interpolate_channels(session, grid):
+    """Takes a session and times, returns every signal channel linearly
+        interpolated at those times
+
+        Rows of one LED share a time channel, so each time channel
+        is searched once and all channels are gathered in one call.
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        grid: numpy array
+                ascending times in msec, within the times of every
+                time channel
+
+        Returns:
+        --------
+        signals: numpy array
+                shape (channels, len(grid)) float64, rows in the
+                order of session.signals
+    """
+    times = session.times
+    n_slots = len(fpho_session.SLOTS)
+    right = np.empty((n_slots, len(grid)), dtype=np.intp)
+    for slot in range(n_slots):
+        right[slot] = np.searchsorted(times[slot], grid, side='right')
+    np.clip(right, 1, max(len(session) - 1, 1), out=right)
+    left = right - 1
+    span = np.take_along_axis(times, right, 1) - np.take_along_axis(
+        times, left, 1)
+    weight = np.divide(grid - np.take_along_axis(times, left, 1), span,
+                       out=np.zeros(span.shape), where=span > 0)
+
+    # Rows are (fiber, color) groups of the Iso, Red and Green slots
+    values = session.signals.reshape(-1, n_slots, len(session))
+    lower = np.take_along_axis(values, left[None], 2)
+    upper = np.take_along_axis(values, right[None], 2)
+    return (lower + weight * (upper - lower)).reshape(-1, len(grid))
+
+
+def resample_session(session, rate=None):
+    """Resamples every channel of a session onto one uniform time grid
+
+        fTimeIso, fTimeRed and fTimeGreen are separate, jittered
+        clocks. The resampled session has the same grid in all three,
+        so every channel lines up sample for sample. Below the
+        recorded rate, channels are interpolated at a whole multiple
+        of the output rate, low-pass filtered forwards and backwards
+        (no phase shift) and decimated, so faster changes do not
+        alias into the output.
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        rate: number
+                samples per second of the output
+                default = None, the median frame rate of the recording
+
+        Returns:
+        --------
+        session: Session
+                same channels, names, metadata and signal data type
+    """
+    if rate is not None:
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            rate = 0
+        if not rate > 0:
+            print("\nError: Resample rate <" + str(rate) + "> was invalid."
+                  + " Please enter a number of samples per second above 0\n")
+            sys.exit(1)
+
+    # Decimate from a whole multiple of the output rate
+    native = None
+    if len(session) > 1:
+        native = 1000 / np.median(np.diff(session.times, axis=1))
+    factor = 1
+    if rate is not None and native is not None and rate < native:
+        factor = int(np.ceil(native / rate))
+    grid = uniform_grid(session, rate=None if rate is None
+                        else rate * factor)
+    signals = interpolate_channels(session, grid)
+
+    if factor > 1:
+        sos = scipy.signal.cheby1(RESAMPLE_ORDER, RESAMPLE_RIPPLE_DB,
+                                  RESAMPLE_CUTOFF / factor, output='sos')
+        signals = scipy.signal.sosfiltfilt(
+            sos, signals, axis=1,
+            padlen=min(3 * (2 * len(sos) + 1), len(grid) - 1))
+        grid = grid[::factor]
+        signals = signals[:, ::factor]
+
+    return fpho_session.Session(
+        np.ascontiguousarray(signals, dtype=session.signals.dtype),
+        np.tile(grid, (len(fpho_session.TIME_NAMES), 1)), session.names,
+        animalID=session.animalID, date=session.date,
+        description=session.description)
+
+
+def summary_dataframe(session):
+    """Takes a session, returns a one row dataframe of it
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+
+        Returns:
+        --------
+        fdata: pandas dataframe
+                one row with a list of values for every channel,
+                then animalID, date and description
+    """
+    summary_dict = {name: [session[name].tolist()]
+                    for name in session.columns}
+    summary_dict['animalID'] = [session.animalID]
+    summary_dict['date'] = [session.date]
+    summary_dict['description'] = [session.description]
+
+    return pd.DataFrame.from_dict(summary_dict)
+
+
+def summary_table(session):
+    """Takes a session, returns a columnar table of it
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+
+        Returns:
+        --------
+        table: pyarrow Table
+                one column per channel and one row per sample.
+                Channel names, animalID, date and description are
+                kept as JSON in the schema metadata.
+    """
+    metadata = {'names': list(session.names),
+                'animalID': session.animalID,
+                'date': session.date,
+                'description': session.description,
+                'driver_version': driver_version}
+    return pa.Table.from_arrays(
+        [pa.array(session[name]) for name in session.columns],
+        names=session.columns,
+        metadata={SUMMARY_METADATA_KEY: json.dumps(metadata)})
+
+
+def write_summary(session, output_filename, write_xlsx=False,
+                  summary_format='csv'):
+    """Writes a session to the _Summary file, and optionally excel file
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        write_xlsx: boolean
+                also write an excel file
+                default = False
+        summary_format: string
+                csv for one row with a list of values per channel,
+                parquet or feather for one column per channel and
+                one row per sample (needs pyarrow)
+                default = csv
+    """
+    # Catch error: unknown summary format
+    if summary_format not in SUMMARY_FORMATS:
+        print("\nError: Summary format <" + str(summary_format)
+              + "> was invalid. Please enter one of "
+              + ", ".join(SUMMARY_FORMATS))
+        sys.exit(1)
+
+    output_summary = (output_filename + '_Summary'
+                      + SUMMARY_FORMATS[summary_format])
+    if summary_format == 'csv':
+        # Dataframe to output csv
+        summary_dataframe(session).to_csv(output_summary, index=False)
+        print('Output CSV written to ' + output_summary)
+    else:
+        if pa is None:
+            print("\nError: Writing a " + summary_format + " summary "
+                  + "needs pyarrow. Install pyarrow or use csv.")
+            sys.exit(1)
+        table = summary_table(session)
+        if summary_format == 'parquet':
+            pa_parquet.write_table(table, output_summary)
+        else:
+            pa_feather.write_feather(table, output_summary)
+        print('Output ' + summary_format + ' file written to '
+              + output_summary)
+
+    if write_xlsx is True:
+        with fpho_profile.stage('write_xlsx'):
+            output_xlsx = output_filename + '_Summary.xlsx'
+            summary_dataframe(session).to_excel(output_xlsx, index=False)
+        print('Output excel file written to ' + output_xlsx)
+
+
+def load_summary(summary_filename):
+    """Takes a parquet or feather _Summary file, returns its session
+
+        Parameters
+        ----------
+        summary_filename: string
+                path of a summary written by write_summary
+
+        Returns:
+        --------
+        session: Session
+                parsed fiberphotometry data with its metadata
+    """
+    if pa is None:
+        print("\nError: Loading a summary needs pyarrow.")
+        sys.exit(1)
+
+    # Open file, catch errors
+    try:
+        if summary_filename.endswith(SUMMARY_FORMATS['parquet']):
+            table = pa_parquet.read_table(summary_filename,
+                                          memory_map=True)
+        else:
+            table = pa_feather.read_table(summary_filename,
+                                          memory_map=True)
+    except FileNotFoundError:
+        print("Could not find file: " + summary_filename)
+        sys.exit(1)
+    except PermissionError:
+        print("Could not access file: " + summary_filename)
+        sys.exit(2)
+
+    metadata = table.schema.metadata or {}
+    if SUMMARY_METADATA_KEY not in metadata:
+        print("No session metadata found in file: " + summary_filename)
+        sys.exit(1)
+    metadata = json.loads(metadata[SUMMARY_METADATA_KEY])
+    names = metadata['names']
+
+    dtype = table.schema.field(names[0]).type.to_pandas_dtype()
+    signals = np.empty((len(names), table.num_rows), dtype=dtype)
+    for i, name in enumerate(names):
+        signals[i] = table.column(name).to_numpy()
+    times = np.empty((len(fpho_session.TIME_NAMES), table.num_rows))
+    for i, name in enumerate(fpho_session.TIME_NAMES):
+        times[i] = table.column(name).to_numpy()
+
+    return fpho_session.Session(signals, times, names,
+                                animalID=metadata['animalID'],
+                                date=metadata['date'],
+                                description=metadata['description'])
+
+
+def minmax_envelope(time, values, n_bins):
+    """Reduces a trace to the min and max of each of n_bins bins
+
+        Drawn as a line, the envelope covers the same pixels as the
+        full trace when there is a bin per pixel column, so peaks
+        and artifacts stay visible.
+
+        Parameters
+        ----------
+        time: numpy array
+                time of each sample
+        values: numpy array
+                data
+        n_bins: integer
+                number of bins, e.g. the width of the axes in pixels
+
+        Returns:
+        --------
+        time, values: numpy arrays
+                the min and max sample of each bin in time order,
+                or the trace itself if it has at most 2 * n_bins
+                samples
+    """
+    n = len(values)
+    if n <= 2 * n_bins:
+        return time, values
+    width = -(-n // n_bins)
+    n_full = n // width * width
+
+    # Rows of bins, the last partial bin is handled on its own
+    bins = values[:n_full].reshape(-1, width)
+    lows = bins.argmin(axis=1)
+    highs = bins.argmax(axis=1)
+    index = np.column_stack([np.minimum(lows, highs),
+                             np.maximum(lows, highs)])
+    index += np.arange(0, n_full, width)[:, None]
+    index = index.ravel()
+    if n_full < n:
+        tail = values[n_full:]
+        index = np.concatenate([index, n_full + np.sort(
+            [tail.argmin(), tail.argmax()])])
+    return time[index], values[index]
+
+
+def plot_envelope(ax, time, values, **kwargs):
+    """Plots a trace on ax as a min/max envelope, 2 bins per pixel
+
+        Parameters
+        ----------
+        ax: matplotlib axes
+                axes to plot on, already sized in its figure
+        time, values: numpy arrays
+                trace to plot
+        kwargs:
+                passed to ax.plot
+
+        Returns:
+        --------
+        lines: list of matplotlib lines
+    """
+    n_bins = max(2 * int(ax.get_window_extent().width), 1)
+    return ax.plot(*minmax_envelope(time, values, n_bins), **kwargs)
+
+
+def raw_channel_options(session):
+    """Lists the channels raw_signal_trace can plot for a session
+
+        Parameters
+        ----------
+        session: Session
+                    contains parsed fiberphotometry data
+
+        Returns:
+        --------
+        options: list of strings
+                    e.g. f1Red, f1Green, f2Red, f2Green
+    """
+    return ['f' + str(fiber) + color
+            for fiber in range(1, session.n_fibers + 1)
+            for color in RAW_CHANNELS]
+
+
+def select_raw_channels(session, channels='all'):
+    """Checks the channels to plot with raw_signal_trace
+
+        Parameters
+        ----------
+        session: Session
+                    contains parsed fiberphotometry data
+        channels: string or list of strings
+                    channels to plot, e.g. f1Red or f2Green, or all
+                    for every channel of the session. A string can
+                    hold several channels separated with a space or
+                    comma.
+
+        Returns:
+        --------
+        channel_list: list of strings
+                    the selected channels, in the order of
+                    raw_channel_options, each once
+    """
+    if isinstance(channels, str):
+        channels = channels.replace(',', ' ').split()
+    options = raw_channel_options(session)
+    if 'all' in channels:
+        return options
+
+    # catch input error -- channel not found in the session
+    for channel in channels:
+        if channel not in options:
+            print("Could not find entries for channels you'd like to plot"
+                  + " in the session channel names."
+                  + " You entered <" + str(channel) + "> and the options"
+                  + " are " + ", ".join(options + ['all']))
+            sys.exit(1)
+    if len(channels) == 0:
+        print("No channels to plot. Options are "
+              + ", ".join(options + ['all']))
+        sys.exit(1)
+    return [channel for channel in options if channel in channels]
+
+
+def draw_raw_signal(time_data, traces, channels, l_color):
+    """Draws raw signal traces side by side
+
+        Parameters
+        ----------
+        time_data: numpy array
+                    time of each sample
+        traces: list of numpy arrays
+                    data of each channel
+        channels: list of strings
+                    channel names, used as titles
+        l_color: string
+                    line color
+
+        Returns:
+        --------
+        fig: matplotlib figure
+    """
+    fig = fpho_plot.new_figure(figsize=(7*len(channels), 6),
+                               facecolor='w',
+                               edgecolor='k',
+                               dpi=300)
+
+    for i in range(0, len(channels)):
+
+        # Initialize plot, add data and title
+        ax = fig.add_subplot(1, len(channels), 1+i)
+        plot_envelope(ax, time_data, traces[i], color=l_color)
+        ax.set_title(str(channels[i]))
+
+        # Remove top and right borders
+        fpho_plot.remove_borders(ax)
+
+    return fig
+
+
+def raw_signal_figures(session, output_filename, channel_list):
+    """Describes the raw signal plots of the chosen channels
+
+        Parameters
+        ----------
+        session: Session
+                    contains parsed fiberphotometry data
+        output_filename: string
+                    output png name
+        channel_list: list of strings
+                    channels to plot, from select_raw_channels
+
+        Returns:
+        --------
+        jobs: list of dictionaries
+                    one fpho_plot.figure_job per channel
+    """
+    jobs = []
+    for channel in channel_list:
+        fiber, color = split_label(channel)
+        slots, time_col, l_color = RAW_CHANNELS[color]
+        channels = [fiber + slot for slot in slots]
+
+        # outputs raw sig plot as png file
+        rawsig_file_name = output_filename + '_RawSignal_' + channel + '.png'
+        jobs.append(fpho_plot.figure_job(
+            draw_raw_signal, rawsig_file_name,
+            savefig={'bbox_inches': 'tight'},
+            time_data=np.asarray(session[time_col]),
+            traces=[np.asarray(session[name]) for name in channels],
+            channels=channels, l_color=l_color))
+    return jobs
+
+
+def raw_signal_trace(session, output_filename, channels='all', workers=1):
+    """Creates a plot of the raw signal traces
+    Parameters
+    ----------
+    session: Session
+                    contains parsed fiberphotometry data
+    output_filename: string
+                    output png name
+    channels: string or list of strings
+                    channels to plot, e.g. f1Red or f2Green, default
+                    all. See select_raw_channels
+    workers: integer
+                    number of processes drawing plots, see
+                    fpho_plot.render_figures
+
+    Returns:
+    --------
+    output_filename_RawSignal_channel.png: PNG
+                     Plot of data for each channel
+    """
+    channel_list = select_raw_channels(session, channels)
+    fpho_plot.render_figures(raw_signal_figures(session, output_filename,
+                                                channel_list),
+                             workers=workers)
+
+
+def isosbestic_pairs(session):
+    """Takes a session, returns the channels fit to the isosbestic
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+
+        Returns:
+        --------
+        pairs: list of tuples
+                (label, isosbestic name, signal name, time name)
+                for each fiber and color, e.g. (f1Green, f1GreenIso,
+                f1GreenGreen, fTimeGreen)
+    """
+    pairs = []
+    for fiber in range(1, session.n_fibers + 1):
+        for color in fpho_session.COLORS:
+            label = 'f' + str(fiber) + color
+            pairs.append((label, label + 'Iso', label + color,
+                          'fTime' + color))
+    return pairs
+
+
+def window_samples(session, window_sec):
+    """Takes a window in seconds, returns it in samples of a session
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        window_sec: number
+                window length in seconds
+
+        Returns:
+        --------
+        window: integer
+                odd number of samples, at least 3
+    """
+    try:
+        window_sec = float(window_sec)
+    except (TypeError, ValueError):
+        window_sec = 0
+    if window_sec <= 0:
+        print("\nError: Window <" + str(window_sec) + "> was invalid."
+              + " Please enter a number of seconds above 0\n")
+        sys.exit(1)
+    time = session['fTimeGreen']
+    rate = (len(time) - 1) * 1000 / (time[-1] - time[0])
+    return max(3, int(round(window_sec * rate)) // 2 * 2 + 1)
+
+
+def rolling_fit(iso, sig, window):
+    """Fits signal = a * isosbestic + b in a window around every sample
+
+        Window sums of x, y, x*x and x*y are differences of
+        cumulative sums, so every window costs the same however
+        long it is and all channels take one pass.
+
+        Parameters
+        ----------
+        iso: numpy array
+                shape (channels, samples), isosbestic values
+        sig: numpy array
+                shape (channels, samples), signal values
+        window: integer
+                samples in each window, centered on its sample.
+                Windows are cut short at the ends of the recording,
+                so one of 2 * samples - 1 or more is a global fit.
+
+        Returns:
+        --------
+        a, b: numpy arrays
+                shape (channels, samples), slope and intercept of
+                the fit around each sample
+    """
+    n = iso.shape[1]
+    # Past 2n - 1 samples every window holds the whole recording
+    window = min(window, 2 * n - 1)
+    half = window // 2
+
+    # Windows are cut short within half a window of the ends
+    edges = np.r_[0:half, n - half:n]
+    lo = np.maximum(edges - half, 0)
+    hi = np.minimum(edges + half + 1, n)
+    count = np.full(n, float(window))
+    count[edges] = hi - lo
+
+    # Sums about the channel means keep their precision
+    isoMean = iso.mean(axis=1, keepdims=True, dtype=np.float64)
+    sigMean = sig.mean(axis=1, keepdims=True, dtype=np.float64)
+    x = iso - isoMean
+    y = sig - sigMean
+    product = np.empty_like(x)
+    cumsum = np.zeros((len(iso), n + 1))
+    sums = []
+    for step in range(4):
+        # Window sums of x, y, x*x, then x*y, which overwrites x
+        if step == 2:
+            np.multiply(x, x, out=product)
+        elif step == 3:
+            np.multiply(x, y, out=x)
+        np.cumsum([x, y, product, x][step], axis=1, out=cumsum[:, 1:])
+        window_sum = np.empty((len(iso), n))
+        if window <= n:
+            np.subtract(cumsum[:, window:], cumsum[:, :n + 1 - window],
+                        out=window_sum[:, half:n - half])
+        window_sum[:, edges] = cumsum[:, hi] - cumsum[:, lo]
+        sums.append(window_sum)
+    sx, sy, sxx, sxy = sums
+
+    # a = (count sxy - sx sy) / (count sxx - sx sx), in place
+    sxy *= count
+    sxy -= np.multiply(sx, sy, out=product)
+    sxx *= count
+    sxx -= np.multiply(sx, sx, out=product)
+    a = np.divide(sxy, sxx, out=sxy)
+
+    # b = mean(y) - a mean(x), shifted back by the channel means
+    sy -= np.multiply(a, sx, out=sx)
+    sy /= count
+    sy += sigMean
+    b = np.subtract(sy, np.multiply(a, isoMean, out=sx), out=sy)
+    return a, b
+
+
+def isosbestic_norm(session, window_sec=None):
+    """Normalizes every fiber and color to its isosbestic channel
+
+        Fits signal = a * isosbestic + b by least squares for all
+        channels at once (the same line np.polyfit(iso, signal, 1)
+        gives), then dF/F = (signal - fit) / fit.
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        window_sec: number
+                fit in a window of this many seconds around each
+                sample, see rolling_fit, to follow slow changes over
+                long sessions
+                default = None, one fit of the whole recording
+
+        Returns:
+        --------
+        normData: dictionary
+                dF/F for each label from isosbestic_pairs, views of
+                rows of one (labels, samples) float64 array
+        coefficients: dictionary
+                (a, b) of the control fit for each label, arrays of
+                one value per sample with window_sec
+    """
+    pairs = isosbestic_pairs(session)
+    iso = session.signals[[session.rows[pair[1]] for pair in pairs]]
+    sig = session.signals[[session.rows[pair[2]] for pair in pairs]]
+
+    if window_sec is not None:
+        a, b = rolling_fit(iso, sig, window_samples(session, window_sec))
+        controlFit = a * iso + b
+    else:
+        # Get coefficients for normalized fit
+        isoMean = iso.mean(axis=1, dtype=np.float64)
+        sigMean = sig.mean(axis=1, dtype=np.float64)
+        isoCentered = iso - isoMean[:, None]
+        a = (np.einsum('ij,ij->i', isoCentered, sig - sigMean[:, None])
+             / np.einsum('ij,ij->i', isoCentered, isoCentered))
+        b = sigMean - a * isoMean
+
+        # Use the coefficients to create a control fit
+        controlFit = a[:, None] * iso + b[:, None]
+
+    # Normalize the fluorophore data using the control fit
+    normData = (sig - controlFit) / controlFit
+
+    labels = [pair[0] for pair in pairs]
+    return ({label: normData[i] for i, label in enumerate(labels)},
+            {label: (a[i], b[i]) for i, label in enumerate(labels)})
+
+
+def draw_isosbestic_norm(time, normData, color, title):
+    """Draws a signal normalized to the isosbestic
+
+        Parameters
+        ----------
+        time: numpy array
+                time of each sample
+        normData: numpy array
+                dF/F of the signal
+        color: string
+                Green or Red
+        title: string
+                plot title
+
+        Returns:
+        --------
+        fig: matplotlib figure
+    """
+    fig = fpho_plot.new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Plot the data
+    plot_envelope(ax, time, normData, color=color[0].lower())
+    # Remove top and right borders
+    fpho_plot.remove_borders(ax)
+    # Add axes labels and a title
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Normalized Fluorescence')
+    ax.set_title(title)
+    return fig
+
+
+def isosbestic_norm_figures(session, output_filename, window_sec=None,
+                            normData=None):
+    """Describes the plots of each fiber and color normalized to
+        the isosbestic
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        window_sec: number
+                seconds in each sliding fit window, see
+                isosbestic_norm
+                default = None, one fit of the whole recording
+        normData: dictionary
+                dF/F for each label from isosbestic_norm
+                default = None, normalized here
+
+        Returns:
+        --------
+        jobs: list of dictionaries
+                one fpho_plot.figure_job per fiber and color
+    """
+    if normData is None:
+        with fpho_profile.stage('normalize'):
+            normData, coefficients = isosbestic_norm(session,
+                                                     window_sec=window_sec)
+
+    jobs = []
+    for label, isoName, sigName, timeName in isosbestic_pairs(session):
+        color = sigName[len(label):]
+        title = color + ' Normalized to Isosbestic'
+        if window_sec is not None:
+            title += ' ({:g} s window)'.format(float(window_sec))
+        if session.n_fibers > 1:
+            title = split_label(label)[0] + ' ' + title
+
+        # Save the plot in a png file
+        iso_plot_name = output_filename + '_' + label + 'NormIso.png'
+        jobs.append(fpho_plot.figure_job(
+            draw_isosbestic_norm, iso_plot_name,
+            time=np.asarray(session[timeName]), normData=normData[label],
+            color=color, title=title))
+    return jobs
+
+
+def plot_isosbestic_norm(session, output_filename, workers=1,
+                         window_sec=None):
+    """Creates a plot normalizing each fiber and color to the isosbestic
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        workers: integer
+                number of processes drawing plots, see
+                fpho_plot.render_figures
+        window_sec: number
+                seconds in each sliding fit window, see
+                isosbestic_norm
+                default = None, one fit of the whole recording
+        Returns:
+        --------
+        output_filename_f1GreenNormIso.png
+        & output_filename_f1RedNormIso.png: png files
+                containing the normalized plot for each fluorophore,
+                and the same for f2 with 2 fiber data
+    """
+    fpho_plot.render_figures(isosbestic_norm_figures(
+                                 session, output_filename,
+                                 window_sec=window_sec),
+                             workers=workers)
+
+
+def percentile_dff(session, window_sec=DFF_WINDOW_SEC,
+                   percentile=DFF_PERCENTILE):
+    """Takes dF/F of every fiber and color to a rolling percentile
+
+        F0 is a low percentile of the signal in a window around each
+        sample, which follows photobleaching and slow drift without
+        the isosbestic channel. All channels are done in one call to
+        fpho_rolling.rolling_percentile.
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        window_sec: number
+                seconds in the window around each sample
+                default = DFF_WINDOW_SEC
+        percentile: number
+                percentile of the window taken as F0, from 0 to 100
+                default = DFF_PERCENTILE
+
+        Returns:
+        --------
+        dff: dictionary
+                dF/F = (signal - F0) / F0 for each label from
+                isosbestic_pairs
+        baseline: dictionary
+                F0 for each label
+    """
+    try:
+        percentile = float(percentile)
+    except (TypeError, ValueError):
+        percentile = -1
+    if not 0 <= percentile <= 100:
+        print("\nError: Percentile <" + str(percentile) + "> was invalid."
+              + " Please enter a number from 0 to 100\n")
+        sys.exit(1)
+
+    pairs = isosbestic_pairs(session)
+    sig = session.signals[[session.rows[pair[2]] for pair in pairs]]
+    f0 = fpho_rolling.rolling_percentile(
+        sig, window_samples(session, window_sec), percentile)
+    dff = (sig - f0) / f0
+
+    labels = [pair[0] for pair in pairs]
+    return ({label: dff[i] for i, label in enumerate(labels)},
+            {label: f0[i] for i, label in enumerate(labels)})
+
+
+def percentile_dff_figures(session, output_filename,
+                           window_sec=DFF_WINDOW_SEC,
+                           percentile=DFF_PERCENTILE, dff=None):
+    """Describes the plots of each fiber and color as dF/F to a
+        rolling percentile
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        window_sec: number
+                seconds in the window, see percentile_dff
+        percentile: number
+                percentile taken as F0, see percentile_dff
+        dff: dictionary
+                dF/F for each label from percentile_dff
+                default = None, found here
+
+        Returns:
+        --------
+        jobs: list of dictionaries
+                one fpho_plot.figure_job per fiber and color
+    """
+    if dff is None:
+        with fpho_profile.stage('rolling_baseline'):
+            dff, baseline = percentile_dff(session, window_sec=window_sec,
+                                           percentile=percentile)
+
+    jobs = []
+    for label, isoName, sigName, timeName in isosbestic_pairs(session):
+        color = sigName[len(label):]
+        title = color + ' dF/F ({:g}th percentile, {:g} s window)'.format(
+            float(percentile), float(window_sec))
+        if session.n_fibers > 1:
+            title = split_label(label)[0] + ' ' + title
+
+        # Save the plot in a png file
+        dff_plot_name = output_filename + '_' + label + 'DFF.png'
+        jobs.append(fpho_plot.figure_job(
+            draw_isosbestic_norm, dff_plot_name,
+            time=np.asarray(session[timeName]), normData=dff[label],
+            color=color, title=title))
+    return jobs
+
+
+def plot_percentile_dff(session, output_filename, workers=1,
+                        window_sec=DFF_WINDOW_SEC,
+                        percentile=DFF_PERCENTILE):
+    """Creates a plot of each fiber and color as dF/F to a rolling
+        percentile
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        workers: integer
+                number of processes drawing plots, see
+                fpho_plot.render_figures
+        window_sec: number
+                seconds in the window, see percentile_dff
+        percentile: number
+                percentile taken as F0, see percentile_dff
+
+        Returns:
+        --------
+        output_filename_f1GreenDFF.png
+        & output_filename_f1RedDFF.png: png files
+                containing the dF/F plot for each fluorophore, and
+                the same for f2 with 2 fiber data
+    """
+    fpho_plot.render_figures(percentile_dff_figures(
+                                 session, output_filename,
+                                 window_sec=window_sec,
+                                 percentile=percentile),
+                             workers=workers)
+
+
+def fit_exp(values, a, b, c, d):
+    """Transforms data into an exponential function
+        of the form y=A*exp(-B*X)+C*exp(-D*x)
+
+        Parameters
+        ----------
+        values: list
+                data
+        a, b, c, d: integers or floats
+                estimates for the parameter values of
+                A, B, C and D
+    """
+
+    values = np.array(values)
+
+    return a * np.exp(b * values) + c * np.exp(d * values)
+
+
+def fit_exp_jacobian(values, a, b, c, d):
+    """Partial derivatives of fit_exp for curve_fit
+
+        Parameters
+        ----------
+        values: numpy array
+                data
+        a, b, c, d: floats
+                parameter values of A, B, C and D
+
+        Returns:
+        --------
+        jacobian: numpy array
+                shape (len(values), 4), derivatives by A, B, C, D
+    """
+    eb = np.exp(b * values)
+    ed = np.exp(d * values)
+    return np.column_stack([eb, a * values * eb, ed, c * values * ed])
+
+
+def exp_initial_guess(time, signal):
+    """Guesses fit_exp parameters from the data
+
+        Candidate rates come from a line fit to log(signal) over
+        the second half of the recording (slow component), a line
+        fit to the log of what remains over the first tenth (fast
+        component), and a fixed grid of rates. For each pair of
+        rates A and C are solved by linear least squares, and the
+        pair with the smallest error is returned.
+
+        Parameters
+        ----------
+        time: numpy array
+                time, scaled to run from 0 to 1
+        signal: numpy array
+                fluorescence data
+
+        Returns:
+        --------
+        p0: tuple of floats
+                guesses for A, B, C and D
+    """
+    n = len(time)
+    rates = list(GUESS_RATES)
+    late = slice(n // 2, None)
+    if (signal[late] > 0).all():
+        d, logC = np.polyfit(time[late], np.log(signal[late]), 1)
+        rates.append(d)
+        # Peel the slow component off the start of the recording
+        early = slice(0, max(n // 10, 3))
+        residual = signal[early] - np.exp(logC + d * time[early])
+        positive = residual > 0
+        if positive.sum() >= 3:
+            rates.append(np.polyfit(time[early][positive],
+                                    np.log(residual[positive]), 1)[0])
+    # Rates fit to noise can be far outside the grid, where the
+    # exponentials overflow
+    rates = np.unique(np.clip(rates, min(GUESS_RATES), max(GUESS_RATES)))
+
+    # exp(rate * time) for every rate, then every pair of them
+    basis = np.exp(np.multiply.outer(rates, time))
+    best = None
+    for i, j in itertools.combinations(range(len(rates)), 2):
+        design = np.column_stack([basis[i], basis[j]])
+        (a, c), sse, rank, sv = np.linalg.lstsq(design, signal, rcond=None)
+        if rank < 2:
+            continue
+        sse = sse[0] if len(sse) else np.inf
+        if best is None or sse < best[0]:
+            best = (sse, (a, rates[i], c, rates[j]))
+    if best is None:
+        return (0.0, -1.0, float(np.mean(signal)), 0.0)
+    return best[1]
+
+
+def fit_bleaching(time, signal, coarse_points=FIT_COARSE_POINTS):
+    """Fits a double exponential photobleaching curve to a signal
+
+        Fits fit_exp to the signal starting from exp_initial_guess,
+        with time scaled to [0, 1] and the signal to its median. If
+        the signal is longer than coarse_points, the fit is first
+        run on block means of the data and then refined on all of
+        it.
+
+        Parameters
+        ----------
+        time: numpy array
+                time of each sample
+        signal: numpy array
+                fluorescence data
+        coarse_points: integer
+                number of points in the coarse fit, 0 or None to
+                fit the full data only
+                default = FIT_COARSE_POINTS
+
+        Returns:
+        --------
+        result: dictionary
+                params: (A, B, C, D) for time starting at 0
+                time: time starting at 0
+                fit: fitted bleaching curve
+                detrended: signal - fit
+    """
+    time = np.asarray(time, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    time = time - time[0]
+    if len(time) < 4:
+        # Too few points for 4 parameters, fit a constant
+        params = (0.0, 0.0, float(np.mean(signal)), 0.0)
+        fit = fit_exp(time, *params)
+        return {'params': params, 'time': time, 'fit': fit,
+                'detrended': signal - fit}
+    span = time[-1] if time[-1] > 0 else 1.0
+    scale = np.median(np.abs(signal))
+    if scale == 0:
+        scale = 1.0
+    t = time / span
+    y = signal / scale
+
+    # Block means of the data for the guess and the coarse fit
+    block = len(t) // coarse_points if coarse_points else 1
+    if block > 1:
+        n = len(t) // block * block
+        tCoarse = t[:n].reshape(-1, block).mean(axis=1)
+        yCoarse = y[:n].reshape(-1, block).mean(axis=1)
+    else:
+        tCoarse, yCoarse = t, y
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        p0 = exp_initial_guess(tCoarse, yCoarse)
+        if block > 1:
+            p0 = fit_exp_scaled(tCoarse, yCoarse, p0)
+        a, b, c, d = fit_exp_scaled(t, y, p0)
+
+    # Report the fast component first
+    if b > d:
+        a, b, c, d = c, d, a, b
+    params = (a * scale, b / span, c * scale, d / span)
+    fit = fit_exp(time, *params)
+    return {'params': params, 'time': time, 'fit': fit,
+            'detrended': signal - fit}
+
+
+def fit_exp_scaled(t, y, p0):
+    """Fits fit_exp to scaled data with its analytic jacobian
+
+        Parameters
+        ----------
+        t: numpy array
+                time, scaled to run from 0 to 1
+        y: numpy array
+                fluorescence data, scaled to about 1
+        p0: tuple of floats
+                first guesses for A, B, C and D
+
+        Returns:
+        --------
+        popt: tuple of floats
+                fitted A, B, C and D, or p0 if the fit failed
+    """
+    # Rates are in units of 1/recording length, bounding them
+    # keeps the exponentials from overflowing
+    bounds = ([-np.inf, -FIT_RATE_MAX, -np.inf, -FIT_RATE_MAX],
+              [np.inf, FIT_RATE_MAX, np.inf, FIT_RATE_MAX])
+    try:
+        popt, pcov = curve_fit(fit_exp, t, y, p0=p0, jac=fit_exp_jacobian,
+                               bounds=bounds, method='trf')
+    except (RuntimeError, ValueError):
+        return p0
+    if not np.isfinite(popt).all():
+        return p0
+    return popt
+
+
+def fit_bleaching_session(session, coarse_points=FIT_COARSE_POINTS):
+    """Fits photobleaching for every fiber and color of a session
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        coarse_points: integer
+                number of points in the coarse fit, see fit_bleaching
+
+        Returns:
+        --------
+        fits: dictionary
+                fit_bleaching result for each label from
+                isosbestic_pairs, fit to the signal channel
+    """
+    return {label: fit_bleaching(session[timeName], session[sigName],
+                                 coarse_points=coarse_points)
+            for label, isoName, sigName, timeName
+            in isosbestic_pairs(session)}
+
+
+def draw_fitted_exp(time, signal, fit, color, title):
+    """Draws a signal and its fitted exponent
+
+        Parameters
+        ----------
+        time: numpy array
+                time of each sample, starting at 0
+        signal: numpy array
+                fluorescence data
+        fit: numpy array
+                fitted bleaching curve
+        color: string
+                Green or Red
+        title: string
+                plot title
+
+        Returns:
+        --------
+        fig: matplotlib figure
+    """
+    fig = fpho_plot.new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Plot the data and the fit line
+    plot_envelope(ax, time, signal, color=color[0].lower())
+    plot_envelope(ax, time, fit, color='k')
+    # Remove top and right borders
+    fpho_plot.remove_borders(ax)
+    # Add axes labels and a title
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Fluorescence')
+    ax.set_title(title)
+    return fig
+
+
+def fitted_exp_figures(session, output_filename, fits=None):
+    """Describes the plots of each fiber and color fitted to an
+        exponential of the form y=A*exp(-B*X)+C*exp(-D*x)
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output file
+        fits: dictionary
+                time and fit for each label from
+                fit_bleaching_session
+                default = None, fit here
+
+        Returns:
+        --------
+        jobs: list of dictionaries
+                one fpho_plot.figure_job per fiber and color
+    """
+    if fits is None:
+        with fpho_profile.stage('fit'):
+            fits = fit_bleaching_session(session)
+
+    jobs = []
+    for label, isoName, sigName, timeName in isosbestic_pairs(session):
+        color = sigName[len(label):]
+        title = color + ' Fitted to Exponential'
+        if session.n_fibers > 1:
+            title = split_label(label)[0] + ' ' + title
+
+        # Save the plot in a png file, with time starting at 0
+        exp_plot_name = output_filename + '_' + label + 'NormExp.png'
+        jobs.append(fpho_plot.figure_job(
+            draw_fitted_exp, exp_plot_name, time=fits[label]['time'],
+            signal=np.asarray(session[sigName]), fit=fits[label]['fit'],
+            color=color, title=title))
+    return jobs
+
+
+def plot_fitted_exp(session, output_filename, workers=1):
+    """Creates a plot fitting each fiber and color to an
+        exponential of the form y=A*exp(-B*X)+C*exp(-D*x)
+
+        Parameters
+        ----------
+        session: Session
+                parsed fiberphotometry data
+        output_filename: string
+                name for output csv
+        workers: integer
+                number of processes drawing plots, see
+                fpho_plot.render_figures
+        Returns:
+        --------
+        output_filename_f1GreenNormExp.png
+        & output_filename_f1RedNormExp.png: png files
+                containing the fitted plot for each fluorophore,
+                and the same for f2 with 2 fiber data
+    """
+    fpho_plot.render_figures(fitted_exp_figures(session, output_filename),
+                             workers=workers)
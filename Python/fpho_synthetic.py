@@ -0,0 +1,484 @@
+"""Writes synthetic Bonsai, video timestamp and BORIS files
+    * led_levels - mean fluorescence of each column in each slot
+    * event_times - behavior events of a synthetic recording
+    * transient_trace - calcium transients at a block of times
+    * cycle_timer - encodes cycle offsets as a Bonsai frame counter
+    * signal_block - rows of a Bonsai file for a block of rows
+    * write_bonsai_signal - writes a Bonsai fiber photometry file
+    * video_frame_times - Bonsai time of a block of video frames
+    * write_video_timestamps - writes the Bonsai time of every frame
+    * write_BORIS_file - writes a raw BORIS export of the events
+    * write_recording - writes all files of one recording
+    * main - writes a recording from the command line
+
+    Files are written in blocks of rows, so recordings of many
+    hours take little memory. Run from the main directory:
+        python Python/fpho_synthetic.py --directory synthetic
+            --minutes 720 --n_fibers 2
+"""
+import argparse
+import os
+import sys
+import numpy as np
+import fpho_align
+import fpho_session
+import fpho_setup
+
+# Bonsai rows per second. The LEDs take turns, so each color is
+# sampled at a third of this rate
+ROW_RATE = 40.0
+
+# Cycle offsets the frame counter advances per row, see
+# fpho_setup.COUNTER_WRAP
+COUNTER_TICKS = (fpho_setup.COUNTER_CYCLES * fpho_setup.COUNTER_OFFSETS
+                 // int(ROW_RATE))
+
+# Rows generated and written at a time
+GENERATE_ROWS = 2**16
+
+# Mean fluorescence of the green and red column of a fiber in the
+# Iso, Red and Green rows, in the order of fpho_session.SLOTS. As in
+# the sample data, Iso rows are brightest in the green column, which
+# is how fpho_setup.interleave_slots finds them
+LED_LEVELS = [(1870.0, 1540.0), (1380.0, 1510.0), (1535.0, 1640.0)]
+
+# Photobleaching, as fraction of the level and time constant in
+# seconds of a fast and a slow exponential decay
+BLEACHING = (0.05, 120.0, 0.10, 3600.0)
+
+# Calcium transients: amplitude as fraction of the level, rise and
+# decay time in seconds and delay after the behavior event
+TRANSIENT = (0.05, 0.1, 1.0, 0.3)
+
+# Standard deviation of the noise on every value
+NOISE = 2.0
+
+# Behaviors scored in the BORIS file
+BEHAVIORS = ['Walking', 'Grooming', 'Rearing']
+
+# Columns of a raw BORIS export
+BORIS_COLUMNS = ['Time', 'Media file path', 'Total length', 'FPS',
+                 'Subject', 'Behavior', 'Behavioral category', 'Comment',
+                 'Status']
+
+
+def led_levels(n_fibers):
+    """Mean fluorescence of each column in each slot
+
+        Parameters
+        ----------
+        n_fibers: integer
+                number of fibers
+
+        Returns:
+        --------
+        levels: numpy array
+                shape (3, 2 * n_fibers), one row per slot in the
+                order of fpho_session.SLOTS and the green and red
+                column of each fiber. Fibers after the first are dimmer.
+    """
+    levels = np.array(LED_LEVELS)
+    return np.hstack([levels * 0.9**fiber for fiber in range(n_fibers)])
+
+
+def event_times(minutes, rate=2.0, seed=0):
+    """Behavior events of a synthetic recording
+
+        Parameters
+        ----------
+        minutes: number
+                length of the recording
+        rate: number
+                mean events per minute
+        seed: integer
+                seed of the random event times
+
+        Returns:
+        --------
+        events: numpy array
+                sorted event times in seconds from the start
+    """
+    rng = np.random.default_rng(seed)
+    n_events = rng.poisson(rate * minutes)
+    return np.sort(rng.uniform(0, minutes * 60, n_events))
+
+
+def transient_trace(time, events, transient=TRANSIENT):
+    """Calcium transients at a block of times
+
+        Parameters
+        ----------
+        time: numpy array
+                sorted times in seconds
+        events: numpy array
+                sorted behavior event times in seconds
+        transient: tuple of numbers
+                see TRANSIENT
+
+        Returns:
+        --------
+        trace: numpy array
+                sum of the transients of all events, as fraction of
+                the level. A single transient peaks at the
+                amplitude.
+    """
+    amplitude, rise, decay, delay = transient
+    onsets = events + delay
+    trace = np.zeros(len(time))
+    if len(time) == 0:
+        return trace
+
+    # Difference of exponentials, scaled to peak at 1
+    peak_time = np.log(decay / rise) * rise * decay / (decay - rise)
+    peak = np.exp(-peak_time / decay) - np.exp(-peak_time / rise)
+
+    # Only transients less than 10 decay times old reach the block
+    first, last = np.searchsorted(onsets, [time[0] - 10 * decay,
+                                           time[-1]])
+    for onset in onsets[first:last]:
+        start, stop = np.searchsorted(time, [onset, onset + 10 * decay])
+        dt = time[start:stop] - onset
+        trace[start:stop] += np.exp(-dt / decay) - np.exp(-dt / rise)
+    return trace * amplitude / peak
+
+
+def cycle_timer(ticks):
+    """Encodes cycle offsets as a Bonsai frame counter
+
+        Parameters
+        ----------
+        ticks: numpy array
+                integer time in cycle offsets
+
+        Returns:
+        --------
+        counter: numpy array
+                32 bit cycle timer values, see fpho_setup.counter_ticks
+    """
+    ticks = ticks % fpho_setup.COUNTER_WRAP
+    cycles = ticks // fpho_setup.COUNTER_OFFSETS
+    return (((cycles // fpho_setup.COUNTER_CYCLES) << 25)
+            | ((cycles % fpho_setup.COUNTER_CYCLES) << 12)
+            | (ticks % fpho_setup.COUNTER_OFFSETS))
+
+
+def signal_block(start, n_rows, n_fibers, phase, events, rng,
+                 start_msec=0.0):
+    """Rows of a Bonsai fiber photometry file
+
+        Parameters
+        ----------
+        start: integer
+                index of the first row
+        n_rows: integer
+                number of rows
+        n_fibers: integer
+                number of fibers
+        phase: integer
+                row of the first Iso frame, 0, 1 or 2
+        events: numpy array
+                behavior event times in seconds, see event_times
+        rng: numpy random generator
+                source of the noise
+        start_msec: number
+                Bonsai time of row 0 in msec of the day
+
+        Returns:
+        --------
+        rows: numpy array
+                shape (n_rows, 2 + 2 * n_fibers): Bonsai time in
+                msec, frame counter, then the green and red column
+                of each fiber
+    """
+    row = np.arange(start, start + n_rows)
+    seconds = row / ROW_RATE
+    rows = np.empty((n_rows, 2 + 2 * n_fibers))
+    # Bonsai stamps each frame with up to 1 msec of jitter
+    rows[:, 0] = (start_msec + seconds * 1000
+                  + rng.uniform(0, 1, n_rows))
+    rows[:, 1] = cycle_timer(row * COUNTER_TICKS
+                             + rng.integers(0, 1000, n_rows))
+
+    fast, fast_sec, slow, slow_sec = BLEACHING
+    bleaching = (1 + fast * np.exp(-seconds / fast_sec)
+                 + slow * np.exp(-seconds / slow_sec))
+    slot = (row - phase) % 3
+    levels = led_levels(n_fibers)[slot] * bleaching[:, None]
+
+    # Transients in the green column of Green rows and the red
+    # column of Red rows
+    transients = transient_trace(seconds, events)
+    green = slot == fpho_session.SLOTS.index('Green')
+    red = slot == fpho_session.SLOTS.index('Red')
+    levels[green, 0::2] *= 1 + transients[green, None]
+    levels[red, 1::2] *= 1 + transients[red, None]
+
+    rows[:, 2:] = levels + rng.normal(0, NOISE, levels.shape)
+    return rows
+
+
+def write_bonsai_signal(filename, minutes, n_fibers=1, phase=0,
+                        events=None, seed=0, start_msec=0.0,
+                        block_rows=GENERATE_ROWS, drop_rows=()):
+    """Writes a Bonsai fiber photometry file one block at a time
+
+        Parameters
+        ----------
+        filename: string
+                name of the csv, space delimited like Bonsai
+        minutes: number
+                length of the recording
+        n_fibers: integer
+                number of fibers, the green column of fiber k is
+                column 2k + 1
+        phase: integer
+                row of the first Iso frame, 0, 1 or 2
+        events: numpy array
+                behavior event times in seconds, default None for
+                no transients
+        seed: integer
+                seed of the noise
+        start_msec: number
+                Bonsai time of the first row in msec of the day
+        block_rows: integer
+                rows generated and written at a time
+        drop_rows: list of integers
+                rows left out of the file, as frames Bonsai dropped.
+                The LEDs and frame counter still advance over them.
+                default = ()
+
+        Returns:
+        --------
+        n_rows: integer
+                number of rows written
+    """
+    if phase not in (0, 1, 2):
+        print("Error: Interleave phase must be 0, 1 or 2")
+        sys.exit(1)
+    if events is None:
+        events = np.empty(0)
+    rng = np.random.default_rng(seed)
+    n_rows = int(minutes * 60 * ROW_RATE)
+    drop_rows = np.asarray(drop_rows, dtype=np.int64)
+    fmt = ' '.join(['%.4f', '%d'] + ['%.6f'] * (2 * n_fibers)) + ' '
+    with open(filename, 'w') as f:
+        for start in range(0, n_rows, block_rows):
+            rows = signal_block(start, min(block_rows, n_rows - start),
+                                n_fibers, phase, events, rng,
+                                start_msec=start_msec)
+            dropped = drop_rows[(drop_rows >= start)
+                                & (drop_rows < start + len(rows))]
+            np.savetxt(f, np.delete(rows, dropped - start, axis=0),
+                       fmt=fmt)
+    return n_rows - len(np.unique(drop_rows[drop_rows < n_rows]))
+
+
+def video_frame_times(start, n_frames, fps, start_msec, drift_ppm, rng):
+    """Bonsai time of a block of video frames
+
+        Parameters
+        ----------
+        start: integer
+                index of the first frame
+        n_frames: integer
+                number of frames
+        fps: number
+                frame rate of the video file
+        start_msec: number
+                Bonsai time of frame 0 in msec of the day
+        drift_ppm: number
+                how much slower the camera runs than fps, in parts
+                per million
+        rng: numpy random generator
+                source of the frame jitter
+
+        Returns:
+        --------
+        frame_times: numpy array
+                time of each frame in msec, with up to 2 msec of
+                jitter
+    """
+    frames = np.arange(start, start + n_frames)
+    return (start_msec + frames * (1000 / fps) * (1 + drift_ppm * 1e-6)
+            + rng.uniform(0, 2, n_frames))
+
+
+def write_video_timestamps(filename, minutes, fps=fpho_align.VIDEO_FPS,
+                           start_msec=0.0, drift_ppm=4300.0, seed=0,
+                           block_rows=GENERATE_ROWS):
+    """Writes the Bonsai time of every video frame one block at a time
+
+        Parameters
+        ----------
+        filename: string
+                name of the csv, one time per line
+        minutes: number
+                length of the video on the Bonsai clock
+        fps: number
+                frame rate of the video file
+        start_msec: number
+                Bonsai time of the first frame in msec of the day
+        drift_ppm: number
+                see video_frame_times
+        seed: integer
+                seed of the frame jitter
+        block_rows: integer
+                frames generated and written at a time
+
+        Returns:
+        --------
+        n_frames: integer
+                number of frames written
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = int(minutes * 60 * fps / (1 + drift_ppm * 1e-6))
+    with open(filename, 'w') as f:
+        for start in range(0, n_frames, block_rows):
+            np.savetxt(f, video_frame_times(start,
+                                            min(block_rows,
+                                                n_frames - start),
+                                            fps, start_msec, drift_ppm,
+                                            rng),
+                       fmt='%.4f')
+    return n_frames
+
+
+def write_BORIS_file(filename, video_seconds, observation,
+                     fps=fpho_align.VIDEO_FPS, video_length=None, seed=0):
+    """Writes a raw BORIS export of point events
+
+        Parameters
+        ----------
+        filename: string
+                name of the csv
+        video_seconds: numpy array
+                event times in seconds of video
+        observation: string
+                observation id, also used for the media file name
+        fps: number
+                frame rate of the video file
+        video_length: number
+                length of the video in seconds, default None for
+                the time of the last event
+        seed: integer
+                seed of the behavior of each event
+
+        Returns:
+        --------
+        behaviors: list of strings
+                the behavior of each event
+    """
+    rng = np.random.default_rng(seed)
+    behaviors = [BEHAVIORS[i] for i in
+                 rng.integers(0, len(BEHAVIORS), len(video_seconds))]
+    media = 'video' + observation + '.avi'
+    if video_length is None:
+        video_length = video_seconds[-1] if len(video_seconds) else 0.0
+    padding = ',' * (len(BORIS_COLUMNS) - 2)
+    preamble = ['Observation id,' + observation, 'Media file(s),',
+                'Player #1,' + media, 'Observation date,',
+                'Description,', 'Time offset (s),0.0',
+                'independent variables,', 'variable,value']
+    with open(filename, 'w') as f:
+        for line in preamble:
+            f.write(line + padding + '\n' + ',' * (len(BORIS_COLUMNS) - 1)
+                    + '\n')
+        f.write(','.join(BORIS_COLUMNS) + '\n')
+        for seconds, behavior in zip(video_seconds, behaviors):
+            f.write('{:.3f},{},{:.3f},{},,{},,,POINT\n'.format(
+                seconds, media, video_length, fps, behavior))
+    return behaviors
+
+
+def write_recording(directory, stamp, minutes, n_fibers=1, phase=0,
+                    event_rate=2.0, fps=fpho_align.VIDEO_FPS,
+                    drift_ppm=4300.0, seed=0, start_msec=55800000.0):
+    """Writes the signal, video timestamp and BORIS files of one
+        recording, named like fpho_batch expects
+
+        Parameters
+        ----------
+        directory: string
+                folder the files are written to
+        stamp: string
+                session stamp, e.g. 2020-10-12T15_30_41
+        minutes: number
+                length of the recording
+        n_fibers: integer
+                number of fibers
+        phase: integer
+                row of the first Iso frame, 0, 1 or 2
+        event_rate: number
+                mean behavior events per minute
+        fps, drift_ppm: numbers
+                see video_frame_times
+        seed: integer
+                seed of all random values
+        start_msec: number
+                Bonsai time of the start in msec of the day
+
+        Returns:
+        --------
+        recording: dictionary
+                input_filename, timestamp_file and BORIS_file, the
+                event times in msec of the day and n_fibers,
+                f1greencol, f2greencol and column_map for
+                import_fpho_data
+    """
+    os.makedirs(directory, exist_ok=True)
+    events = event_times(minutes, rate=event_rate, seed=seed)
+    recording = {
+        'input_filename': os.path.join(directory,
+                                       'FiberPhoSig' + stamp + '.csv'),
+        'timestamp_file': os.path.join(directory, 'video time stamp_'
+                                       + stamp + '.csv'),
+        'BORIS_file': os.path.join(directory, stamp + '_BORIS.csv'),
+        'event_msec': start_msec + events * 1000,
+        'n_fibers': n_fibers, 'f1greencol': 3,
+        'f2greencol': 5 if n_fibers > 1 else None,
+        'column_map': {'f' + str(fiber) + color: 2 * fiber + 1 + i
+                       for fiber in range(1, n_fibers + 1)
+                       for i, color in enumerate(fpho_session.COLORS)}}
+
+    write_bonsai_signal(recording['input_filename'], minutes,
+                        n_fibers=n_fibers, phase=phase, events=events,
+                        seed=seed, start_msec=start_msec)
+    write_video_timestamps(recording['timestamp_file'], minutes, fps=fps,
+                           start_msec=start_msec, drift_ppm=drift_ppm,
+                           seed=seed + 1)
+    # BORIS counts video seconds at fps, the camera runs slower
+    write_BORIS_file(recording['BORIS_file'],
+                     events / (1 + drift_ppm * 1e-6), stamp, fps=fps,
+                     video_length=minutes * 60 / (1 + drift_ppm * 1e-6),
+                     seed=seed + 2)
+    return recording
+
+
+def main():
+    """Writes a synthetic recording from the command line
+
+    Returns
+    -------
+        Writes FiberPhoSig<stamp>.csv, video time stamp_<stamp>.csv
+        and <stamp>_BORIS.csv to the chosen directory
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--directory', type=str, required=True)
+    parser.add_argument('--stamp', type=str, default='2020-10-12T15_30_41')
+    parser.add_argument('--minutes', type=float, default=60.0)
+    parser.add_argument('--n_fibers', type=int, default=1)
+    parser.add_argument('--phase', type=int, default=0)
+    parser.add_argument('--event_rate', type=float, default=2.0,
+                        help='behavior events per minute')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    recording = write_recording(args.directory, args.stamp, args.minutes,
+                                n_fibers=args.n_fibers, phase=args.phase,
+                                event_rate=args.event_rate, seed=args.seed)
+    for name in ['input_filename', 'timestamp_file', 'BORIS_file']:
+        print('Written ' + recording[name])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Performs unit tests on the functions in behavior_setup.py
+
+    These functions are:
+        find_BORIS_header(), read_BORIS_file(),
+        import_behavior_data(), split_behavior_data(),
+        nearest_index(), peri_event_zscore() and plot_zscore().
+
+"""
+import behavior_setup
+import fpho_setup
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+
+class TestBehaviorSetup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.timestamp_file = 'Python/SampleData/1fiberTimestamp.csv'
+
+        # Two raw BORIS exports in one file, with two subjects
+        with open('Python/SampleData/2fiberBORIS.csv', 'r') as f:
+            lines = f.readlines()
+        second = [line.replace('2020-04-09T16_04_47', 'second')
+                  .replace(',,Walking,', ',vole2,Walking,')
+                  for line in lines]
+        self.multi_file = os.path.join(self.tmp, 'multiBORIS.csv')
+        with open(self.multi_file, 'w') as f:
+            f.writelines(lines + second)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that the header is found in both BORIS formats
+    def test_find_BORIS_header(self):
+        with open('Python/SampleData/2fiberBORIS.csv', 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(behavior_setup.find_BORIS_header(lines),
+                         [(15, 91, '2020-04-09T16_04_47')])
+        with open('Python/SampleData/1FiberBORIS.csv', 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(behavior_setup.find_BORIS_header(lines),
+                         [(0, 14, None)])
+
+    # Testing the pre-formatted file and the time conversion
+    def test_import_behavior_data(self):
+        behaviorData = behavior_setup.import_behavior_data(
+            'Python/SampleData/1FiberBORIS.csv', self.timestamp_file)
+        self.assertEqual(list(behaviorData.columns),
+                         behavior_setup.BEHAVIOR_COLUMNS)
+        self.assertEqual(len(behaviorData), 13)
+        self.assertEqual(behaviorData['Time'][0], 518.233)
+        # 518.233 sec is between frames 15546 and 15547 at 30 fps
+        frame_times = np.loadtxt(self.timestamp_file)
+        self.assertAlmostEqual(behaviorData['Time (total msec)'][0],
+                               frame_times[15546] + 0.99
+                               * (frame_times[15547] - frame_times[15546]))
+        self.assertEqual(set(behaviorData['Behavior']), {'Clap'})
+
+    # Testing that every observation of an export is read and split
+    def test_split_behavior_data(self):
+        behaviorData = behavior_setup.import_behavior_data(
+            self.multi_file, self.timestamp_file)
+        self.assertEqual(len(behaviorData), 150)
+        events = behavior_setup.split_behavior_data(behaviorData)
+        self.assertEqual(set(events),
+                         {('2020-04-09T16_04_47', None),
+                          ('second', None), ('second', 'vole2')})
+        self.assertEqual(len(events[('second', 'vole2')]), 30)
+        self.assertEqual(set(events[('second', 'vole2')]['Behavior']),
+                         {'Walking'})
+        self.assertTrue((np.diff(events[('second', None)]['Time']) >= 0)
+                        .all())
+
+    # Testing that nearest_index() matches the closest time
+    def test_nearest_index(self):
+        times = np.array([0.0, 10.0, 20.0, 30.0])
+        values = np.array([-5, 4, 5, 6, 29, 100])
+        self.assertEqual(behavior_setup.nearest_index(times, values)
+                         .tolist(),
+                         [int(np.argmin(abs(times - value)))
+                          for value in values])
+
+    # Testing peri_event_zscore() against a loop over the events
+    def test_peri_event_zscore(self):
+        rng = np.random.default_rng(0)
+        signal_time = 1000.0 + np.arange(4000) * 20 + rng.uniform(0, 2, 4000)
+        signal = rng.normal(size=4000)
+        events = np.array([500.0, 5000.0, 30000.0, 79000.0, 90000.0])
+        result = behavior_setup.peri_event_zscore(signal, signal_time,
+                                                  events)
+        self.assertEqual(result['kept'].tolist(),
+                         [False, True, True, False, False])
+        self.assertEqual(result['zscore'].shape, (2, 401))
+        self.assertAlmostEqual(result['time'][0], -3, places=2)
+
+        std = np.std(signal, ddof=1)
+        for row, event in zip(result['zscore'], events[result['kept']]):
+            index = np.argmin(abs(signal_time - event))
+            start = np.argmin(abs(signal_time - (event - 3000)))
+            stop = np.argmin(abs(signal_time - (event - 2000)))
+            expected = ((signal[index - 150:index + 251]
+                         - signal[start:stop + 1].mean()) / std)
+            self.assertTrue(np.allclose(row, expected))
+        self.assertTrue(np.allclose(result['mean'],
+                                    result['zscore'].mean(axis=0)))
+        self.assertTrue(np.allclose(result['sem'],
+                                    result['zscore'].std(axis=0, ddof=1)
+                                    / np.sqrt(2)))
+
+    # Testing that a recording shorter than the window keeps no events
+    def test_peri_event_zscore_short(self):
+        signal_time = 1000.0 + np.arange(100) * 20
+        signal = np.sin(np.arange(100))
+        result = behavior_setup.peri_event_zscore(signal, signal_time,
+                                                  np.array([2000.0]))
+        self.assertEqual(result['kept'].tolist(), [False])
+        self.assertEqual(result['zscore'].shape, (0, 401))
+        self.assertEqual(len(result['mean']), 401)
+
+    # Checking that plot_zscore() creates a plot for each behavior
+    def test_plot_zscore(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/1fiberSignal.csv',
+            output_filename=os.path.join(self.tmp, 'zscore'), n_fibers=1,
+            f1greencol=3, animal_ID='vole1', exp_date='2020-09-01',
+            exp_desc='testing')
+        behaviorData = behavior_setup.import_behavior_data(
+            'Python/SampleData/1FiberBORIS.csv', self.timestamp_file)
+        output_filename = os.path.join(self.tmp, 'zscore')
+        results = behavior_setup.plot_zscore(session, behaviorData,
+                                             output_filename)
+        self.assertEqual(list(results), [('f1GreenGreen', 'Clap')])
+        self.assertEqual(len(results[('f1GreenGreen', 'Clap')]['zscore']),
+                         13)
+        self.assertTrue(os.path.exists(output_filename
+                                       + '_f1GreenGreen_Clap_zscore.png'))
+
+        with self.assertRaises(SystemExit) as cm:
+            behavior_setup.plot_zscore(session, behaviorData,
+                                       output_filename, channels=['f2Red'])
+        self.assertEqual(cm.exception.code, 1)
+
+    # Testing the error handling of read_BORIS_file()
+    def test_read_BORIS_file_errors(self):
+        with self.assertRaises(SystemExit) as cm:
+            behavior_setup.read_BORIS_file(
+                os.path.join(self.tmp, 'missing.csv'))
+        self.assertEqual(cm.exception.code, 1)
+        with self.assertRaises(SystemExit) as cm:
+            behavior_setup.read_BORIS_file(self.timestamp_file)
+        self.assertEqual(cm.exception.code, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Performs unit tests on the functions in fpho_align.py
+
+    These functions are:
+        read_video_timestamps(), video_fps(), estimate_drift()
+        and video_to_bonsai().
+
+"""
+import fpho_align
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import pandas as pd
+
+
+class TestFphoAlign(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # Frames 1% slower than 30 fps, with jitter
+        rng = np.random.default_rng(0)
+        self.frame_times = (5e7 + np.arange(3000) * 1000 / 30 * 1.01
+                            + rng.uniform(-5, 5, 3000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that every frame is read and a partial last line dropped
+    def test_read_video_timestamps(self):
+        frame_times = fpho_align.read_video_timestamps(
+            'Python/SampleData/2fiberTimestamp.csv')
+        self.assertEqual(len(frame_times), 7785)
+        self.assertEqual(frame_times[0], 57887084.6208)
+
+        timestamp_file = os.path.join(self.tmp, 'timestamps.csv')
+        with open(timestamp_file, 'w') as f:
+            f.write('55841506.368 \r\n55841528.4224 \r\n'
+                    '55841560.256 \r\n5584')
+        self.assertEqual(fpho_align.read_video_timestamps(
+            timestamp_file).tolist(),
+            [55841506.368, 55841528.4224, 55841560.256])
+
+        with self.assertRaises(SystemExit) as cm:
+            fpho_align.read_video_timestamps(os.path.join(self.tmp,
+                                                          'missing.csv'))
+        self.assertEqual(cm.exception.code, 1)
+
+    # Testing the frame rate from a BORIS export and the default
+    def test_video_fps(self):
+        BORISData = pd.DataFrame({'Time': [1.0], 'FPS': [25.0]})
+        self.assertEqual(fpho_align.video_fps(BORISData), 25.0)
+        self.assertEqual(fpho_align.video_fps(), fpho_align.VIDEO_FPS)
+
+    # Testing that the drift of the frame clock is found
+    def test_estimate_drift(self):
+        drift = fpho_align.estimate_drift(self.frame_times, 30)
+        self.assertAlmostEqual(drift['drift_ppm'], 1e4, delta=10)
+        self.assertAlmostEqual(drift['offset'], 5e7, delta=1)
+        self.assertLess(drift['jitter_msec'], 5)
+
+    # Testing that video seconds land on the right frame times
+    def test_video_to_bonsai(self):
+        seconds = np.array([0, 10, 10 + 1 / 60, -1, 200])
+        msec = fpho_align.video_to_bonsai(seconds, self.frame_times, 30)
+        self.assertEqual(msec[0], self.frame_times[0])
+        self.assertEqual(msec[1], self.frame_times[300])
+        self.assertAlmostEqual(msec[2], (self.frame_times[300]
+                                         + self.frame_times[301]) / 2)
+        # Outside the frames, the clock runs 1% slower than video
+        self.assertAlmostEqual(msec[3], self.frame_times[0] - 1010,
+                               delta=1)
+        self.assertAlmostEqual(msec[4] - self.frame_times[-1],
+                               (200 - 2999 / 30) * 1010, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Performs unit tests on the functions in fpho_batch.py
+
+    These functions are:
+        find_sessions(), session_config(), run_session()
+        and run_batch().
+
+"""
+import fpho_batch
+import unittest
+import tempfile
+import shutil
+import os
+import yaml
+
+
+class TestFphoBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for stamp in ['2020-10-12T15_30_41', '2020-10-12T16_57_46']:
+            shutil.copy('Python/SampleData/1fiberSignal.csv',
+                        os.path.join(self.tmp, 'FiberPhoSig' + stamp
+                                     + '.csv'))
+        shutil.copy('Python/SampleData/1fiberTimestamp.csv',
+                    os.path.join(self.tmp, 'video time stamp_'
+                                 '2020-10-12T15_30_41.csv'))
+        with open('Python/config.yml', 'r') as f:
+            self.config = yaml.load(f, Loader=yaml.FullLoader)
+        self.config.update({'batch_dir': self.tmp,
+                            'output_filename': os.path.join(self.tmp,
+                                                            'batch'),
+                            'plot_iso_fit': True,
+                            'use_cache': False})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that signal files are paired by their session stamp
+    def test_find_sessions(self):
+        sessions = fpho_batch.find_sessions(self.tmp)
+        self.assertEqual([s['session'] for s in sessions],
+                         ['2020-10-12T15_30_41', '2020-10-12T16_57_46'])
+        self.assertEqual(os.path.basename(sessions[0]['timestamp_file']),
+                         'video time stamp_2020-10-12T15_30_41.csv')
+        self.assertIsNone(sessions[1]['timestamp_file'])
+        self.assertIsNone(sessions[0]['BORIS_file'])
+
+    # Testing the error handling of file name patterns
+    def test_find_sessions_errors(self):
+        with self.assertRaises(SystemExit) as cm:
+            fpho_batch.find_sessions(self.tmp, signal_pattern='*Sig*.csv')
+        self.assertEqual(cm.exception.code, 1)
+        with self.assertRaises(SystemExit) as cm:
+            fpho_batch.find_sessions(os.path.join(self.tmp, 'missing'))
+        self.assertEqual(cm.exception.code, 1)
+
+    # Testing that each session gets its own outputs and date
+    def test_session_config(self):
+        session = fpho_batch.find_sessions(self.tmp)[0]
+        config = fpho_batch.session_config(self.config, session)
+        self.assertEqual(config['output_filename'],
+                         os.path.join(self.tmp, 'batch_2020-10-12T15_30_41'))
+        self.assertEqual(config['exp_date'], '2020-10-12')
+        self.assertEqual(config['input_filename'], session['input_filename'])
+        self.assertNotEqual(self.config['output_filename'],
+                            config['output_filename'])
+
+    # Testing that a failing session is reported, not raised
+    def test_run_session_failure(self):
+        session = fpho_batch.find_sessions(self.tmp)[0]
+        config = fpho_batch.session_config(self.config, session)
+        config['n_fibers'] = 3
+        row = fpho_batch.run_session(config)
+        self.assertEqual(row['status'], 'failed')
+        self.assertIn('fibers', row['message'])
+
+    # Testing that every session is run and summarized
+    def test_run_batch(self):
+        summary = fpho_batch.run_batch(self.config, workers=1)
+        self.assertEqual(list(summary['status']), ['ok', 'ok'])
+        self.assertEqual(list(summary.columns),
+                         fpho_batch.BATCH_SUMMARY_COLUMNS)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp, 'batch_BatchSummary.csv')))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp, 'batch_2020-10-12T16_57_46_f1GreenNormIso.png')))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp, 'batch_2020-10-12T15_30_41_RawSignal_f1Red.png')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Performs unit tests on the functions in fpho_benchmark.py
+
+    These functions are:
+        scale_recording() and compare_baseline().
+
+"""
+import fpho_benchmark
+import fpho_setup
+import behavior_setup
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import pandas as pd
+
+
+class TestFphoBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that a scaled recording continues in time
+    def test_scale_recording(self):
+        dataset = fpho_benchmark.SUITE_DATASETS[0]
+        scaled = fpho_benchmark.scale_recording(dataset, 3, self.tmp)
+        self.assertEqual(scaled['dataset'], 'sample_1fiber_x3')
+
+        data = fpho_setup.read_fpho_columns(dataset['input_filename'])
+        scaled_data = fpho_setup.read_fpho_columns(scaled['input_filename'])
+        # The first two lines of a Bonsai file are not data rows
+        self.assertEqual(len(scaled_data), 3 * len(data) - 2)
+        self.assertTrue((np.diff(scaled_data[:, 0]) > 0).all())
+        self.assertTrue(np.allclose(scaled_data[-len(data):, 2:],
+                                    data[:, 2:]))
+
+        behaviorData = behavior_setup.import_behavior_data(
+            scaled['BORIS_file'], scaled['timestamp_file'])
+        self.assertEqual(len(behaviorData), 3 * 13)
+        self.assertTrue((np.diff(behaviorData['Time (total msec)']) > 0)
+                        .all())
+
+    # Testing that only large slowdowns are regressions
+    def test_compare_baseline(self):
+        baseline = pd.DataFrame({'dataset': ['a', 'a', 'a'],
+                                 'stage': ['import', 'plot', 'fit'],
+                                 'samples': [10, 10, 10],
+                                 'seconds': [1.0, 0.01, 1.0]})
+        results = baseline.copy()
+        results['seconds'] = [3.0, 0.05, 1.2]
+        results.loc[3] = ['a', 'new', 10, 5.0]
+        compared = fpho_benchmark.compare_baseline(results, baseline)
+        self.assertEqual(list(compared['regression']),
+                         [True, False, False, False])
+        self.assertAlmostEqual(compared['ratio'][0], 3.0)
+        self.assertTrue(np.isnan(compared['baseline_seconds'][3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""Performs unit tests on the functions in fpho_cache.py
+
+    These functions are:
+        cache_key(), stage_key(), cached_stage(), save_cached(),
+        load_cached(), evict_cache(), clear_cache() and the stage
+        graph of fpho_config.run_stages.
+
+"""
+import fpho_cache
+import fpho_config
+import fpho_setup
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import yaml
+
+
+class TestFphoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, fpho_cache.CACHE_DIRNAME)
+        self.input_filename = os.path.join(self.tmp, '1FiberTesting.csv')
+        shutil.copy('Python/TestData/1FiberTesting.csv', self.input_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that the key changes with file contents and settings
+    def test_cache_key(self):
+        settings = {'n_fibers': 1, 'f1greencol': 3, 'f2greencol': None}
+        key = fpho_cache.cache_key(self.input_filename, settings,
+                                   cache_dir=self.cache_dir)
+        self.assertEqual(key, fpho_cache.cache_key(self.input_filename,
+                                                   settings))
+
+        settings['f1greencol'] = 4
+        self.assertNotEqual(key, fpho_cache.cache_key(self.input_filename,
+                                                      settings))
+
+        settings['f1greencol'] = 3
+        with open(self.input_filename, 'a') as f:
+            f.write('62316574.0 0 1.0 1.0\n')
+        self.assertNotEqual(key, fpho_cache.cache_key(
+                                     self.input_filename, settings,
+                                     cache_dir=self.cache_dir))
+
+    # Testing that a stage key changes with settings, inputs and files
+    def test_stage_key(self):
+        key = fpho_cache.stage_key('fit', {'window': 1}, inputs=['a'],
+                                   files=[self.input_filename])
+        self.assertEqual(key, fpho_cache.stage_key(
+            'fit', {'window': 1}, inputs=['a'], files=[self.input_filename]))
+        for changed in [('zscore', {'window': 1}, ['a']),
+                        ('fit', {'window': 2}, ['a']),
+                        ('fit', {'window': 1}, ['b'])]:
+            self.assertNotEqual(key, fpho_cache.stage_key(
+                *changed, files=[self.input_filename]))
+        with open(self.input_filename, 'a') as f:
+            f.write('62316574.0 0 1.0 1.0\n')
+        self.assertNotEqual(key, fpho_cache.stage_key(
+            'fit', {'window': 1}, inputs=['a'], files=[self.input_filename]))
+
+    # Testing that a stage runs once, and again when its output is gone
+    def test_cached_stage(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'x': np.arange(3.0)}
+
+        output = os.path.join(self.tmp, 'out.png')
+        open(output, 'w').close()
+        for cached in [False, True]:
+            arrays, hit = fpho_cache.cached_stage(self.cache_dir, 'k',
+                                                  compute, outputs=[output])
+            self.assertEqual(hit, cached)
+            self.assertTrue((arrays['x'] == np.arange(3.0)).all())
+        self.assertEqual(len(calls), 1)
+
+        os.remove(output)
+        arrays, hit = fpho_cache.cached_stage(self.cache_dir, 'k', compute,
+                                              outputs=[output])
+        self.assertFalse(hit)
+        arrays, hit = fpho_cache.cached_stage(None, 'k', compute)
+        self.assertFalse(hit)
+        self.assertEqual(len(calls), 3)
+
+    # Testing that a config change reruns only the stages it affects
+    def test_run_stages(self):
+        with open('Python/config.yml', 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+        output_filename = os.path.join(self.tmp, 'my_file_name')
+        config.update({'input_filename': self.input_filename,
+                       'output_filename': output_filename,
+                       'n_fibers': 1, 'f1greencol': 3, 'use_cache': True,
+                       'plot_raw_signal': False, 'plot_iso_fit': True,
+                       'plot_fit_exp': True, 'plot_workers': 1})
+        cold = fpho_config.run_config(config)
+        # The parsed session is cached once, as the import stage
+        entries = [name for name in os.listdir(self.cache_dir)
+                   if os.path.exists(os.path.join(self.cache_dir, name,
+                                                  'drops.npy'))]
+        self.assertEqual(entries, [])
+        figure = output_filename + '_f1GreenNormIso.png'
+        os.utime(figure, (0, 0))
+
+        # Nothing changed, so nothing is run or drawn again
+        warm = fpho_config.run_config(config)
+        self.assertTrue((cold.signals == warm.signals).all())
+        self.assertIsInstance(warm.signals, np.memmap)
+        self.assertEqual(os.path.getmtime(figure), 0)
+
+        # A new fit window redraws the normalized plots only
+        fit = output_filename + '_f1GreenNormExp.png'
+        os.utime(fit, (0, 0))
+        config['iso_fit_window_sec'] = 5
+        fpho_config.run_config(config)
+        self.assertGreater(os.path.getmtime(figure), 0)
+        self.assertEqual(os.path.getmtime(fit), 0)
+
+    # Testing that saved arrays load back memory-mapped
+    def test_save_load_cached(self):
+        self.assertIsNone(fpho_cache.load_cached(self.cache_dir, 'abc'))
+        arrays = {'b': np.arange(5.0), 'a': np.ones(3)}
+        fpho_cache.save_cached(self.cache_dir, 'abc', arrays)
+        loaded = fpho_cache.load_cached(self.cache_dir, 'abc')
+        self.assertEqual(list(loaded), ['b', 'a'])
+        self.assertTrue((loaded['b'] == arrays['b']).all())
+        self.assertIsInstance(loaded['a'], np.memmap)
+
+    # Testing that the least recently used entries are evicted
+    def test_evict_cache(self):
+        for key in ['old', 'new']:
+            fpho_cache.save_cached(self.cache_dir, key,
+                                   {'x': np.zeros(2**17)})
+        os.utime(os.path.join(self.cache_dir, 'old'), (0, 0))
+        fpho_cache.evict_cache(self.cache_dir, max_mb=1.5)
+        self.assertIsNone(fpho_cache.load_cached(self.cache_dir, 'old'))
+        self.assertIsNotNone(fpho_cache.load_cached(self.cache_dir, 'new'))
+
+        fpho_cache.clear_cache(self.cache_dir)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    # Testing that a warm import gives the same session
+    def test_import_fpho_data_cached(self):
+        output_filename = os.path.join(self.tmp, 'my_file_name')
+        kwargs = dict(input_filename=self.input_filename,
+                      output_filename=output_filename,
+                      n_fibers=1, f1greencol=3, animal_ID='vole1',
+                      exp_date='2020-09-01', exp_desc='testing',
+                      use_cache=True)
+        cold = fpho_setup.import_fpho_data(**kwargs)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        warm = fpho_setup.import_fpho_data(**kwargs)
+        self.assertTrue((cold.signals == warm.signals).all())
+        self.assertTrue((cold.times == warm.times).all())
+        self.assertEqual(cold.names, warm.names)
+        self.assertIsInstance(warm.signals, np.memmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,9 +28,17 @@ run test_fpho_setup_badinput2 python Python/fpho_ftest_driver.py --input_filenam
 assert_exit_code 1
 
 # Test that exit code = 0 for raw signal
-run test_plotrawsig_success python Python/fpho_ftest_driver.py --input_filename Python/SampleData/1fiberSignal.csv --output_filename testing --n_fibers 1 --f1greencol 3 --animal_ID 1 --exp_date 2020-10-10 --exp_desc 'testing the driver' --plot_raw_signal
+run test_plotrawsig_success python Python/fpho_ftest_driver.py --input_filename Python/SampleData/1fiberSignal.csv --output_filename testing --n_fibers 1 --f1greencol 3 --animal_ID 1 --exp_date 2020-10-10 --exp_desc 'testing the driver' --plot_raw_signal --raw_channels f1Red
 assert_exit_code 0
 
+# Test that every channel is plotted in one run
+run test_plotrawsig_all python Python/fpho_ftest_driver.py --input_filename Python/SampleData/2fiberSignal.csv --output_filename testing --n_fibers 2 --f1greencol 3 --f2greencol 5 --animal_ID 1 --exp_date 2020-10-10 --exp_desc 'testing the driver' --plot_raw_signal --raw_channels all
+assert_exit_code 0
+
+# Test that an unknown raw signal channel exits with code 1
+run test_plotrawsig_badchannel python Python/fpho_ftest_driver.py --input_filename Python/SampleData/1fiberSignal.csv --output_filename testing --n_fibers 1 --f1greencol 3 --animal_ID 1 --exp_date 2020-10-10 --exp_desc 'testing the driver' --plot_raw_signal --raw_channels f2Red
+assert_exit_code 1
+
 # Test that exit code = 0 for iso
 run test_plotiso_success python Python/fpho_ftest_driver.py --input_filename Python/SampleData/1fiberSignal.csv --output_filename testing --n_fibers 1 --f1greencol 3 --animal_ID 1 --exp_date 2020-10-10 --exp_desc 'testing the driver' --plot_iso_fit
 assert_exit_code 0
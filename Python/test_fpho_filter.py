@@ -0,0 +1,111 @@
+"""Performs unit tests on the functions in fpho_filter.py
+
+    These functions are:
+        sample_rate(), filter_overlap(), design_filter(),
+        apply_filter(), filter_blocks() and filter_session().
+
+"""
+import fpho_filter
+import fpho_session
+import fpho_setup
+import unittest
+import numpy as np
+import scipy.ndimage
+import scipy.signal
+
+
+class TestFphoFilter(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_samples = 5000
+        times = np.tile(np.arange(n_samples) * 75.0, (3, 1))
+        signals = (np.cumsum(rng.normal(0, 1, (12, n_samples)), axis=1)
+                   + rng.normal(0, 5, (12, n_samples)))
+        self.session = fpho_session.Session(
+            signals, times, fpho_session.signal_names(2), animalID='vole1')
+
+    # Testing the filters against scipy on the whole recording
+    def test_design_filter(self):
+        rate = fpho_filter.sample_rate(self.session)
+        self.assertAlmostEqual(rate, 1000 / 75)
+        spec = fpho_filter.design_filter('bandpass', rate,
+                                         cutoff=[0.05, 2])
+        sos = scipy.signal.butter(fpho_filter.FILTER_ORDER, [0.05, 2],
+                                  btype='bandpass', fs=rate, output='sos')
+        self.assertTrue(np.allclose(spec['sos'], sos))
+        self.assertTrue(np.allclose(
+            fpho_filter.apply_filter(spec, self.session.signals),
+            scipy.signal.sosfiltfilt(sos, self.session.signals, axis=1)))
+
+        # The slowest transient has decayed by the end of the overlap
+        impulse = np.zeros(spec['overlap'] + 1)
+        impulse[0] = 1
+        response = scipy.signal.sosfilt(sos, impulse)
+        self.assertLess(np.abs(response[-20:]).max(),
+                        1e3 * fpho_filter.FILTER_SETTLE)
+
+        spec = fpho_filter.design_filter('median', rate, window_sec=0.5)
+        self.assertEqual(spec['size'], 7)
+        self.assertTrue(np.array_equal(
+            fpho_filter.apply_filter(spec, self.session.signals),
+            scipy.ndimage.median_filter(self.session.signals, size=(1, 7),
+                                        mode='nearest')))
+
+    # Testing that filtering in chunks matches filtering all at once
+    def test_filter_session(self):
+        rate = fpho_filter.sample_rate(self.session)
+        for kind, cutoff in [('lowpass', 1), ('bandpass', [0.05, 2]),
+                             ('median', None)]:
+            spec = fpho_filter.design_filter(kind, rate, cutoff=cutoff,
+                                             window_sec=1)
+            whole = fpho_filter.apply_filter(spec, self.session.signals)
+            for chunk in [1, 333, 10**6]:
+                filtered = fpho_filter.filter_session(
+                    self.session, kind, cutoff=cutoff, window_sec=1,
+                    chunk=chunk)
+                self.assertEqual(filtered.animalID, 'vole1')
+                self.assertTrue(np.array_equal(filtered.times,
+                                               self.session.times))
+                self.assertTrue(np.allclose(filtered.signals, whole,
+                                            rtol=0, atol=1e-6))
+
+    # Testing that streamed blocks filter the same as an import
+    def test_filter_blocks(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=2, f1greencol=3,
+            f2greencol=5, animal_ID='vole1', exp_date='2020-09-01',
+            exp_desc='testing')
+        filtered = fpho_filter.filter_session(session, 'lowpass',
+                                              cutoff=0.5)
+        spec = fpho_filter.design_filter(
+            'lowpass', fpho_filter.sample_rate(session), cutoff=0.5)
+        blocks = list(fpho_filter.filter_blocks(
+            fpho_setup.stream_fpho_data('Python/SampleData/2fiberSignal.csv',
+                                        2, 3, f2greencol=5,
+                                        block_frames=100),
+            spec, chunk=500))
+        self.assertEqual([len(block) for block in blocks[:-1]],
+                         [500] * (len(blocks) - 1))
+        streamed = fpho_session.Session.concatenate(blocks)
+        self.assertTrue(np.array_equal(streamed.times, session.times))
+        self.assertTrue(np.allclose(streamed.signals, filtered.signals,
+                                    rtol=0, atol=1e-6))
+
+    # Testing that bad settings exit with an error
+    def test_design_filter_errors(self):
+        for kind, cutoff, window_sec in [('highpass', 1, None),
+                                         ('lowpass', None, None),
+                                         ('lowpass', 7, None),
+                                         ('bandpass', [2, 0.05], None),
+                                         ('bandpass', 1, None),
+                                         ('median', None, 'long')]:
+            with self.assertRaises(SystemExit) as cm:
+                fpho_filter.design_filter(kind, 13.3, cutoff=cutoff,
+                                          window_sec=window_sec)
+            self.assertEqual(cm.exception.code, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Performs unit tests on the functions in fpho_live.py
+
+    These functions are:
+        read_new_lines(), RunningFit and run_live().
+
+"""
+import fpho_live
+import fpho_setup
+import fpho_synthetic
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+import os
+import yaml
+import numpy as np
+import pandas as pd
+
+
+class TestFphoLive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that partial lines wait for the rest of the line
+    def test_read_new_lines(self):
+        filename = os.path.join(self.tmp, 'growing.csv')
+        with open(filename, 'w') as writer, open(filename, 'r') as reader:
+            writer.write('1,2\n3 4\n5,')
+            writer.flush()
+            lines, pending = fpho_live.read_new_lines(reader)
+            self.assertEqual(lines, ['1 2', '3 4'])
+            self.assertEqual(pending, '5,')
+
+            writer.write('6\n')
+            writer.flush()
+            lines, pending = fpho_live.read_new_lines(reader, pending)
+            self.assertEqual(lines, ['5 6'])
+            self.assertEqual(pending, '')
+
+    # Testing that the running fit matches the fit of all samples
+    def test_running_fit(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            output_filename=os.path.join(self.tmp, 'my_file_name'),
+            n_fibers=2, f1greencol=3, f2greencol=5, animal_ID='vole1',
+            exp_date='2020-09-01', exp_desc='testing')
+        normData, coefficients = fpho_setup.isosbestic_norm(session)
+        pairs = fpho_setup.isosbestic_pairs(session)
+        iso = session.signals[[session.rows[pair[1]] for pair in pairs]]
+        sig = session.signals[[session.rows[pair[2]] for pair in pairs]]
+
+        fit = fpho_live.RunningFit()
+        for start in range(0, len(session), 97):
+            fit.update(iso[:, start:start + 97], sig[:, start:start + 97])
+        a, b = fit.coefficients()
+        for i, pair in enumerate(pairs):
+            self.assertAlmostEqual(a[i], coefficients[pair[0]][0],
+                                   places=9)
+            self.assertAlmostEqual(b[i], coefficients[pair[0]][1],
+                                   places=6)
+
+    # Testing live mode on a file written while it is followed
+    def test_run_live(self):
+        recorded = os.path.join(self.tmp, 'recorded.csv')
+        fpho_synthetic.write_bonsai_signal(recorded, 2, n_fibers=2,
+                                           phase=2, drop_rows=[2000])
+        with open(recorded, 'r') as f:
+            text = f.read()
+
+        # Bonsai writes in bursts that may end inside a line
+        growing = os.path.join(self.tmp, 'growing.csv')
+
+        def write_growing():
+            with open(growing, 'w') as f:
+                for start in range(0, len(text), 4001):
+                    f.write(text[start:start + 4001])
+                    f.flush()
+                    time.sleep(0.002)
+
+        with open('Python/config.yml', 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+        config.update({'input_filename': growing,
+                       'output_filename': os.path.join(self.tmp, 'live'),
+                       'n_fibers': 2, 'f1greencol': 3, 'f2greencol': 5,
+                       'live_poll_sec': 0.001, 'live_idle_sec': 0.5,
+                       'live_status_sec': 0.2})
+        writer = threading.Thread(target=write_growing)
+        writer.start()
+        result = fpho_live.run_live(config)
+        writer.join()
+
+        session = fpho_setup.import_fpho_data(
+            input_filename=recorded,
+            output_filename=os.path.join(self.tmp, 'my_file_name'),
+            n_fibers=2, f1greencol=3, f2greencol=5, animal_ID='vole1',
+            exp_date='2020-09-01', exp_desc='testing')
+        normData, coefficients = fpho_setup.isosbestic_norm(session)
+
+        live = pd.read_csv(os.path.join(self.tmp, 'live_Live.csv'))
+        self.assertEqual(result['frames'], len(session))
+        self.assertEqual(len(live), len(session))
+        self.assertTrue(np.allclose(live['fTimeGreen'],
+                                    session['fTimeGreen']))
+        self.assertEqual(len(result['drops']), 1)
+        for label in coefficients:
+            self.assertTrue(np.allclose(result['coefficients'][label],
+                                        coefficients[label]))
+            # The last frames are normalized to the same fit
+            self.assertTrue(np.allclose(live[label].values[-10:],
+                                        normData[label][-10:],
+                                        atol=1e-9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Performs unit tests on the functions in fpho_plot.py
+
+    These functions are:
+        new_figure(), save_figure(), render_figure()
+        and render_figures().
+
+"""
+import fpho_plot
+import fpho_setup
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+
+class TestFphoPlot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        time = np.arange(1000, dtype=np.float64)
+        self.jobs = [fpho_plot.figure_job(
+                         fpho_setup.draw_raw_signal,
+                         os.path.join(self.tmp, 'plot' + str(i) + '.png'),
+                         savefig={'bbox_inches': 'tight'},
+                         time_data=time, traces=[np.sin(time / (i + 1))],
+                         channels=['f1RedRed'], l_color='r')
+                     for i in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that a saved figure leaves no temporary file
+    def test_save_figure(self):
+        fig = fpho_plot.new_figure()
+        fig.add_subplot(1, 1, 1).plot([0, 1], [1, 0])
+        filename = os.path.join(self.tmp, 'saved.png')
+        fpho_plot.save_figure(fig, filename)
+        self.assertEqual(os.listdir(self.tmp), ['saved.png'])
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+
+    # Testing that a failed save keeps the old file
+    def test_save_figure_failure(self):
+        filename = os.path.join(self.tmp, 'saved.png')
+        with open(filename, 'w') as f:
+            f.write('old')
+        fig = fpho_plot.new_figure()
+        with self.assertRaises(TypeError):
+            fpho_plot.save_figure(fig, filename, not_an_option=True)
+        self.assertEqual(os.listdir(self.tmp), ['saved.png'])
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), 'old')
+
+    # Testing that each job is drawn in this process or on a pool
+    def test_render_figures(self):
+        for workers in [1, 2]:
+            filenames = fpho_plot.render_figures(self.jobs, workers=workers)
+            self.assertEqual(filenames,
+                             [job['filename'] for job in self.jobs])
+            for filename in filenames:
+                self.assertTrue(os.path.exists(filename))
+                os.remove(filename)
+        self.assertEqual(fpho_plot.render_figures([], workers=0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Performs unit tests on the functions in fpho_profile.py
+
+    These functions are:
+        Profiler.stage(), stage(), start_profiling()
+        and stop_profiling().
+
+"""
+import fpho_profile
+import fpho_config
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import yaml
+import numpy as np
+
+
+class TestFphoProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        fpho_profile.PROFILER = None
+        shutil.rmtree(self.tmp)
+
+    # Testing that stages do nothing while profiling is off
+    def test_stage_off(self):
+        self.assertIsNone(fpho_profile.PROFILER)
+        with fpho_profile.stage('parse'):
+            pass
+        self.assertIs(fpho_profile.stage('parse'), fpho_profile.NO_STAGE)
+
+    # Testing the names, times and memory peaks of nested stages
+    def test_nested_stages(self):
+        profiler = fpho_profile.start_profiling(memory=True)
+        with fpho_profile.stage('import'):
+            with fpho_profile.stage('parse'):
+                data = np.ones(2**21)
+            del data
+            with fpho_profile.stage('write'):
+                pass
+        report = fpho_profile.stop_profiling(os.path.join(self.tmp, 'run'))
+        self.assertIsNone(fpho_profile.PROFILER)
+        self.assertIs(report['stages'], profiler.stages)
+
+        stages = {row['stage']: row for row in report['stages']}
+        self.assertEqual(list(stages),
+                         ['import', 'import/parse', 'import/write'])
+        self.assertGreaterEqual(stages['import']['seconds'],
+                                stages['import/parse']['seconds'])
+        # 16 MB array
+        self.assertGreater(stages['import/parse']['peak_mb'], 16)
+        self.assertLess(stages['import/write']['peak_mb'], 16)
+        self.assertGreater(stages['import']['peak_mb'], 16)
+
+        with open(os.path.join(self.tmp, 'run_Timing.json'), 'r') as f:
+            self.assertEqual(json.load(f)['stages'], report['stages'])
+
+    # Testing that run_config writes the reports only when asked
+    def test_run_config(self):
+        with open('Python/config.yml', 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+        output_filename = os.path.join(self.tmp, 'profiled')
+        config.update({'input_filename': 'Python/SampleData/1fiberSignal.csv',
+                       'output_filename': output_filename,
+                       'plot_raw_signal': False, 'plot_iso_fit': True,
+                       'use_cache': False})
+        fpho_config.run_config(config)
+        self.assertFalse(os.path.exists(output_filename + '_Timing.json'))
+
+        config.update({'profile': True, 'profile_cprofile': True})
+        fpho_config.run_config(config)
+        with open(output_filename + '_Timing.json', 'r') as f:
+            report = json.load(f)
+        self.assertEqual([row['stage'] for row in report['stages']],
+                         ['import_fpho_data', 'import_fpho_data/parse',
+                          'import_fpho_data/write_summary',
+                          'isosbestic_norm', 'isosbestic_norm/normalize',
+                          'render_figures'])
+        self.assertTrue(os.path.exists(output_filename + '_Profile.prof'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Performs unit tests on the functions in fpho_rolling.py
+
+    These functions are:
+        SortedWindow, rolling_order_stats(), rolling_percentile(),
+        rolling_median() and rolling_mad().
+
+"""
+import fpho_rolling
+import unittest
+import numpy as np
+
+
+class TestFphoRolling(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.signals = rng.normal(0, 1, (3, 300))
+        # Repeated values, so removing one copy is checked
+        self.signals[1] = np.round(self.signals[1] * 2)
+
+    # Testing window statistics against numpy on the same values
+    def test_sorted_window(self):
+        values = [3.0, -1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0]
+        window = fpho_rolling.SortedWindow(values)
+        self.assertEqual(window.values, sorted(values))
+        self.assertAlmostEqual(window.percentile(10),
+                               np.percentile(values, 10))
+        self.assertAlmostEqual(window.median(), np.median(values))
+        self.assertAlmostEqual(window.mad(), np.median(
+            np.abs(values - np.median(values))))
+
+        window.remove(4.0)
+        window.add(-7.0)
+        values[2] = -7.0
+        self.assertEqual(window.values, sorted(values))
+        self.assertAlmostEqual(window.mad(), np.median(
+            np.abs(values - np.median(values))))
+
+    # Testing every sample of the rolling statistics, including the
+    # windows cut short at the ends and windows longer than the data
+    def test_rolling_order_stats(self):
+        for window in [1, 4, 21, 1001]:
+            stats = fpho_rolling.rolling_order_stats(
+                self.signals, window, percentiles=[10, 50], mad=True)
+            half = min(window, 599) // 2
+            for channel in range(3):
+                for i in range(300):
+                    values = self.signals[channel,
+                                          max(0, i - half):i + half + 1]
+                    median = np.median(values)
+                    self.assertAlmostEqual(stats[10][channel, i],
+                                           np.percentile(values, 10))
+                    self.assertAlmostEqual(stats[50][channel, i], median)
+                    self.assertAlmostEqual(
+                        stats['mad'][channel, i],
+                        np.median(np.abs(values - median)))
+
+    # Testing the single statistic functions match rolling_order_stats
+    def test_rolling_functions(self):
+        stats = fpho_rolling.rolling_order_stats(
+            self.signals, 31, percentiles=[5, 50], mad=True)
+        self.assertTrue(np.array_equal(
+            fpho_rolling.rolling_percentile(self.signals, 31, 5), stats[5]))
+        self.assertTrue(np.array_equal(
+            fpho_rolling.rolling_median(self.signals, 31), stats[50]))
+        self.assertTrue(np.array_equal(
+            fpho_rolling.rolling_mad(self.signals, 31), stats['mad']))
+        self.assertEqual(
+            fpho_rolling.rolling_median(self.signals[0], 31).shape,
+            (1, 300))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,56 @@
 """Performs unit tests on the functions in fpho_setup.py
 
     These functions are:
-        import_fpho_data(), raw_signal_trace(), fit_exp(),
-        plot_isosbestic_norm(), and plot_fitted_exp().
+        read_fpho_columns(), stream_fpho_data(), check_column_map(),
+        split_label(),
+        align_frames(), import_fpho_data(), resample_session(),
+        load_summary(), minmax_envelope(), select_raw_channels(),
+        raw_signal_trace(), fit_exp(), fit_bleaching(),
+        window_samples(), rolling_fit(), isosbestic_norm(),
+        plot_isosbestic_norm(), percentile_dff(), plot_percentile_dff()
+        and plot_fitted_exp().
 
 """
 import fpho_setup
+import fpho_session
+import fpho_synthetic
 import unittest
 import random
 import sys
 import pandas as pd
+import numpy as np
 import os.path
+import tempfile
 from os import path
 
 
 class TestFphoSetup(unittest.TestCase):
 
+    # Testing that comma and repeated whitespace delimiters
+    # give the same columns as the single space Bonsai format
+    def test_read_fpho_columns(self):
+        data = fpho_setup.read_fpho_columns('Python/TestData'
+                                            '/1FiberTesting.csv')
+        self.assertEqual(data.shape, (258, 4))
+        self.assertEqual(data[0, 2], 1879.10306148701)
+
+        with open('Python/TestData/1FiberTesting.csv', 'r') as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmp:
+            comma_file = os.path.join(tmp, 'comma.csv')
+            with open(comma_file, 'w') as f:
+                for line in lines:
+                    f.write(line.rstrip().replace(' ', ', ') + ',\n')
+            self.assertTrue((fpho_setup.read_fpho_columns(comma_file)
+                             == data).all())
+
+            space_file = os.path.join(tmp, 'space.csv')
+            with open(space_file, 'w') as f:
+                for line in lines:
+                    f.write(line.rstrip().replace(' ', '   ') + '  \n')
+            self.assertTrue((fpho_setup.read_fpho_columns(space_file)
+                             == data).all())
+
     # Testing the normal functioning of import_fpho_data()
     def test_import_fpho_data(self):
         df = fpho_setup.import_fpho_data(input_filename='Python/TestData'
@@ -29,13 +64,237 @@ class TestFphoSetup(unittest.TestCase):
                                          write_xlsx=False)
 
         test_green_iso = [1640.48859543818, 1640.90076030412]
-        self.assertEqual(df['f1GreenIso'].values[0], test_green_iso)
+        self.assertEqual(df['f1GreenIso'].tolist(), test_green_iso)
 
         test_green_green = [1511.23969587835, 1511.07482993197]
-        self.assertEqual(df['f1GreenGreen'].values[0], test_green_green)
+        self.assertEqual(df['f1GreenGreen'].tolist(), test_green_green)
 
         test_red_iso = [1536.2730469085, 1536.54499614098]
-        self.assertEqual(df['f1RedIso'].values[0], test_red_iso)
+        self.assertEqual(df['f1RedIso'].tolist(), test_red_iso)
+
+    # Testing that streamed blocks join to the whole-file channels
+    # and keep the interleave phase found in the first block
+    def test_stream_fpho_data(self):
+        blocks = list(fpho_setup.stream_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            n_fibers=2, f1greencol=3, f2greencol=5, block_frames=100))
+        self.assertEqual(len(blocks), 34)
+        self.assertEqual(len(blocks[0]['f2RedRed']), 100)
+
+        whole = list(fpho_setup.stream_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            n_fibers=2, f1greencol=3, f2greencol=5))
+        self.assertEqual(len(whole), 1)
+        for name in whole[0].columns:
+            joined = np.concatenate([block[name] for block in blocks])
+            self.assertTrue((joined == whole[0][name]).all())
+
+    # Testing that the session holds channels as views of
+    # contiguous arrays, with float32 storage on request
+    def test_import_fpho_data_session(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=2, f1greencol=3,
+            f2greencol=5, animal_ID='vole1', exp_date='2020-09-01',
+            exp_desc='testing', dtype='float32')
+        self.assertEqual(session.n_fibers, 2)
+        self.assertEqual(session.signals.shape, (12, 3382))
+        self.assertEqual(session.signals.dtype, np.float32)
+        self.assertEqual(session.times.dtype, np.float64)
+        self.assertEqual(session.animalID, 'vole1')
+        self.assertTrue(session.signals.flags['C_CONTIGUOUS'])
+
+        green = session.fiber(2, 'Green')
+        self.assertTrue(np.shares_memory(green, session.signals))
+        self.assertTrue((green[2] == session['f2GreenGreen']).all())
+        with self.assertRaises(AttributeError):
+            session.extra = 1
+
+    # Testing that columnar summaries load back into the same session
+    @unittest.skipIf(fpho_setup.pa is None, 'needs pyarrow')
+    def test_load_summary(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output_filename = os.path.join(tmp, 'my_file_name')
+            for summary_format in ['parquet', 'feather']:
+                session = fpho_setup.import_fpho_data(
+                    input_filename='Python/SampleData/2fiberSignal.csv',
+                    output_filename=output_filename, n_fibers=2,
+                    f1greencol=3, f2greencol=5, animal_ID='vole1',
+                    exp_date='2020-09-01', exp_desc='testing',
+                    summary_format=summary_format)
+                loaded = fpho_setup.load_summary(
+                    output_filename + '_Summary.' + summary_format)
+                self.assertEqual(loaded.names, session.names)
+                self.assertEqual(loaded.description, 'testing')
+                self.assertTrue((loaded.signals == session.signals).all())
+                self.assertTrue((loaded.times == session.times).all())
+
+    # Testing that a column map gives the f1greencol/f2greencol
+    # channels and imports any number of fibers
+    def test_import_column_map(self):
+        blocks = fpho_setup.stream_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            n_fibers=2, f1greencol=None,
+            column_map={'f1Green': 3, 'f1Red': 4, 'f2Red': 6, 'f2Green': 5})
+        legacy = fpho_setup.stream_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            n_fibers=2, f1greencol=3, f2greencol=5)
+        for block, legacy_block in zip(blocks, legacy):
+            self.assertEqual(block.names, legacy_block.names)
+            self.assertTrue((block.signals == legacy_block.signals).all())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            recording = fpho_synthetic.write_recording(tmp, 'synthetic', 2,
+                                                       n_fibers=4, phase=1)
+            session = fpho_setup.import_fpho_data(
+                input_filename=recording['input_filename'],
+                output_filename=os.path.join(tmp, 'my_file_name'),
+                n_fibers=4, f1greencol=None, animal_ID='vole1',
+                exp_date='2020-09-01', exp_desc='testing',
+                column_map=recording['column_map'])
+        self.assertEqual(session.n_fibers, 4)
+        # 2 header lines and 250 trimmed rows, then Iso on the next row
+        self.assertEqual(session.signals.shape,
+                         (24, (2*60*40 - 2 - 250 - 1) // 3))
+        self.assertTrue(session.signals.flags['C_CONTIGUOUS'])
+        # Iso is the brightest slot in the green column of every fiber
+        for fiber in range(1, 5):
+            green = session.fiber(fiber, 'Green').mean(axis=1)
+            self.assertEqual(np.argmax(green), 0)
+
+    # Testing that fibers numbered 10 and up are named, plotted and
+    # titled by their whole number
+    def test_ten_fibers(self):
+        self.assertEqual(fpho_setup.split_label('f10RedRed'), ('f10', 'Red'))
+        with tempfile.TemporaryDirectory() as tmp:
+            recording = fpho_synthetic.write_recording(tmp, 'synthetic', 1,
+                                                       n_fibers=10)
+            output_filename = os.path.join(tmp, 'my_file_name')
+            session = fpho_setup.import_fpho_data(
+                input_filename=recording['input_filename'],
+                output_filename=output_filename, n_fibers=10,
+                f1greencol=None, animal_ID='vole1', exp_date='2020-09-01',
+                exp_desc='testing', column_map=recording['column_map'])
+            self.assertEqual(session.n_fibers, 10)
+
+            fpho_setup.raw_signal_trace(session, output_filename,
+                                        channels=['f10Red', 'f1Green'])
+            self.assertTrue(path.exists(output_filename
+                                        + '_RawSignal_f10Red.png'))
+            jobs = fpho_setup.raw_signal_figures(session, output_filename,
+                                                 ['f10Red'])
+            self.assertEqual(jobs[0]['kwargs']['channels'], ['f10RedRed'])
+
+        jobs = fpho_setup.isosbestic_norm_figures(session, 'my_file_name')
+        titles = [job['kwargs']['title'] for job in jobs]
+        self.assertEqual(titles[-1], 'f10 Red Normalized to Isosbestic')
+
+    # Testing that frames follow the frame counter across drops
+    def test_stream_fpho_data_drops(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_filename = os.path.join(tmp, 'dropped.csv')
+            fpho_synthetic.write_bonsai_signal(
+                input_filename, 3, n_fibers=2, phase=1,
+                drop_rows=[1000, 2001, 2002, 3000, 3001, 3002])
+            for block_frames in [50, fpho_setup.BLOCK_FRAMES]:
+                drops = []
+                blocks = list(fpho_setup.stream_fpho_data(
+                    input_filename, 2, 3, f2greencol=5,
+                    block_frames=block_frames, drops=drops))
+                self.assertEqual([drop['missing_frames'] for drop in drops],
+                                 [1, 2, 3])
+                # Rows 0 and 1 of the file are not data rows
+                self.assertEqual([drop['row'] for drop in drops],
+                                 [998, 1998, 2995])
+                # Iso is the brightest slot in the green column after
+                # every drop
+                last = blocks[-1].fiber(2, 'Green').mean(axis=1)
+                self.assertEqual(np.argmax(last), 0)
+
+            session = fpho_setup.import_fpho_data(
+                input_filename=input_filename,
+                output_filename=os.path.join(tmp, 'my_file_name'),
+                n_fibers=2, f1greencol=3, f2greencol=5, animal_ID='vole1',
+                exp_date='2020-09-01', exp_desc='testing')
+            report = pd.read_csv(os.path.join(tmp,
+                                              'my_file_name_Drops.csv'))
+            self.assertEqual(list(report['missing_frames']), [1, 2, 3])
+            # Frames start at rows 253, 256, ... 7195 after trimming,
+            # the frames of rows 1000, 2001, 2002, 3000 and 3001 miss
+            # a color
+            self.assertEqual(len(session), (7195 - 253) // 3 + 1 - 5)
+
+    # Testing that the colors are found again when a drop shifts
+    # them against the frame counter
+    def test_align_frames_shifted(self):
+        rng = np.random.default_rng(0)
+        rows = fpho_synthetic.signal_block(0, 3000, 1, 0, np.empty(0), rng)
+        # Row 1500 is lost, but the counter skips 2 frames
+        rows = np.delete(rows, 1500, axis=0)
+        rows[1500:, 1] = fpho_synthetic.cycle_timer(
+            fpho_setup.counter_ticks(rows[1500:, 1])
+            + fpho_synthetic.COUNTER_TICKS)
+        drops = []
+        frames = np.concatenate(list(fpho_setup.align_frames(
+            [rows[:1000], rows[1000:]], drops=drops)))
+        self.assertEqual(drops[0]['row'], 1500)
+        self.assertEqual(drops[0]['missing_frames'], 2)
+        self.assertTrue(drops[0]['shifted'])
+        self.assertEqual(frames.shape[1], 3)
+        green = frames.reshape(-1, 3, 3)[:, :, 1]
+        self.assertTrue((np.argmax(green, axis=1) == 0).mean() > 0.99)
+
+    # Testing invalid column maps
+    def test_check_column_map_errors(self):
+        for column_map, n_fibers in [({}, None),
+                                     ({'f1Green': 3, 'f1Blue': 4}, None),
+                                     ({'f1Green': 3, 'f1Red': 7}, None),
+                                     ({'f1Green': 3, 'f1Red': 3}, None),
+                                     ({'f1Green': 3, 'f1Red': 4,
+                                       'f3Green': 5, 'f3Red': 6}, None),
+                                     ({'f1Green': 3, 'f1Red': 4}, 2)]:
+            with self.assertRaises(SystemExit) as cm:
+                fpho_setup.check_column_map(column_map, 6,
+                                            n_fibers=n_fibers)
+            self.assertEqual(cm.exception.code, 1)
+
+    # Testing that resampling puts every channel on one uniform grid,
+    # linearly interpolated from its own clock
+    def test_resample_session(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=2, f1greencol=3,
+            f2greencol=5, animal_ID='vole1', exp_date='2020-09-01',
+            exp_desc='testing', dtype='float32')
+        resampled = fpho_setup.resample_session(session)
+        self.assertEqual(resampled.names, session.names)
+        self.assertEqual(resampled.signals.dtype, np.float32)
+        grid = resampled['fTimeGreen']
+        self.assertTrue(np.array_equal(resampled['fTimeIso'], grid))
+        self.assertTrue(np.allclose(np.diff(grid), np.diff(grid)[0]))
+        for name, timeName in [('f1GreenIso', 'fTimeIso'),
+                               ('f2RedRed', 'fTimeRed'),
+                               ('f2GreenGreen', 'fTimeGreen')]:
+            self.assertTrue(np.allclose(
+                resampled[name],
+                np.interp(grid, session[timeName], session[name])))
+
+        # Components above the output Nyquist frequency are filtered
+        # out instead of aliasing
+        time = session.times
+        slow = np.sin(2 * np.pi * 0.2 * time / 1000)
+        fast = np.sin(2 * np.pi * 3.5 * time / 1000)
+        signals = np.tile(slow + fast, (session.n_fibers * 2, 1))
+        waves = fpho_session.Session(signals, time, session.names)
+        decimated = fpho_setup.resample_session(waves, rate=2)
+        self.assertTrue(np.allclose(np.diff(decimated['fTimeRed']), 500))
+        expected = np.sin(2 * np.pi * 0.2 * decimated['fTimeRed'] / 1000)
+        self.assertTrue(np.allclose(decimated['f1RedRed'][20:-20],
+                                    expected[20:-20], atol=0.05))
+
+        with self.assertRaises(SystemExit) as cm:
+            fpho_setup.resample_session(session, rate=-1)
+        self.assertEqual(cm.exception.code, 1)
 
     # Testing FileNotFound error for import_fpho_data()
     def test_import_fpho_data_errors(self):
@@ -60,9 +319,46 @@ class TestFphoSetup(unittest.TestCase):
         self.assertEqual(0.7357588823428847, fit[0])
         self.assertEqual(9.079985952496971e-05, fit[3])
 
+    # Testing that fit_bleaching() recovers a known double exponential
+    # and starts time at 0, with and without the coarse fit
+    def test_fit_bleaching(self):
+        time = 1000.0 + np.arange(20000) * 75.0
+        params = (200.0, -1 / 3e5, 500.0, -1 / 1e7)
+        signal = fpho_setup.fit_exp(time - time[0], *params)
+        for coarse_points in [None, 2000]:
+            result = fpho_setup.fit_bleaching(time, signal,
+                                              coarse_points=coarse_points)
+            self.assertTrue(np.allclose(result['params'], params,
+                                        rtol=1e-4))
+            self.assertEqual(result['time'][0], 0)
+            self.assertTrue(np.allclose(result['detrended'], 0, atol=1e-6))
+            self.assertTrue(np.allclose(result['fit'] + result['detrended'],
+                                        signal))
+
+    # Testing that minmax_envelope() keeps the min and max of every bin
+    def test_minmax_envelope(self):
+        rng = np.random.default_rng(0)
+        time = np.arange(10005.0)
+        values = rng.normal(size=10005)
+        values[1234] = 50
+        envTime, envValues = fpho_setup.minmax_envelope(time, values, 100)
+        self.assertEqual(len(envValues), 2 * 100)
+        self.assertTrue((np.diff(envTime) >= 0).all())
+        self.assertEqual(envValues.max(), 50)
+        self.assertEqual(envValues.min(), values.min())
+        self.assertTrue(np.array_equal(values[envTime.astype(int)],
+                                       envValues))
+        # 101 samples per bin, the last bin is partial
+        self.assertEqual(envValues[:2].tolist(),
+                         sorted([values[:101].min(), values[:101].max()],
+                                key=list(values[:101]).index))
+
+        envTime, envValues = fpho_setup.minmax_envelope(time[:150],
+                                                        values[:150], 100)
+        self.assertEqual(len(envValues), 150)
+
     # Checking that the correct file is created from running
-    # raw_signal_trace() - Must use a correct user
-    # input for raw_signal_trace() - (f1Red, f2Red, f1Green, and/or f2Green)
+    # raw_signal_trace() for one channel and for all channels
     def test_raw_signal_trace(self):
         df_test = fpho_setup.import_fpho_data(input_filename='Python/TestData'
                                               '/1FiberTesting.csv',
@@ -74,15 +370,43 @@ class TestFphoSetup(unittest.TestCase):
                                               f2greencol=None,
                                               write_xlsx=False)
 
-        fpho_setup.raw_signal_trace(fpho_dataframe=df_test,
+        fpho_setup.raw_signal_trace(session=df_test,
                                     output_filename='testing_unit',
-                                    data_row_index=0)
+                                    channels='f1Red')
         self.assertTrue(path.exists('testing_unit_RawSignal_f1Red.png'))
+        self.assertFalse(path.exists('testing_unit_RawSignal_f1Green.png'))
+
+        fpho_setup.raw_signal_trace(session=df_test,
+                                    output_filename='testing_unit_all')
+        self.assertTrue(path.exists('testing_unit_all_RawSignal_f1Red.png'))
+        self.assertTrue(path.exists('testing_unit_all_RawSignal_f1Green'
+                                    '.png'))
+
+    # Checking that select_raw_channels() reads lists, separated
+    # strings and all
+    def test_select_raw_channels(self):
+        df_test = fpho_setup.import_fpho_data(input_filename='Python/TestData'
+                                              '/1FiberTesting.csv',
+                                              output_filename='my_file_name',
+                                              n_fibers=1, f1greencol=3,
+                                              animal_ID='vole1',
+                                              exp_date='2020-09-01',
+                                              exp_desc="testing",
+                                              f2greencol=None,
+                                              write_xlsx=False)
+        self.assertEqual(fpho_setup.select_raw_channels(df_test, 'all'),
+                         ['f1Red', 'f1Green'])
+        self.assertEqual(fpho_setup.select_raw_channels(df_test,
+                                                        'f1Green, f1Red'),
+                         ['f1Red', 'f1Green'])
+        self.assertEqual(fpho_setup.select_raw_channels(df_test,
+                                                        ['f1Green']),
+                         ['f1Green'])
 
     # Checking the error handling of raw_signal_trace()
-    # using an incorrect user input
-    # i.e. input something other than
-    # f1Red, f2Red, f1Green or f2Green when prompted
+    # using an incorrect channel
+    # i.e. something other than
+    # f1Red, f2Red, f1Green, f2Green or all
     def test_raw_signal_trace_errors(self):
         df_test = fpho_setup.import_fpho_data(input_filename='Python/TestData'
                                               '/1FiberTesting.csv',
@@ -93,12 +417,12 @@ class TestFphoSetup(unittest.TestCase):
                                               exp_desc="testing",
                                               f2greencol=None,
                                               write_xlsx=False)
-        with self.assertRaises(SystemExit) as cm:
-            # Use the user input: userinputfailure
-            fpho_setup.raw_signal_trace(fpho_dataframe=df_test,
-                                        output_filename='testing_unit.png',
-                                        data_row_index=0)
-        self.assertEqual(cm.exception.code, 1)
+        for channels in ['userinputfailure', 'f2Red', []]:
+            with self.assertRaises(SystemExit) as cm:
+                fpho_setup.raw_signal_trace(session=df_test,
+                                            output_filename='testing_unit',
+                                            channels=channels)
+            self.assertEqual(cm.exception.code, 1)
 
     # Checking that the correct file is created from running
     # plot_isosbestic_norm
@@ -112,11 +436,99 @@ class TestFphoSetup(unittest.TestCase):
                                               exp_desc="testing",
                                               f2greencol=None,
                                               write_xlsx=False)
-        fpho_setup.plot_isosbestic_norm(fpho_dataframe=df_test,
+        fpho_setup.plot_isosbestic_norm(session=df_test,
                                         output_filename='my_file_name')
         self.assertTrue(path.exists('my_file_name_f1GreenNormIso.png'))
         self.assertTrue(path.exists('my_file_name_f1RedNormIso.png'))
 
+    # Testing that every fiber and color is normalized with the
+    # same fit np.polyfit gives
+    def test_isosbestic_norm(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/2fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=2, f1greencol=3,
+            f2greencol=5, animal_ID='vole1', exp_date='2020-09-01',
+            exp_desc='testing')
+        normData, coefficients = fpho_setup.isosbestic_norm(session)
+        self.assertEqual(list(normData),
+                         ['f1Green', 'f1Red', 'f2Green', 'f2Red'])
+
+        a, b = np.polyfit(session['f2RedIso'], session['f2RedRed'], 1)
+        self.assertAlmostEqual(coefficients['f2Red'][0], a)
+        self.assertAlmostEqual(coefficients['f2Red'][1], b)
+        controlFit = a * session['f2RedIso'] + b
+        self.assertTrue(np.allclose(normData['f2Red'],
+                                    (session['f2RedRed'] - controlFit)
+                                    / controlFit))
+
+    # Testing that the sliding-window fit matches np.polyfit on the
+    # window around a sample, including the shortened windows at the ends
+    def test_rolling_fit(self):
+        rng = np.random.default_rng(0)
+        iso = rng.normal(10, 1, (2, 200))
+        sig = 3 * iso + 5 + rng.normal(0, 1, (2, 200))
+        a, b = fpho_setup.rolling_fit(iso, sig, 21)
+        self.assertEqual(a.shape, (2, 200))
+        for i in [0, 5, 10, 100, 195, 199]:
+            lo, hi = max(0, i - 10), min(200, i + 11)
+            ref = np.polyfit(iso[1, lo:hi], sig[1, lo:hi], 1)
+            self.assertTrue(np.allclose([a[1, i], b[1, i]], ref))
+
+        # A window longer than the recording is one global fit
+        a, b = fpho_setup.rolling_fit(iso, sig, 1001)
+        ref = np.polyfit(iso[0], sig[0], 1)
+        self.assertTrue(np.allclose(a[0], ref[0]))
+        self.assertTrue(np.allclose(b[0], ref[1]))
+
+    # Testing the windowed normalization on a session and its window check
+    def test_isosbestic_norm_window(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/1fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=1, f1greencol=3,
+            animal_ID='vole1', exp_date='2020-09-01', exp_desc='testing')
+        window = fpho_setup.window_samples(session, 10)
+        self.assertEqual(window % 2, 1)
+        normData, coefficients = fpho_setup.isosbestic_norm(session,
+                                                            window_sec=10)
+        a, b = coefficients['f1Green']
+        self.assertEqual(len(a), len(session))
+        controlFit = a * session['f1GreenIso'] + b
+        self.assertTrue(np.allclose(normData['f1Green'],
+                                    (session['f1GreenGreen'] - controlFit)
+                                    / controlFit))
+
+        with self.assertRaises(SystemExit) as cm:
+            fpho_setup.window_samples(session, 'soon')
+        self.assertEqual(cm.exception.code, 1)
+
+    # Testing dF/F to the rolling percentile of each signal, its plots
+    # and the percentile check
+    def test_percentile_dff(self):
+        session = fpho_setup.import_fpho_data(
+            input_filename='Python/SampleData/1fiberSignal.csv',
+            output_filename='my_file_name', n_fibers=1, f1greencol=3,
+            animal_ID='vole1', exp_date='2020-09-01', exp_desc='testing')
+        dff, baseline = fpho_setup.percentile_dff(session, window_sec=5,
+                                                  percentile=10)
+        self.assertEqual(list(dff), ['f1Green', 'f1Red'])
+
+        half = fpho_setup.window_samples(session, 5) // 2
+        values = session['f1RedRed'][1000 - half:1000 + half + 1]
+        self.assertAlmostEqual(baseline['f1Red'][1000],
+                               np.percentile(values, 10))
+        self.assertTrue(np.allclose(dff['f1Red'],
+                                    session['f1RedRed'] / baseline['f1Red']
+                                    - 1))
+
+        fpho_setup.plot_percentile_dff(session, 'my_file_name',
+                                       window_sec=5)
+        self.assertTrue(path.exists('my_file_name_f1GreenDFF.png'))
+        self.assertTrue(path.exists('my_file_name_f1RedDFF.png'))
+
+        with self.assertRaises(SystemExit) as cm:
+            fpho_setup.percentile_dff(session, percentile=110)
+        self.assertEqual(cm.exception.code, 1)
+
     # Checking that the correct file is created from running
     # plot_fitted_exp
     def test_plot_fitted_exp(self):
@@ -129,7 +541,7 @@ class TestFphoSetup(unittest.TestCase):
                                               exp_desc="testing",
                                               f2greencol=None,
                                               write_xlsx=False)
-        fpho_setup.plot_fitted_exp(fpho_dataframe=df_test,
+        fpho_setup.plot_fitted_exp(session=df_test,
                                    output_filename='my_file_name')
         self.assertTrue(path.exists('my_file_name_f1GreenNormExp.png'))
         self.assertTrue(path.exists('my_file_name_f1RedNormExp.png'))
@@ -0,0 +1,95 @@
+"""Performs unit tests on the functions in fpho_synthetic.py
+
+    These functions are:
+        transient_trace(), write_bonsai_signal() and
+        write_recording().
+
+"""
+import fpho_synthetic
+import fpho_setup
+import behavior_setup
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+
+class TestFphoSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Testing that a transient peaks at the amplitude after the delay
+    def test_transient_trace(self):
+        amplitude, rise, decay, delay = fpho_synthetic.TRANSIENT
+        time = np.arange(0, 30, 0.001)
+        trace = fpho_synthetic.transient_trace(time, np.array([10.0]))
+        self.assertAlmostEqual(trace.max(), amplitude, places=5)
+        self.assertTrue((trace[time < 10 + delay] == 0).all())
+        self.assertTrue((trace[(time > 10 + delay)
+                               & (time < 10 + delay + 10 * decay)] > 0)
+                        .all())
+
+        # Blocks see the transients of events before them
+        block = fpho_synthetic.transient_trace(time[12000:],
+                                               np.array([10.0]))
+        self.assertTrue(np.allclose(block, trace[12000:]))
+
+    # Testing the column layout, frame counter and interleave phase
+    def test_write_bonsai_signal(self):
+        filename = os.path.join(self.tmp, 'signal.csv')
+        for phase in [0, 1, 2]:
+            n_rows = fpho_synthetic.write_bonsai_signal(
+                filename, 5, n_fibers=2, phase=phase, block_rows=1000)
+            self.assertEqual(n_rows, 5 * 60 * fpho_synthetic.ROW_RATE)
+            data = fpho_setup.read_fpho_columns(filename)
+            self.assertEqual(data.shape, (n_rows - 2, 6))
+            self.assertTrue((np.diff(data[:, 0]) > 0).all())
+            # The counter is a cycle timer, wrapping every 128 sec
+            ticks = (np.diff(fpho_setup.counter_ticks(data[:, 1]))
+                     % fpho_setup.COUNTER_WRAP)
+            self.assertTrue((abs(ticks - fpho_synthetic.COUNTER_TICKS)
+                             < 1000).all())
+            self.assertTrue((np.diff(data[:, 1]) < 0).any())
+
+            # Rows 0 and 1 of the file are not data rows, so row 250
+            # of data is row 252 of the file
+            slots = fpho_setup.interleave_slots(data[250:, 2])
+            self.assertEqual(slots['Iso'], phase)
+
+        with self.assertRaises(SystemExit) as cm:
+            fpho_synthetic.write_bonsai_signal(filename, 1, phase=3)
+        self.assertEqual(cm.exception.code, 1)
+
+    # Testing that behavior events line up with the signal clock
+    def test_write_recording(self):
+        recording = fpho_synthetic.write_recording(self.tmp, 'synthetic',
+                                                   20, n_fibers=2)
+        session = fpho_setup.import_fpho_data(
+            recording['input_filename'], os.path.join(self.tmp, 'out'),
+            recording['n_fibers'], recording['f1greencol'], 'vole1',
+            '2020-10-12', 'synthetic', f2greencol=recording['f2greencol'])
+        self.assertEqual(session.n_fibers, 2)
+
+        behaviorData = behavior_setup.import_behavior_data(
+            recording['BORIS_file'], recording['timestamp_file'])
+        self.assertEqual(len(behaviorData), len(recording['event_msec']))
+        self.assertTrue(np.allclose(behaviorData['Time (total msec)'],
+                                    recording['event_msec'], atol=3))
+
+        # Transients follow the events in Green but not Iso rows
+        results = behavior_setup.zscore_results(
+            session, behaviorData, channels=['f1GreenGreen', 'f1GreenIso'],
+            behaviors=['Walking'])
+        green = results[('f1GreenGreen', 'Walking')]['mean']
+        iso = results[('f1GreenIso', 'Walking')]['mean']
+        self.assertGreater(green.max(), 0.5)
+        self.assertLess(abs(iso).max(), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()